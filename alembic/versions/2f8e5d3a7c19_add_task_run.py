@@ -0,0 +1,34 @@
+"""Add task run
+
+Revision ID: 2f8e5d3a7c19
+Revises: e7a94b1c2f60
+Create Date: 2026-10-18 13:20:05.117602
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "2f8e5d3a7c19"
+down_revision = "e7a94b1c2f60"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "task_run",
+        sa.Column("key", sa.String(255), primary_key=True),
+        sa.Column("parent_key", sa.String(255), nullable=True, index=True),
+        sa.Column("status", sa.String(20), nullable=False),
+        sa.Column("summary", sa.JSON(), nullable=True),
+        sa.Column(
+            "created_at", sa.TIMESTAMP(timezone=True), server_default=sa.func.now()
+        ),
+        sa.Column("finished_at", sa.TIMESTAMP(timezone=True), nullable=True),
+        schema="deneb",
+    )
+
+
+def downgrade():
+    op.drop_table("task_run", schema="deneb")
@@ -0,0 +1,25 @@
+"""Add artist release marks
+
+Revision ID: 4b1e6f0a9d27
+Revises: c5a2efda32eb
+Create Date: 2026-10-18 10:12:41.502871
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "4b1e6f0a9d27"
+down_revision = "c5a2efda32eb"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "artist", sa.Column("release_marks", sa.JSON(), nullable=True), schema="deneb"
+    )
+
+
+def downgrade():
+    op.drop_column("artist", "release_marks", schema="deneb")
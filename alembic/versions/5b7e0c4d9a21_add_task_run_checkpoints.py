@@ -0,0 +1,37 @@
+"""Add task run checkpoints
+
+Revision ID: 5b7e0c4d9a21
+Revises: 2f8e5d3a7c19
+Create Date: 2026-10-18 14:02:41.530218
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5b7e0c4d9a21"
+down_revision = "2f8e5d3a7c19"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("task_run", sa.Column("users_ids", sa.JSON()), schema="deneb")
+    op.add_column(
+        "task_run",
+        sa.Column("claimed_at", sa.TIMESTAMP(timezone=True), nullable=True),
+        schema="deneb",
+    )
+    op.create_table(
+        "task_run_user",
+        sa.Column("run_key", sa.String(255), primary_key=True),
+        sa.Column("user_id", sa.Integer, primary_key=True),
+        sa.Column("finished_at", sa.TIMESTAMP(timezone=True), nullable=True),
+        schema="deneb",
+    )
+
+
+def downgrade():
+    op.drop_table("task_run_user", schema="deneb")
+    op.drop_column("task_run", "claimed_at", schema="deneb")
+    op.drop_column("task_run", "users_ids", schema="deneb")
@@ -0,0 +1,43 @@
+"""Add artist sync job
+
+Revision ID: 8d1f6a3b2e07
+Revises: 5b7e0c4d9a21
+Create Date: 2026-10-18 15:11:09.274816
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8d1f6a3b2e07"
+down_revision = "5b7e0c4d9a21"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "artist_sync_job",
+        sa.Column(
+            "artist_id",
+            sa.Integer,
+            sa.ForeignKey("deneb.artist.id", ondelete="CASCADE"),
+            primary_key=True,
+        ),
+        sa.Column("priority", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("due_at", sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column("leased_until", sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column("attempts", sa.Integer, nullable=False, server_default="0"),
+        schema="deneb",
+    )
+    op.create_index(
+        "artist_sync_job_due_idx",
+        "artist_sync_job",
+        [sa.text("priority DESC"), "due_at"],
+        schema="deneb",
+    )
+
+
+def downgrade():
+    op.drop_index("artist_sync_job_due_idx", "artist_sync_job", schema="deneb")
+    op.drop_table("artist_sync_job", schema="deneb")
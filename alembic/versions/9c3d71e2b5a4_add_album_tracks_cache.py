@@ -0,0 +1,30 @@
+"""Add album tracks cache
+
+Revision ID: 9c3d71e2b5a4
+Revises: 4b1e6f0a9d27
+Create Date: 2026-10-18 11:02:17.318245
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "9c3d71e2b5a4"
+down_revision = "4b1e6f0a9d27"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "album_tracks_cache",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("spotify_id", sa.String(25), unique=True, nullable=False),
+        sa.Column("data", sa.JSON(), nullable=False),
+        sa.Column("fetched_at", sa.TIMESTAMP(timezone=True), nullable=False),
+        schema="deneb",
+    )
+
+
+def downgrade():
+    op.drop_table("album_tracks_cache", schema="deneb")
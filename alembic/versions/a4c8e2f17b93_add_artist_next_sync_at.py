@@ -0,0 +1,25 @@
+"""Add artist next sync at
+
+Revision ID: a4c8e2f17b93
+Revises: 8d1f6a3b2e07
+Create Date: 2026-10-18 15:48:27.903145
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "a4c8e2f17b93"
+down_revision = "8d1f6a3b2e07"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "artist", sa.Column("next_sync_at", sa.DateTime, nullable=True), schema="deneb"
+    )
+
+
+def downgrade():
+    op.drop_column("artist", "next_sync_at", schema="deneb")
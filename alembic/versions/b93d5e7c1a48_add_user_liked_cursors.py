@@ -0,0 +1,25 @@
+"""Add user liked cursors
+
+Revision ID: b93d5e7c1a48
+Revises: a4c8e2f17b93
+Create Date: 2026-10-18 16:35:52.118604
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "b93d5e7c1a48"
+down_revision = "a4c8e2f17b93"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "user", sa.Column("liked_cursors", sa.JSON(), nullable=True), schema="deneb"
+    )
+
+
+def downgrade():
+    op.drop_column("user", "liked_cursors", schema="deneb")
@@ -0,0 +1,64 @@
+"""Add liked track index and playlist mirror
+
+Revision ID: c2e7f4a9d615
+Revises: b93d5e7c1a48
+Create Date: 2026-10-18 17:24:13.640291
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "c2e7f4a9d615"
+down_revision = "b93d5e7c1a48"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "liked_track",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column(
+            "user_id",
+            sa.Integer,
+            sa.ForeignKey("deneb.user.id", ondelete="CASCADE"),
+            nullable=False,
+        ),
+        sa.Column("spotify_id", sa.String(255), nullable=False),
+        sa.Column("name", sa.String(255), nullable=False),
+        sa.Column("artists", sa.JSON(), nullable=False),
+        sa.Column("release_year", sa.String(4), nullable=False),
+        sa.Column("added_at", sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.UniqueConstraint("user_id", "spotify_id"),
+        schema="deneb",
+    )
+    op.create_index(
+        "liked_track_user_added_at",
+        "liked_track",
+        ["user_id", "added_at"],
+        schema="deneb",
+    )
+    op.create_table(
+        "playlist_mirror",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column(
+            "user_id",
+            sa.Integer,
+            sa.ForeignKey("deneb.user.id", ondelete="CASCADE"),
+            nullable=False,
+        ),
+        sa.Column("year", sa.String(4), nullable=False),
+        sa.Column("playlist_id", sa.String(255), nullable=False),
+        sa.Column("snapshot_id", sa.String(255), nullable=True),
+        sa.Column("tracks_ids", sa.JSON(), nullable=False),
+        sa.Column("updated_at", sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.UniqueConstraint("user_id", "year"),
+        schema="deneb",
+    )
+
+
+def downgrade():
+    op.drop_table("playlist_mirror", schema="deneb")
+    op.drop_index("liked_track_user_added_at", "liked_track", schema="deneb")
+    op.drop_table("liked_track", schema="deneb")
@@ -0,0 +1,27 @@
+"""Add user follows fingerprint
+
+Revision ID: d8a3f1c6e952
+Revises: c2e7f4a9d615
+Create Date: 2026-10-18 19:12:40.503817
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "d8a3f1c6e952"
+down_revision = "c2e7f4a9d615"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "user",
+        sa.Column("follows_fingerprint", sa.String(64), nullable=True),
+        schema="deneb",
+    )
+
+
+def downgrade():
+    op.drop_column("user", "follows_fingerprint", schema="deneb")
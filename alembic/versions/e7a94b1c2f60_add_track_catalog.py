@@ -0,0 +1,44 @@
+"""Add track catalog
+
+Revision ID: e7a94b1c2f60
+Revises: 9c3d71e2b5a4
+Create Date: 2026-10-18 11:48:53.904127
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "e7a94b1c2f60"
+down_revision = "9c3d71e2b5a4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "album", sa.Column("catalog", sa.JSON(), nullable=True), schema="deneb"
+    )
+
+    op.create_table(
+        "track",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column(
+            "album_id",
+            sa.Integer,
+            sa.ForeignKey("deneb.album.id", ondelete="CASCADE"),
+            nullable=False,
+        ),
+        sa.Column("spotify_id", sa.String(25), nullable=False),
+        sa.Column("name", sa.String(255), nullable=False),
+        sa.Column("artists", sa.JSON(), nullable=False),
+        sa.Column("popularity", sa.Integer, nullable=True),
+        sa.Column("position", sa.Integer, nullable=False),
+        sa.UniqueConstraint("album_id", "spotify_id"),
+        schema="deneb",
+    )
+
+
+def downgrade():
+    op.drop_table("track", schema="deneb")
+    op.drop_column("album", "catalog", schema="deneb")
@@ -0,0 +1,98 @@
+"""Requests/sec of AsyncSpotify against a local fake spotify api
+
+compares a new `aiohttp.ClientSession` per call (previous behaviour) with
+the pooled per-loop session from `deneb.http_pool`
+
+    python benchmarks/bench_http_pool.py --requests 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import aiohttp
+from aiohttp import web
+
+os.environ.setdefault("DENEB_PLAYLIST_NAME_PREFIX", "bench-")
+
+from deneb import http_pool, sp  # noqa: E402
+
+_ME = {"id": "bench-user", "display_name": "bench", "country": "MD"}
+
+
+async def _me(request: web.Request) -> web.Response:
+    return web.json_response(_ME)
+
+
+async def start_fake_spotify() -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/v1/me/", _me)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner
+
+
+class _PerCallSession:
+    """mimic the old flow: a fresh session (and connection) for every call"""
+
+    def request(self, *args, **kwargs):
+        return _PerCallRequest(args, kwargs)
+
+
+class _PerCallRequest:
+    def __init__(self, args, kwargs):
+        self.session = aiohttp.ClientSession()
+        self.request_ctx = self.session.request(*args, **kwargs)
+
+    async def __aenter__(self):
+        return await self.request_ctx.__aenter__()
+
+    async def __aexit__(self, *exc):
+        await self.request_ctx.__aexit__(*exc)
+        await self.session.close()
+
+
+async def _run(client: sp.AsyncSpotify, requests: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _call():
+        async with semaphore:
+            await client.current_user()
+
+    tstart = time.perf_counter()
+    await asyncio.gather(*[_call() for _ in range(requests)])
+    return requests / (time.perf_counter() - tstart)
+
+
+async def main(requests: int, concurrency: int) -> None:
+    runner = await start_fake_spotify()
+    port = runner.addresses[0][1]
+
+    client = sp.AsyncSpotify(auth="bench-token")
+    client.prefix = f"http://127.0.0.1:{port}/v1/"
+
+    original_get_session = http_pool.get_session
+    try:
+        sp.get_session = _PerCallSession
+        before = await _run(client, requests, concurrency)
+
+        sp.get_session = original_get_session
+        await http_pool.init_http_pool()
+        after = await _run(client, requests, concurrency)
+    finally:
+        sp.get_session = original_get_session
+        await http_pool.close_http_pool()
+        await runner.cleanup()
+
+    print(f"session per call: {before:10.1f} req/s")
+    print(f"pooled session:   {after:10.1f} req/s ({after / before:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    cli_args = parser.parse_args()
+    asyncio.run(main(cli_args.requests, cli_args.concurrency))
@@ -0,0 +1,107 @@
+"""Per item overhead of `run_tasks` for a growing number of no-op items
+
+compares the previous implementation (job list rebuilt and the remaining
+items sliced on every refill) with the worker pool from `deneb.tools`
+
+    python benchmarks/bench_run_tasks.py --sizes 1000,10000,100000
+"""
+import argparse
+import asyncio
+import os
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+os.environ.setdefault("DENEB_PLAYLIST_NAME_PREFIX", "bench-")
+
+from deneb.tools import run_tasks  # noqa: E402
+
+
+def _create_jobs(func: Callable, args_items: List[Any]) -> List[asyncio.Future]:
+    return [asyncio.create_task(func(*item)) for item in args_items]
+
+
+def _take(
+    amount: int, items: List[Any], can_add_filter: Callable
+) -> Tuple[List[Any], List[Any]]:
+    taken_items = []  # type: List[Any]
+    for idx, item in enumerate(items):
+        if len(taken_items) == amount:
+            return taken_items, items[idx:]
+        if can_add_filter(args=item):
+            taken_items.append(item)
+    return taken_items, []
+
+
+async def legacy_run_tasks(
+    queue_size: int,
+    args_items_left: List[Any],
+    afunc: Callable,
+    items_filter: Optional[Callable] = None,
+) -> List[Any]:
+    items_filter = items_filter or (lambda args: args)
+
+    args_items_batch, args_items_left = _take(queue_size, args_items_left, items_filter)
+    jobs = _create_jobs(afunc, args_items_batch)
+    job_results = []
+
+    while jobs:
+        done_tasks, pending = await asyncio.wait(
+            jobs, return_when=asyncio.FIRST_COMPLETED
+        )
+        while done_tasks:
+            done_task = done_tasks.pop()
+            jobs.remove(done_task)
+            result = await done_task
+            job_results.append(result)
+
+        if args_items_left:
+            required_amount = queue_size - len(pending)
+            args_items_batch, args_items_left = _take(
+                required_amount, args_items_left, items_filter
+            )
+            jobs.extend(_create_jobs(afunc, args_items_batch))
+
+    return job_results
+
+
+async def _noop(idx: int) -> int:
+    await asyncio.sleep(0)
+    return idx
+
+
+async def _per_item_us(runner: Callable, size: int, queue_size: int) -> float:
+    args_items = [(idx,) for idx in range(size)]
+    tstart = time.perf_counter()
+    results = await runner(queue_size, args_items, _noop)
+    assert len(results) == size
+    return (time.perf_counter() - tstart) / size * 10 ** 6
+
+
+async def main(sizes: List[int], queue_size: int, legacy_max: int) -> None:
+    print(f"{'items':>8} {'legacy us/item':>15} {'pool us/item':>13}")
+    for size in sizes:
+        legacy = "skipped"
+        if size <= legacy_max:
+            legacy = f"{await _per_item_us(legacy_run_tasks, size, queue_size):.2f}"
+        pool = await _per_item_us(run_tasks, size, queue_size)
+        print(f"{size:>8} {legacy:>15} {pool:>13.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--queue-size", type=int, default=20)
+    parser.add_argument(
+        "--legacy-max",
+        type=int,
+        default=100000,
+        help="largest size to run the previous implementation with",
+    )
+    cli_args = parser.parse_args()
+    asyncio.run(
+        main(
+            [int(a) for a in cli_args.sizes.split(",")],
+            cli_args.queue_size,
+            cli_args.legacy_max,
+        )
+    )
@@ -6,9 +6,13 @@ from celery import Celery
 from celery.schedules import crontab
 from celery.signals import worker_process_init, worker_process_shutdown
 
-from deneb.config import VERSION
-from deneb.db import close_db, init_db
+from deneb.config import VERSION, Config
+from deneb.db import ArtistSyncJob, close_db, init_db
+from deneb.dispatch import dispatch_users_chunks, run_users_chunk
+from deneb.http_pool import close_http_pool, init_http_pool
 from deneb.logger import get_logger
+from deneb.spotify.common import _get_to_update_users
+from deneb.spotify.users_following import discover_releases
 from deneb.spotify.weekly_releases import (
     update_users_followed_artists_and_weekly_playlists
 )
@@ -30,47 +34,92 @@ uvloop.install()
 def init_worker(*args, **kwargs):
     loop = asyncio.get_event_loop()
     loop.run_until_complete(init_db())
+    loop.run_until_complete(init_http_pool())
 
 
 @worker_process_shutdown.connect
 def shutdown_worker(**kwargs):
     loop = asyncio.get_event_loop()
+    loop.run_until_complete(close_http_pool())
     loop.run_until_complete(close_db())
 
 
 app = Celery(f"deneb-{VERSION}")
 
 
+def _fb_alert() -> FBAlert:
+    return FBAlert(os.environ["FB_API_KEY"], os.environ["FB_API_URL"], notify=True)
+
+
+def _run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+async def _dispatch(name: str, chunk_task, all_markets: bool) -> int:
+    users = await _get_to_update_users(all_markets=all_markets)
+    return await dispatch_users_chunks(name, users, chunk_task.delay)
+
+
 @app.task()
 def liked_task():
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(
-        update_users_playlists_liked_by_year(
-            SPOTIFY_KEYS,
-            FBAlert(os.environ["FB_API_KEY"], os.environ["FB_API_URL"], notify=True),
-            None,
-            None,
-            dry_run=False,
+    _run(_dispatch("liked-sorted-yearly", liked_chunk_task, all_markets=True))
+
+
+@app.task()
+def liked_chunk_task(chunk_key, users_ids):
+    _run(
+        run_users_chunk(
+            chunk_key,
+            users_ids,
+            lambda ids, key: update_users_playlists_liked_by_year(
+                SPOTIFY_KEYS,
+                _fb_alert(),
+                None,
+                None,
+                dry_run=False,
+                user_ids=ids,
+                run_key=key,
+            ),
         )
     )
 
 
 @app.task()
 def weekly_playlist():
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(
-        update_users_followed_artists_and_weekly_playlists(
-            SPOTIFY_KEYS,
-            FBAlert(os.environ["FB_API_KEY"], os.environ["FB_API_URL"], notify=True),
-            None,
-            None,
-            None,
+    _run(_dispatch("weekly-playlist-update", weekly_playlist_chunk, all_markets=False))
+
+
+@app.task()
+def weekly_playlist_chunk(chunk_key, users_ids):
+    # users were picked by their market hour at dispatch
+    _run(
+        run_users_chunk(
+            chunk_key,
+            users_ids,
+            lambda ids, key: update_users_followed_artists_and_weekly_playlists(
+                SPOTIFY_KEYS, _fb_alert(), all_markets=True, user_ids=ids, run_key=key
+            ),
         )
     )
 
 
+@app.task()
+def feed_artists_queue():
+    # nodes running `sync-artists` drain it
+    _run(ArtistSyncJob.feed())
+
+
+@app.task()
+def discover_releases_task():
+    _run(discover_releases(SPOTIFY_KEYS))
+
+
 config = {
     "beat_schedule": {
+        "feed-artists-queue": {
+            "task": "celery_ship.feed_artists_queue",
+            "schedule": crontab(hour="*", minute=0),
+        },
         "liked-sorted-yearly": {
             "task": "celery_ship.liked_task",
             "schedule": crontab(hour="*", minute=5),
@@ -83,4 +132,11 @@ config = {
     "timezone": "Europe/Bucharest",
 }
 
+if Config.NEW_RELEASES_DISCOVERY:
+    # before the weekly playlists are built
+    config["beat_schedule"]["discover-releases"] = {
+        "task": "celery_ship.discover_releases_task",
+        "schedule": crontab(hour="*", minute=0),
+    }
+
 app.conf.update(config)
@@ -1,5 +1,9 @@
 import asyncio
+import functools
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Tuple
 
 import click
 import uvloop
@@ -7,12 +11,20 @@ from dotenv import load_dotenv
 
 load_dotenv()  # noqa
 
+from deneb import governor
 from deneb.db import close_db, init_db
+from deneb.dispatch import run_lock
+from deneb.http_pool import close_http_pool, init_http_pool
 from deneb.logger import get_logger
-from deneb.spotify.users_following import sync_users_artists
+from deneb.rate_limit import SPOTIFY_LIMITER
+from deneb.spotify.album_tracks import ALBUM_TRACKS_CACHE
+from deneb.spotify.users_following import (
+    discover_releases, feed_artists_queue, sync_artists_queue, sync_users_artists
+)
 from deneb.spotify.weekly_releases import update_users_playlists
 from deneb.spotify.yearly_liked import update_users_playlists_liked_by_year
 from deneb.structs import FBAlert, SpotifyKeys
+from deneb.tools import merge_summaries
 
 uvloop.install()
 
@@ -26,16 +38,87 @@ SPOTIFY_KEYS = SpotifyKeys(
 )
 
 
-def runner(func, args):
+async def _run_locked(name: str, run: Callable[[], Awaitable[Any]]) -> Any:
+    """skip the run while a previous run of the command, sharded or not, is going"""
+    async with run_lock(name) as locked:
+        if not locked:
+            _LOGGER.info(f"{name} is still running elsewhere; skipped")
+            return {}
+        return await run()
+
+
+def _run(
+    func: Callable, args: Tuple, kwargs: Dict[str, Any], lock: bool = True
+) -> Dict[str, Any]:
+    loop = asyncio.new_event_loop()
+    summary = {}  # type: Dict[str, Any]
+    try:
+        loop.run_until_complete(init_db())
+        loop.run_until_complete(init_http_pool())
+        run = functools.partial(func, *args, **kwargs)
+        locked_run = _run_locked(func.__name__, run) if lock else run()
+        summary = loop.run_until_complete(locked_run) or {}
+    except Exception:
+        _LOGGER.exception(f"task {func} interrupted; args: {args[1:]};")
+    finally:
+        _LOGGER.info(f"spotify rate limiter: {SPOTIFY_LIMITER.stats()}")
+        _LOGGER.info(f"album tracks cache: {ALBUM_TRACKS_CACHE.stats()}")
+        _LOGGER.info(f"concurrency budgets: {governor.stats()}")
+        _LOGGER.info(f"http limit history: {governor.HTTP_BUDGET.get_history()}")
+        loop.run_until_complete(close_http_pool())
+        loop.run_until_complete(close_db())
+        loop.close()
+    return summary
+
+
+def _run_shard(func: Callable, args: Tuple, shard: Tuple[int, int]) -> Dict[str, Any]:
+    _LOGGER.info(f"running shard {shard[0] + 1}/{shard[1]} in {os.getpid()}")
+    return _run(func, args, {"shard": shard}, lock=False)
+
+
+def _run_shards(func: Callable, args: Tuple, workers: int) -> Dict[str, Any]:
+    # a fresh interpreter per worker, each with its own loop and pools
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        shards = [
+            pool.submit(_run_shard, func, args, (index, workers))
+            for index in range(workers)
+        ]
+        return merge_summaries(a.result() for a in shards)
+
+
+def _run_sharded(
+    func: Callable, args: Tuple, workers: int, lock: bool
+) -> Dict[str, Any]:
+    """the shards run unlocked, the command lock is held here while they go"""
+    if not lock:
+        return _run_shards(func, args, workers)
     loop = asyncio.new_event_loop()
+    summary = {}  # type: Dict[str, Any]
     try:
         loop.run_until_complete(init_db())
-        loop.run_until_complete(func(*args))
+        run = functools.partial(
+            loop.run_in_executor, None, _run_shards, func, args, workers
+        )
+        summary = loop.run_until_complete(_run_locked(func.__name__, run)) or {}
     except Exception:
         _LOGGER.exception(f"task {func} interrupted; args: {args[1:]};")
     finally:
         loop.run_until_complete(close_db())
         loop.close()
+    return summary
+
+
+def runner(func: Callable, args: Tuple, workers: int = 1, lock: bool = True) -> None:
+    """run the command; with more workers, users are split among processes
+
+    with `lock` a run of the command is skipped while another one is going
+    """
+    if workers <= 1:
+        summary = _run(func, args, {}, lock)
+    else:
+        summary = _run_sharded(func, args, workers, lock)
+    _LOGGER.info(f"finished {func.__name__}: {summary}")
 
 
 def get_fb_alert(notify: bool) -> FBAlert:
@@ -53,9 +136,13 @@ def cli():
 @click.option("--notify", is_flag=True)
 @click.option("--dry-run", is_flag=True)
 @click.option("--all-markets", is_flag=True)
+@click.option("--artist-centric", is_flag=True)
 @click.option("--year")
+@click.option("--workers", type=int, default=1)
 @click.pass_context
-def full_run(ctx, user, force, notify, dry_run, all_markets, year):
+def full_run(
+    ctx, user, force, notify, dry_run, all_markets, artist_centric, year, workers
+):
     orig_params = ctx.params.copy()
 
     ctx.params = {
@@ -63,6 +150,8 @@ def full_run(ctx, user, force, notify, dry_run, all_markets, year):
         "force": orig_params.get("force", False),
         "dry_run": orig_params.get("dry_run", False),
         "all_markets": orig_params.get("all_markets", False),
+        "artist_centric": orig_params.get("artist_centric", False),
+        "workers": orig_params.get("workers", 1),
     }
     update_followed.invoke(ctx)
 
@@ -71,6 +160,7 @@ def full_run(ctx, user, force, notify, dry_run, all_markets, year):
         "notify": orig_params.get("notify", False),
         "dry_run": orig_params.get("dry_run", False),
         "all_markets": orig_params.get("all_markets", False),
+        "workers": orig_params.get("workers", 1),
     }
     update_playlists.invoke(ctx)
 
@@ -79,6 +169,7 @@ def full_run(ctx, user, force, notify, dry_run, all_markets, year):
         "year": orig_params.get("year", None),
         "notify": orig_params.get("notify", False),
         "dry_run": orig_params.get("dry_run", False),
+        "workers": orig_params.get("workers", 1),
     }
     update_playlists_yearly_liked.invoke(ctx)
 
@@ -88,9 +179,15 @@ def full_run(ctx, user, force, notify, dry_run, all_markets, year):
 @click.option("--force", is_flag=True)
 @click.option("--dry-run", is_flag=True)
 @click.option("--all-markets", is_flag=True)
-def update_followed(user, force, dry_run, all_markets):
+@click.option("--artist-centric", is_flag=True)
+@click.option("--workers", type=int, default=1)
+def update_followed(user, force, dry_run, all_markets, artist_centric, workers):
     _LOGGER.info("running: update user followed artists and artist albums")
-    runner(sync_users_artists, (SPOTIFY_KEYS, user, force, dry_run, all_markets))
+    runner(
+        sync_users_artists,
+        (SPOTIFY_KEYS, user, force, dry_run, all_markets, artist_centric),
+        workers,
+    )
 
 
 @click.command()
@@ -98,10 +195,15 @@ def update_followed(user, force, dry_run, all_markets):
 @click.option("--notify", is_flag=True)
 @click.option("--dry-run", is_flag=True)
 @click.option("--all-markets", is_flag=True)
-def update_playlists(user, notify, dry_run, all_markets):
+@click.option("--workers", type=int, default=1)
+def update_playlists(user, notify, dry_run, all_markets, workers):
     _LOGGER.info("running: update users spotify weekly playlists")
     fb_alert = get_fb_alert(notify)
-    runner(update_users_playlists, (SPOTIFY_KEYS, fb_alert, user, dry_run, all_markets))
+    runner(
+        update_users_playlists,
+        (SPOTIFY_KEYS, fb_alert, user, dry_run, all_markets),
+        workers,
+    )
 
 
 @click.command()
@@ -109,19 +211,40 @@ def update_playlists(user, notify, dry_run, all_markets):
 @click.option("--year")
 @click.option("--notify", is_flag=True)
 @click.option("--dry-run", is_flag=True)
-def update_playlists_yearly_liked(user, year, notify, dry_run):
+@click.option("--workers", type=int, default=1)
+def update_playlists_yearly_liked(user, year, notify, dry_run, workers):
     _LOGGER.info("running: update users spotify liked by year playlist")
     fb_alert = get_fb_alert(notify)
     runner(
         update_users_playlists_liked_by_year,
         (SPOTIFY_KEYS, fb_alert, user, year, dry_run),
+        workers,
     )
 
 
+@click.command()
+@click.option("--feed", is_flag=True)
+@click.option("--workers", type=int, default=1)
+def sync_artists(feed, workers):
+    _LOGGER.info("running: sync artists from the work queue")
+    if feed:
+        # fed once, ahead of the workers, which only drain it
+        runner(feed_artists_queue, (), lock=False)
+    runner(sync_artists_queue, (SPOTIFY_KEYS,), workers, lock=False)
+
+
+@click.command()
+def discover_new_releases():
+    _LOGGER.info("running: discover followed artists releases in new releases feeds")
+    runner(discover_releases, (SPOTIFY_KEYS,))
+
+
 cli.add_command(update_playlists_yearly_liked)
 cli.add_command(update_followed)
 cli.add_command(update_playlists)
 cli.add_command(full_run)
+cli.add_command(sync_artists)
+cli.add_command(discover_new_releases)
 
 if __name__ == "__main__":
     cli()
@@ -1,5 +1,6 @@
 import aiohttp
 
+from deneb.http_pool import get_session
 from deneb.logger import get_logger, push_sentry_error
 from deneb.structs import FBAlert
 
@@ -31,13 +32,11 @@ async def send_message(fb_id: str, fb_alert: FBAlert, data: str):
             "message": {"text": "".join(clean_chunk)},
             "tag": "ACCOUNT_UPDATE",
         }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                fb_alert.url, json=contents, params=fb_token
-            ) as res:
-                if res.status != 200:
-                    try:
-                        res.raise_for_status()
-                    except aiohttp.ClientError as exc:
-                        _LOGGER.exception(f"{res} {res.content}")
-                        push_sentry_error(exc, fb_id)
+        session = get_session()
+        async with session.post(fb_alert.url, json=contents, params=fb_token) as res:
+            if res.status != 200:
+                try:
+                    res.raise_for_status()
+                except aiohttp.ClientError as exc:
+                    _LOGGER.exception(f"{res} {res.content}")
+                    push_sentry_error(exc, fb_id)
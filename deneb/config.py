@@ -8,4 +8,53 @@ class Config:
     USERS_TASKS_AMOUNT = 5
     ALBUMS_TASKS_AMOUNT = 20
     ARTISTS_TASKS_AMOUNT = 20
+    PAGES_TASKS_AMOUNT = 10
+    ALBUMS_BULK_SIZE = 500
+    # page artist album groups concurrently, when one page doesn't hold them
+    ALBUMS_FETCH_BY_GROUP = True
+    HTTP_POOL_LIMIT = 100
+    HTTP_POOL_LIMIT_PER_HOST = 50
+    HTTP_DNS_CACHE_TTL = 300
+    DB_POOL_SIZE = 20
+    # max in-flight spotify requests, for all tasks; adapts to spotify
+    # responses, between the min and max
+    HTTP_CONCURRENCY = 20
+    HTTP_CONCURRENCY_MIN = 4
+    HTTP_CONCURRENCY_MAX = HTTP_POOL_LIMIT_PER_HOST
+    SPOTIFY_REQUESTS_PER_SECOND = 25
+    SPOTIFY_REQUESTS_BURST = 25
+    # seconds before expiry when a user token gets refreshed
+    TOKEN_REFRESH_MARGIN = 300
+    # album tracks shared between users; memory cap in bytes, max age in seconds
+    ALBUM_TRACKS_CACHE_SIZE = 64 * 1024 * 1024
+    ALBUM_TRACKS_CACHE_TTL = 12 * 3600
+    # keep fetched album tracks in the db too, for the next runs
+    ALBUM_TRACKS_CACHE_PERSIST = bool(os.environ.get("DENEB_ALBUM_TRACKS_PERSIST"))
+    # users per celery sub-task of the scheduled jobs
+    TASK_USERS_CHUNK_SIZE = 25
+    # a started chunk whose lease is not renewed for this long is taken as
+    # left by a dead worker; running chunks renew it every quarter of it
+    TASK_CHUNK_LEASE_MINUTES = 60
+    # unfinished runs older than this are given up, a new run starts over
+    TASK_RUN_MAX_HOURS = 6
+    # artists are synced again a fraction of their release cadence later,
+    # the gap between their last releases, within these hours
+    ARTIST_SYNC_MIN_HOURS = 4
+    ARTIST_SYNC_MAX_HOURS = 7 * 24
+    ARTIST_SYNC_CADENCE_FRACTION = 0.1
+    ARTIST_SYNC_RELEASES = 10
+    # find new releases in the new releases feed of the markets, released
+    # in the last days; per artist syncing is then only a backstop, that
+    # many times rarer
+    NEW_RELEASES_DISCOVERY = bool(os.environ.get("DENEB_NEW_RELEASES_DISCOVERY"))
+    NEW_RELEASES_DAYS = 7
+    NEW_RELEASES_BACKSTOP_FACTOR = 4
+    # artist sync work queue: artists claimed at once and for how long,
+    # failed ones are retried after attempts * retry seconds, a few times
+    ARTIST_QUEUE_BATCH_SIZE = 50
+    ARTIST_QUEUE_LEASE_SECONDS = 15 * 60
+    ARTIST_QUEUE_RETRY_SECONDS = 5 * 60
+    ARTIST_QUEUE_MAX_ATTEMPTS = 5
+    # liked tracks per request when scanning the user library, spotify max
+    LIKED_TRACKS_PAGE_SIZE = 50
     PLAYLIST_NAME_PREFIX = os.environ["DENEB_PLAYLIST_NAME_PREFIX"]
@@ -3,8 +3,14 @@
 import os
 
 from deneb.db.album import Album
+from deneb.db.album_tracks import CachedAlbumTracks
 from deneb.db.artist import Artist
+from deneb.db.artist_sync_job import ArtistSyncJob
+from deneb.db.liked_track import LikedTrack
 from deneb.db.market import Market
+from deneb.db.playlist_mirror import PlaylistMirror
+from deneb.db.task_run import TaskRun
+from deneb.db.track import Track
 from deneb.db.user import User
 from deneb.tortoise_pool import PoolTortoise
 
@@ -23,4 +29,18 @@ async def close_db() -> None:
     await PoolTortoise.close_connections()
 
 
-__all__ = ["Album", "Artist", "Market", "User", "PoolTortoise", "init_db", "close_db"]
+__all__ = [
+    "Album",
+    "Artist",
+    "ArtistSyncJob",
+    "CachedAlbumTracks",
+    "LikedTrack",
+    "Market",
+    "PlaylistMirror",
+    "TaskRun",
+    "Track",
+    "User",
+    "PoolTortoise",
+    "init_db",
+    "close_db",
+]
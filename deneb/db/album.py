@@ -1,9 +1,70 @@
-from typing import Tuple
+import json
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 
 from tortoise import exceptions, fields
 from tortoise.models import Model
 
+from deneb.db.track import Track
 from deneb.tools import generate_release_date
+from deneb.tortoise_pool import PoolTortoise
+
+if TYPE_CHECKING:  # pragma: no cover
+    from deneb.db import Artist  # noqa
+
+_INSERT_ALBUMS = """
+    INSERT INTO deneb.album (spotify_id, name, type, release, catalog)
+    SELECT DISTINCT ON (spotify_id) spotify_id, name, type, release, catalog::json
+    FROM unnest($1::text[], $2::text[], $3::text[], $4::date[], $5::text[])
+        AS input(spotify_id, name, type, release, catalog)
+    ON CONFLICT (spotify_id) DO NOTHING
+    RETURNING id
+"""
+
+# albums stored before the catalog was kept
+_FILL_CATALOG = """
+    UPDATE deneb.album
+    SET catalog = input.catalog::json
+    FROM unnest($1::text[], $2::text[]) AS input(spotify_id, catalog)
+    WHERE album.spotify_id = input.spotify_id
+        AND album.catalog IS NULL
+        AND input.catalog IS NOT NULL
+"""
+
+_SELECT_ALBUMS_IDS = """
+    SELECT id, spotify_id
+    FROM deneb.album
+    WHERE spotify_id = ANY($1::text[])
+"""
+
+_LINK_ARTISTS_ALBUMS = """
+    INSERT INTO deneb.artist_albums (album_id, artist_id)
+    SELECT DISTINCT link.album_id, link.artist_id
+    FROM unnest($1::int[], $2::int[]) AS link(album_id, artist_id)
+    WHERE NOT EXISTS (
+        SELECT 1
+        FROM deneb.artist_albums
+        WHERE album_id = link.album_id AND artist_id = link.artist_id
+    )
+"""
+
+
+def album_catalog(item: dict) -> Optional[dict]:
+    """snapshot of the album a release belongs to, as playlists need it
+
+    featuring tracks are stored as releases too, their album is under `album`
+    """
+    album = item.get("album") if item["type"] == "track" else item
+    if not album:
+        return None
+    return {
+        "id": album["id"],
+        "name": album["name"],
+        "album_type": album["album_type"],
+        "artists": [{"id": a["id"], "name": a["name"]} for a in album["artists"]],
+        "available_markets": album.get("available_markets", []),
+        "release_date": album["release_date"],
+        "release_date_precision": album["release_date_precision"],
+    }
 
 
 class Album(Model):  # type: ignore
@@ -12,6 +73,8 @@ class Album(Model):  # type: ignore
     type = fields.CharField(max_length=255)
     spotify_id = fields.CharField(max_length=255)
     release = fields.DateField()
+    # see `album_catalog`
+    catalog = fields.JSONField(null=True)
     created_at = fields.DatetimeField(auto_now_add=True)
     artists = fields.ManyToManyField(
         "models.Artist",
@@ -72,3 +135,74 @@ class Album(Model):  # type: ignore
                 raise
 
         return db_album, created
+
+    @classmethod
+    async def bulk_sync(
+        cls, artists_albums: List[Tuple[dict, "Artist"]]
+    ) -> Dict[int, List["Album"]]:
+        """insert albums and link them to their artists with set based queries
+
+        returns the newly created albums by the id of the artist which
+        brought them in, existing albums are only linked. Featuring tracks
+        get their track stored along, as it's already at hand
+        """
+        if not artists_albums:
+            return {}
+
+        albums = {album["id"]: album for album, _ in artists_albums}
+        releases = [
+            generate_release_date(a["release_date"], a["release_date_precision"])
+            for a in albums.values()
+        ]
+        spotify_ids = list(albums.keys())
+        catalogs = [album_catalog(a) for a in albums.values()]
+        catalogs_data = [json.dumps(a) if a else None for a in catalogs]
+
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            async with conn.transaction():
+                created_rows = await conn.fetch(
+                    _INSERT_ALBUMS,
+                    spotify_ids,
+                    [a["name"] for a in albums.values()],
+                    [a["type"] for a in albums.values()],
+                    releases,
+                    catalogs_data,
+                )
+                await conn.execute(_FILL_CATALOG, spotify_ids, catalogs_data)
+                # a separate statement, so it sees rows inserted meanwhile
+                # by concurrent syncs too
+                rows = await conn.fetch(_SELECT_ALBUMS_IDS, spotify_ids)
+                albums_ids = {row["spotify_id"]: row["id"] for row in rows}
+
+                links = [
+                    (albums_ids[album["id"]], artist.id)
+                    for album, artist in artists_albums
+                ]
+                await conn.execute(
+                    _LINK_ARTISTS_ALBUMS,
+                    [album_id for album_id, _ in links],
+                    [artist_id for _, artist_id in links],
+                )
+                await Track.insert_many(
+                    conn,
+                    [
+                        (albums_ids[a["id"]], [a])
+                        for a in albums.values()
+                        if a["type"] == "track"
+                    ],
+                )
+
+        created_albums = {}  # type: Dict[int, Album]
+        if created_rows:
+            created_ids = [row["id"] for row in created_rows]
+            created_albums = {a.id: a for a in await Album.filter(id__in=created_ids)}
+
+        new_albums = {}  # type: Dict[int, List[Album]]
+        for album_id, artist_id in links:
+            if album_id in created_albums:
+                # count a new album only once, for the first artist having it
+                new_albums.setdefault(artist_id, []).append(
+                    created_albums.pop(album_id)
+                )
+        return new_albums
@@ -0,0 +1,62 @@
+import datetime
+import json
+from typing import Dict, List
+
+from tortoise import fields
+from tortoise.models import Model
+
+from deneb.tortoise_pool import PoolTortoise
+
+_SELECT_FRESH = """
+    SELECT spotify_id, data
+    FROM deneb.album_tracks_cache
+    WHERE spotify_id = ANY($1::text[]) AND fetched_at > $2
+"""
+
+_UPSERT = """
+    INSERT INTO deneb.album_tracks_cache (spotify_id, data, fetched_at)
+    SELECT spotify_id, data::json, $3
+    FROM unnest($1::text[], $2::text[]) AS input(spotify_id, data)
+    ON CONFLICT (spotify_id)
+    DO UPDATE SET data = excluded.data, fetched_at = excluded.fetched_at
+"""
+
+
+class CachedAlbumTracks(Model):
+    """spotify album with all of its tracks, as fetched from the api"""
+
+    id = fields.IntField(pk=True)
+    spotify_id = fields.CharField(max_length=255, unique=True)
+    # {"parent": <album>, "tracks": [<track>, ..]}
+    data = fields.JSONField()
+    fetched_at = fields.DatetimeField()
+
+    class Meta:
+        table = 'deneb"."album_tracks_cache'
+
+    def __str__(self):
+        return f"<{self.spotify_id}> [{self.fetched_at}]"
+
+    @classmethod
+    async def load(cls, spotify_ids: List[str], max_age: int) -> Dict[str, dict]:
+        """entries fetched in the last `max_age` seconds, by spotify id"""
+        if not spotify_ids:
+            return {}
+        since = datetime.datetime.now() - datetime.timedelta(seconds=max_age)
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            rows = await conn.fetch(_SELECT_FRESH, spotify_ids, since)
+        return {row["spotify_id"]: json.loads(row["data"]) for row in rows}
+
+    @classmethod
+    async def store(cls, entries: Dict[str, dict]) -> None:
+        if not entries:
+            return
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            await conn.execute(
+                _UPSERT,
+                list(entries.keys()),
+                [json.dumps(data) for data in entries.values()],
+                datetime.datetime.now(),
+            )
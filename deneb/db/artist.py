@@ -1,7 +1,83 @@
 import datetime
+import json
+from typing import Dict, List, Optional, Set
 
 from tortoise import fields
 from tortoise.models import Model
+from tortoise.query_utils import Q
+
+from deneb.config import Config
+from deneb.tortoise_pool import PoolTortoise
+
+_UPDATE_SYNCED = """
+    UPDATE deneb.artist
+    SET
+        synced_at = $1,
+        release_marks = synced.release_marks::json,
+        next_sync_at = synced.next_sync_at
+    FROM unnest($2::int[], $3::text[], $4::timestamp[])
+        AS synced(id, release_marks, next_sync_at)
+    WHERE artist.id = synced.id
+"""
+
+_SELECT_BY_SPOTIFY_IDS = """
+    SELECT id, name, spotify_id
+    FROM deneb.artist
+    WHERE spotify_id = ANY($1::text[])
+"""
+
+# new artists are due a sync only after `hours_delta`, as with `Artist.create`;
+# their times are app local, as everywhere else; the casts pin one type for $3
+# as it fills both timestamptz and timestamp columns
+_INSERT_ARTISTS = """
+    INSERT INTO deneb.artist (name, spotify_id, created_at, updated_at, synced_at)
+    SELECT DISTINCT ON (spotify_id)
+        name, spotify_id, $3::timestamp, $3::timestamp, $3::timestamp
+    FROM unnest($1::text[], $2::text[]) AS input(name, spotify_id)
+    ON CONFLICT (spotify_id) DO NOTHING
+    RETURNING id, name, spotify_id
+"""
+
+_SELECT_RECENT_RELEASES = """
+    SELECT artist.id AS artist_id, recent.release
+    FROM unnest($1::int[]) AS artist(id)
+    JOIN LATERAL (
+        SELECT album.release
+        FROM deneb.album
+        JOIN deneb.artist_albums ON artist_albums.album_id = album.id
+        WHERE artist_albums.artist_id = artist.id
+        ORDER BY album.release DESC
+        LIMIT $2
+    ) AS recent ON true
+"""
+
+
+def sync_interval(
+    releases: List[datetime.date], today: Optional[datetime.date] = None
+) -> datetime.timedelta:
+    """how long until an artist is due a sync again, by its release cadence
+
+    the cadence is the average gap between its releases, or the time since
+    the last one when the artist is silent for longer than that; artists
+    are synced a fraction of it later, within the configured floor and ceiling,
+    and later still when new releases are found in the releases feed
+    """
+    floor = datetime.timedelta(hours=Config.ARTIST_SYNC_MIN_HOURS)
+    ceiling = datetime.timedelta(hours=Config.ARTIST_SYNC_MAX_HOURS)
+    if not releases:
+        return floor
+
+    today = today or datetime.date.today()
+    releases = sorted(releases, reverse=True)
+    cadence = today - releases[0]
+    if len(releases) > 1:
+        average_gap = (releases[0] - releases[-1]) / (len(releases) - 1)
+        cadence = max(cadence, average_gap)
+
+    interval = cadence * Config.ARTIST_SYNC_CADENCE_FRACTION
+    if Config.NEW_RELEASES_DISCOVERY:
+        interval *= Config.NEW_RELEASES_BACKSTOP_FACTOR
+    return min(ceiling, max(floor, interval))
 
 
 class Artist(Model):
@@ -11,6 +87,10 @@ class Artist(Model):
     created_at = fields.DatetimeField(auto_now_add=True)
     updated_at = fields.DatetimeField(auto_now_add=True)
     synced_at = fields.DatetimeField(auto_now_add=True)
+    # newest album seen per album group, {group: {"id": .., "release_date": ..}}
+    release_marks = fields.JSONField(null=True)
+    # see `sync_interval`; artists synced before it was kept use `hours_delta`
+    next_sync_at = fields.DatetimeField(null=True)
 
     class Meta:
         table = 'deneb"."artist'
@@ -24,9 +104,11 @@ class Artist(Model):
     def can_update(self, hours_delta=4):
         """check if artist can be updated
 
-        returns True if last update time is bigger
-        the the hours_delta, else False
+        returns True if the artist is due its next sync, or without one, if
+        last update time is bigger the the hours_delta, else False
         """
+        if self.next_sync_at:
+            return datetime.datetime.now() >= self.next_sync_at
         if not self.synced_at:
             return True
         delta = datetime.datetime.now() - self.synced_at
@@ -34,6 +116,125 @@ class Artist(Model):
             return True
         return False
 
+    async def claim_update(self, hours_delta=4):
+        """atomically mark the artist as synced now
+
+        returns True only if it was due an update, so that two tasks
+        racing for the same artist won't both sync it
+        """
+        now = datetime.datetime.now()
+        threshold = now - datetime.timedelta(hours=hours_delta)
+        retry_at = now + datetime.timedelta(hours=hours_delta)
+        claimed = (
+            await Artist.filter(id=self.id)
+            .filter(
+                Q(next_sync_at__lte=now)
+                | Q(
+                    Q(next_sync_at__isnull=True),
+                    Q(synced_at__isnull=True) | Q(synced_at__lt=threshold),
+                )
+            )
+            # not claimed again meanwhile; set for real once synced
+            .update(synced_at=now, next_sync_at=retry_at)
+        )
+        if claimed:
+            self.synced_at = now
+            self.next_sync_at = retry_at
+        return bool(claimed)
+
+    @classmethod
+    async def followed_spotify_ids(cls) -> Set[str]:
+        """spotify ids of the artists followed by anyone"""
+        return set(
+            await Artist.filter(users__id__isnull=False)
+            .distinct()
+            .values_list("spotify_id", flat=True)
+        )
+
+    @classmethod
+    async def followed_by(cls, users_ids: List[int]) -> List["Artist"]:
+        """artists followed by any of the users, each once"""
+        # json columns can't be compared, so no DISTINCT over whole rows
+        artists_ids = (
+            await Artist.filter(users__id__in=users_ids)
+            .distinct()
+            .values_list("id", flat=True)
+        )
+        return await Artist.filter(id__in=artists_ids)
+
+    @classmethod
+    async def resolve_many(cls, artists: List[Dict]) -> List["Artist"]:
+        """db artists of spotify artists, creating the missing ones
+
+        the artists come back with their id, name and spotify id only
+        """
+        if not artists:
+            return []
+        spotify_ids = list(dict.fromkeys(a["id"] for a in artists))
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            rows = await conn.fetch(_SELECT_BY_SPOTIFY_IDS, spotify_ids)
+            found = {row["spotify_id"]: row for row in rows}
+            missing = [a for a in artists if a["id"] not in found]
+            if missing:
+                rows = await conn.fetch(
+                    _INSERT_ARTISTS,
+                    [a["name"] for a in missing],
+                    [a["id"] for a in missing],
+                    datetime.datetime.now(),
+                )
+                found.update({row["spotify_id"]: row for row in rows})
+            # created meanwhile by a concurrent sync
+            raced = [a["id"] for a in missing if a["id"] not in found]
+            if raced:
+                rows = await conn.fetch(_SELECT_BY_SPOTIFY_IDS, raced)
+                found.update({row["spotify_id"]: row for row in rows})
+        return [
+            Artist(id=row["id"], name=row["name"], spotify_id=row["spotify_id"])
+            for row in (found[spotify_id] for spotify_id in spotify_ids)
+        ]
+
     async def update_synced_at(self):
         self.synced_at = datetime.datetime.now()
         await self.save()
+
+    def _releases(self, stored: List[datetime.date]) -> List[datetime.date]:
+        """stored releases, with the release marks for artists synced once"""
+        marked = [
+            datetime.date.fromisoformat(a["release_date"])
+            for a in (self.release_marks or {}).values()
+        ]
+        return sorted(set(stored) | set(marked), reverse=True)[
+            : Config.ARTIST_SYNC_RELEASES
+        ]
+
+    @classmethod
+    async def bulk_update_synced(cls, artists):
+        """store synced_at, release marks and next sync of artists in one query"""
+        if not artists:
+            return
+        now = datetime.datetime.now()
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            rows = await conn.fetch(
+                _SELECT_RECENT_RELEASES,
+                [a.id for a in artists],
+                Config.ARTIST_SYNC_RELEASES,
+            )
+            releases = {}  # type: Dict[int, List[datetime.date]]
+            for row in rows:
+                releases.setdefault(row["artist_id"], []).append(row["release"])
+            for artist in artists:
+                artist.next_sync_at = now + sync_interval(
+                    artist._releases(releases.get(artist.id, [])), now.date()
+                )
+
+            await conn.execute(
+                _UPDATE_SYNCED,
+                now,
+                [a.id for a in artists],
+                [json.dumps(a.release_marks) for a in artists],
+                [a.next_sync_at for a in artists],
+            )
+        for artist in artists:
+            artist.synced_at = now
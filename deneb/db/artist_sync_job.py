@@ -0,0 +1,121 @@
+import datetime
+from typing import List
+
+from tortoise import fields
+from tortoise.models import Model
+
+from deneb.tortoise_pool import PoolTortoise
+
+# artists due a sync (same rule as `Artist.can_update`) and followed by
+# somebody, the more followers the sooner; jobs already queued keep their
+# lease and take the higher priority. Artists sync times are app local,
+# so they are compared to the app clock, not to the db one
+_FEED = """
+    INSERT INTO deneb.artist_sync_job (artist_id, priority, due_at, attempts)
+    SELECT artist.id, count(*), now(), 0
+    FROM deneb.artist
+    JOIN deneb.user_followed_artists AS follow ON follow.artist_id = artist.id
+    WHERE artist.next_sync_at <= $2
+        OR (
+            artist.next_sync_at IS NULL
+            AND (artist.synced_at IS NULL OR artist.synced_at < $1)
+        )
+    GROUP BY artist.id
+    ON CONFLICT (artist_id) DO UPDATE
+    SET priority = GREATEST(artist_sync_job.priority, excluded.priority)
+    RETURNING artist_id
+"""
+
+# every node claims its own batch, rows locked by other nodes are skipped
+_CLAIM = """
+    UPDATE deneb.artist_sync_job AS job
+    SET
+        leased_until = now() + $2::int * interval '1 second',
+        attempts = job.attempts + 1
+    FROM (
+        SELECT artist_id
+        FROM deneb.artist_sync_job
+        WHERE due_at <= now() AND (leased_until IS NULL OR leased_until < now())
+        ORDER BY priority DESC, due_at
+        LIMIT $1
+        FOR UPDATE SKIP LOCKED
+    ) AS due
+    WHERE job.artist_id = due.artist_id
+    RETURNING job.artist_id
+"""
+
+_COMPLETE = """
+    DELETE FROM deneb.artist_sync_job
+    WHERE artist_id = ANY($1::int[])
+"""
+
+# failed jobs are retried later and later, then given up on
+_RELEASE = """
+    UPDATE deneb.artist_sync_job
+    SET
+        leased_until = NULL,
+        due_at = now() + attempts * $2::int * interval '1 second'
+    WHERE artist_id = ANY($1::int[])
+"""
+
+_DROP_FAILED = """
+    DELETE FROM deneb.artist_sync_job
+    WHERE artist_id = ANY($1::int[]) AND attempts >= $2
+    RETURNING artist_id
+"""
+
+
+class ArtistSyncJob(Model):
+    """an artist waiting to be synced, the work queue shared by every node
+
+    a job is claimed with a lease; one whose lease ran out was left by a
+    node which died, and can be claimed again
+    """
+
+    artist_id = fields.IntField(pk=True)
+    priority = fields.IntField(default=0)
+    due_at = fields.DatetimeField()
+    leased_until = fields.DatetimeField(null=True)
+    attempts = fields.IntField(default=0)
+
+    class Meta:
+        table = 'deneb"."artist_sync_job'
+
+    def __str__(self):
+        return f"<artist_sync_job:{self.artist_id}>"
+
+    @classmethod
+    async def feed(cls, hours_delta: int = 4) -> int:
+        """queue artists not synced in the last `hours_delta` hours"""
+        now = datetime.datetime.now()
+        synced_before = now - datetime.timedelta(hours=hours_delta)
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            rows = await conn.fetch(_FEED, synced_before, now)
+        return len(rows)
+
+    @classmethod
+    async def claim(cls, batch_size: int, lease_seconds: int) -> List[int]:
+        """lease up to `batch_size` due jobs; returns their artists ids"""
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            rows = await conn.fetch(_CLAIM, batch_size, lease_seconds)
+        return [row["artist_id"] for row in rows]
+
+    @classmethod
+    async def complete(cls, artists_ids: List[int]) -> None:
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            await conn.execute(_COMPLETE, artists_ids)
+
+    @classmethod
+    async def release(
+        cls, artists_ids: List[int], retry_seconds: int, max_attempts: int
+    ) -> List[int]:
+        """put failed jobs back to be retried; returns the ones given up on"""
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch(_DROP_FAILED, artists_ids, max_attempts)
+                await conn.execute(_RELEASE, artists_ids, retry_seconds)
+        return [row["artist_id"] for row in rows]
@@ -0,0 +1,151 @@
+import datetime
+import json
+from typing import Dict, List, Optional
+
+from tortoise import fields
+from tortoise.models import Model
+
+from deneb.tortoise_pool import PoolTortoise
+
+_UPSERT = """
+    INSERT INTO deneb.liked_track
+        (user_id, spotify_id, name, artists, release_year, added_at)
+    SELECT DISTINCT ON (spotify_id)
+        $1, spotify_id, name, artists::json, release_year, added_at
+    FROM unnest($2::text[], $3::text[], $4::text[], $5::text[], $6::timestamptz[])
+        AS input(spotify_id, name, artists, release_year, added_at)
+    ON CONFLICT (user_id, spotify_id) DO UPDATE SET added_at = excluded.added_at
+"""
+
+_SELECT_NEWEST = """
+    SELECT spotify_id, added_at
+    FROM deneb.liked_track
+    WHERE user_id = $1
+    ORDER BY added_at DESC, id DESC
+    LIMIT 1
+"""
+
+# newest first, as spotify lists them
+_SELECT_LIKED = """
+    SELECT spotify_id, name, artists, release_year, added_at
+    FROM deneb.liked_track
+    WHERE user_id = $1
+        AND ($2::timestamptz IS NULL OR added_at >= $2)
+        AND ($3::text[] IS NULL OR release_year = ANY($3))
+    ORDER BY added_at DESC, id DESC
+"""
+
+_DELETE = """
+    DELETE FROM deneb.liked_track
+    WHERE user_id = $1 AND spotify_id = ANY($2::text[])
+"""
+
+_ADDED_AT_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def parse_added_at(added_at: str) -> datetime.datetime:
+    return datetime.datetime.strptime(added_at, _ADDED_AT_FORMAT).replace(
+        tzinfo=datetime.timezone.utc
+    )
+
+
+def format_added_at(added_at: datetime.datetime) -> str:
+    return added_at.astimezone(datetime.timezone.utc).strftime(_ADDED_AT_FORMAT)
+
+
+def _artists(track: dict) -> List[dict]:
+    return [{"id": a["id"], "name": a["name"]} for a in track["artists"]]
+
+
+def _liked_item(row) -> dict:
+    """the liked track in the shape spotify lists saved tracks"""
+    return {
+        "added_at": format_added_at(row["added_at"]),
+        "track": {
+            "id": row["spotify_id"],
+            "name": row["name"],
+            "uri": f"spotify:track:{row['spotify_id']}",
+            "artists": json.loads(row["artists"]),
+            "album": {"release_date": row["release_year"]},
+        },
+    }
+
+
+class LikedTrack(Model):
+    """a track in a user liked library, kept current by the liked scans
+
+    scans only go down to the newest track stored, so unliked tracks are
+    found, and dropped, when they are about to be added to a playlist
+    """
+
+    id = fields.IntField(pk=True)
+    user = fields.ForeignKeyField("models.User", related_name="liked_tracks")
+    spotify_id = fields.CharField(max_length=255)
+    name = fields.CharField(max_length=255)
+    # [{"id": .., "name": ..}]
+    artists = fields.JSONField()
+    release_year = fields.CharField(max_length=4)
+    added_at = fields.DatetimeField()
+
+    class Meta:
+        table = 'deneb"."liked_track'
+
+    def __str__(self):
+        return f"<spotify:track:{self.spotify_id}> - {self.name}"
+
+    @classmethod
+    async def store(cls, user_id: int, items: List[dict]) -> None:
+        """store saved tracks items, as listed by spotify"""
+        if not items:
+            return
+        # oldest first, so ids go along with liking order on equal added_at
+        items = items[::-1]
+        tracks = [a["track"] for a in items]
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            await conn.execute(
+                _UPSERT,
+                user_id,
+                [a["id"] for a in tracks],
+                [a["name"] for a in tracks],
+                [json.dumps(_artists(a)) for a in tracks],
+                [a["album"]["release_date"][:4] for a in tracks],
+                [parse_added_at(a["added_at"]) for a in items],
+            )
+
+    @classmethod
+    async def newest_cursor(cls, user_id: int) -> Optional[Dict[str, str]]:
+        """cursor of the newest liked track stored, None for a new library"""
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            row = await conn.fetchrow(_SELECT_NEWEST, user_id)
+        if row is None:
+            return None
+        return {
+            "added_at": format_added_at(row["added_at"]),
+            "track_id": row["spotify_id"],
+        }
+
+    @classmethod
+    async def load(
+        cls,
+        user_id: int,
+        years: Optional[List[str]] = None,
+        since: Optional[str] = None,
+    ) -> List[dict]:
+        """liked items of the years, liked since `since` added_at, newest first"""
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            rows = await conn.fetch(
+                _SELECT_LIKED, user_id, since and parse_added_at(since), years
+            )
+        return [_liked_item(row) for row in rows]
+
+    @classmethod
+    async def forget(cls, user_id: int, spotify_ids: List[str]) -> None:
+        """drop tracks the user unliked"""
+        if not spotify_ids:
+            return
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            await conn.execute(_DELETE, user_id, spotify_ids)
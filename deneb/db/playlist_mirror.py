@@ -0,0 +1,73 @@
+import json
+from typing import Dict, Optional, Set
+
+from tortoise import fields
+from tortoise.models import Model
+
+from deneb.tortoise_pool import PoolTortoise
+
+_UPSERT = """
+    INSERT INTO deneb.playlist_mirror
+        (user_id, year, playlist_id, snapshot_id, tracks_ids, updated_at)
+    VALUES ($1, $2, $3, $4, $5::json, now())
+    ON CONFLICT (user_id, year) DO UPDATE
+    SET
+        playlist_id = excluded.playlist_id,
+        snapshot_id = excluded.snapshot_id,
+        tracks_ids = excluded.tracks_ids,
+        updated_at = excluded.updated_at
+"""
+
+
+class PlaylistMirror(Model):
+    """track ids of a liked by year playlist, as of its snapshot
+
+    while the playlist snapshot is the same, it needs no fetching
+    """
+
+    id = fields.IntField(pk=True)
+    user = fields.ForeignKeyField("models.User", related_name="playlist_mirrors")
+    year = fields.CharField(max_length=4)
+    playlist_id = fields.CharField(max_length=255)
+    # None when the playlist changed in ways not known
+    snapshot_id = fields.CharField(max_length=255, null=True)
+    tracks_ids = fields.JSONField()
+    updated_at = fields.DatetimeField(auto_now=True)
+
+    class Meta:
+        table = 'deneb"."playlist_mirror'
+
+    def __str__(self):
+        return f"<{self.user_id}:{self.year}> [{self.snapshot_id}]"
+
+    def tracks_of(self, playlist: dict) -> Optional[Set[str]]:
+        """the playlist track ids, if the mirror is of its current snapshot"""
+        if self.snapshot_id is None or self.playlist_id != playlist.get("id"):
+            return None
+        if self.snapshot_id != playlist.get("snapshot_id"):
+            return None
+        return set(self.tracks_ids)
+
+    @classmethod
+    async def by_year(cls, user_id: int) -> Dict[str, "PlaylistMirror"]:
+        return {a.year: a for a in await PlaylistMirror.filter(user_id=user_id)}
+
+    @classmethod
+    async def store(
+        cls,
+        user_id: int,
+        year: str,
+        playlist_id: str,
+        snapshot_id: Optional[str],
+        tracks_ids: Set[str],
+    ) -> None:
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            await conn.execute(
+                _UPSERT,
+                user_id,
+                year,
+                playlist_id,
+                snapshot_id,
+                json.dumps(sorted(tracks_ids)),
+            )
@@ -0,0 +1,250 @@
+import datetime
+import json
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from tortoise import fields
+from tortoise.models import Model
+
+from deneb.tools import merge_summaries
+from deneb.tortoise_pool import PoolTortoise
+
+_INSERT_RUN = """
+    INSERT INTO deneb.task_run (key, status, created_at)
+    VALUES ($1, 'running', now())
+    ON CONFLICT (key) DO NOTHING
+    RETURNING key
+"""
+
+_INSERT_CHUNKS = """
+    INSERT INTO deneb.task_run (key, parent_key, status, users_ids, created_at)
+    SELECT key, $3, 'pending', users_ids::json, now()
+    FROM unnest($1::text[], $2::text[]) AS input(key, users_ids)
+"""
+
+# a running chunk whose lease is over was left by a worker which died;
+# leases go by the db clock, which also sets them
+_CLAIM_CHUNK = """
+    UPDATE deneb.task_run
+    SET status = 'running', claimed_at = now()
+    WHERE key = $1
+        AND (
+            status = 'pending'
+            OR (
+                status = 'running'
+                AND claimed_at < now() - $2::int * interval '1 minute'
+            )
+        )
+    RETURNING parent_key
+"""
+
+_RENEW_CHUNK = """
+    UPDATE deneb.task_run
+    SET claimed_at = now()
+    WHERE key = $1 AND status = 'running'
+"""
+
+# a failed chunk is given back, to be sent again when the run resumes
+_RELEASE_CHUNK = """
+    UPDATE deneb.task_run
+    SET status = 'pending', claimed_at = NULL
+    WHERE key = $1 AND status = 'running'
+"""
+
+_SELECT_RESUMABLE_CHUNKS = """
+    SELECT key, users_ids
+    FROM deneb.task_run
+    WHERE parent_key = $1
+        AND (
+            status = 'pending'
+            OR (
+                status = 'running'
+                AND claimed_at < now() - $2::int * interval '1 minute'
+            )
+        )
+    ORDER BY key
+"""
+
+_SELECT_UNFINISHED_CHUNKS_USERS = """
+    SELECT users_ids
+    FROM deneb.task_run
+    WHERE parent_key = $1 AND status != 'done'
+"""
+
+_FINISH_CHUNK = """
+    UPDATE deneb.task_run
+    SET status = 'done', summary = $2::json, finished_at = now()
+    WHERE key = $1
+    RETURNING parent_key
+"""
+
+# only the last chunk to finish gets the run row back
+_CLOSE_RUN = """
+    UPDATE deneb.task_run
+    SET status = 'done', finished_at = now()
+    WHERE key = $1
+        AND status = 'running'
+        AND NOT EXISTS (
+            SELECT 1
+            FROM deneb.task_run
+            WHERE parent_key = $1 AND status != 'done'
+        )
+    RETURNING key
+"""
+
+_SELECT_CHUNKS_SUMMARIES = """
+    SELECT summary
+    FROM deneb.task_run
+    WHERE parent_key = $1
+"""
+
+_SET_SUMMARY = """
+    UPDATE deneb.task_run
+    SET summary = $2::json
+    WHERE key = $1
+"""
+
+_INSERT_DONE_USER = """
+    INSERT INTO deneb.task_run_user (run_key, user_id, finished_at)
+    VALUES ($1, $2, now())
+    ON CONFLICT DO NOTHING
+"""
+
+_SELECT_DONE_USERS = """
+    SELECT user_id
+    FROM deneb.task_run_user
+    WHERE run_key = $1
+"""
+
+
+class TaskRun(Model):
+    """a run of a chunked job, or one of its chunks
+
+    the key makes a run, and each chunk, happen at most once
+    """
+
+    key = fields.CharField(max_length=255, pk=True)
+    parent_key = fields.CharField(max_length=255, null=True)
+    # pending -> running -> done; runs given up on are `abandoned`
+    status = fields.CharField(max_length=20)
+    users_ids = fields.JSONField(null=True)
+    summary = fields.JSONField(null=True)
+    created_at = fields.DatetimeField(auto_now_add=True)
+    claimed_at = fields.DatetimeField(null=True)
+    finished_at = fields.DatetimeField(null=True)
+
+    class Meta:
+        table = 'deneb"."task_run'
+
+    def __str__(self):
+        return f"<{self.key}> [{self.status}]"
+
+    @classmethod
+    async def register(cls, run_key: str, chunks: Dict[str, List[int]]) -> bool:
+        """store a run with its chunks users; False if the run was already there"""
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            async with conn.transaction():
+                if not await conn.fetchval(_INSERT_RUN, run_key):
+                    return False
+                await conn.execute(
+                    _INSERT_CHUNKS,
+                    list(chunks.keys()),
+                    [json.dumps(a) for a in chunks.values()],
+                    run_key,
+                )
+        return True
+
+    @classmethod
+    async def unfinished(cls, job_name: str) -> List["TaskRun"]:
+        return await TaskRun.filter(
+            key__startswith=f"{job_name}:",
+            parent_key__isnull=True,
+            status="running",
+        ).order_by("created_at")
+
+    @classmethod
+    async def abandon_stale(cls, job_name: str, before: datetime.datetime) -> int:
+        """give up on unfinished runs of the job started before `before`"""
+        return (
+            await TaskRun.filter(
+                key__startswith=f"{job_name}:",
+                parent_key__isnull=True,
+                status="running",
+                created_at__lt=before,
+            ).update(status="abandoned")
+        )
+
+    @classmethod
+    async def resumable_chunks(
+        cls, run_key: str, lease_minutes: int
+    ) -> List[Tuple[str, List[int]]]:
+        """chunks of the run never started, or left behind by a dead worker"""
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            rows = await conn.fetch(_SELECT_RESUMABLE_CHUNKS, run_key, lease_minutes)
+        return [(row["key"], json.loads(row["users_ids"])) for row in rows]
+
+    @classmethod
+    async def unfinished_users(cls, run_key: str) -> Set[int]:
+        """users of the run chunks not done yet"""
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            rows = await conn.fetch(_SELECT_UNFINISHED_CHUNKS_USERS, run_key)
+        return {a for row in rows for a in json.loads(row["users_ids"])}
+
+    @classmethod
+    async def claim(cls, chunk_key: str, lease_minutes: int) -> Optional[str]:
+        """mark a chunk as started; returns its run key, None if already running"""
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            return await conn.fetchval(_CLAIM_CHUNK, chunk_key, lease_minutes)
+
+    @classmethod
+    async def renew(cls, chunk_key: str) -> None:
+        """extend the lease of a running chunk, from now"""
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            await conn.execute(_RENEW_CHUNK, chunk_key)
+
+    @classmethod
+    async def release(cls, chunk_key: str) -> None:
+        """put a running chunk back to pending, to run it again"""
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            await conn.execute(_RELEASE_CHUNK, chunk_key)
+
+    @classmethod
+    async def finish(
+        cls, chunk_key: str, summary: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """mark a chunk as done
+
+        the last chunk of a run closes it too, with the chunks summaries
+        added up; only then the run summary is returned
+        """
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            run_key = await conn.fetchval(_FINISH_CHUNK, chunk_key, json.dumps(summary))
+            if run_key is None or not await conn.fetchval(_CLOSE_RUN, run_key):
+                return None
+
+            rows = await conn.fetch(_SELECT_CHUNKS_SUMMARIES, run_key)
+            run_summary = merge_summaries(
+                json.loads(row["summary"]) for row in rows if row["summary"]
+            )
+            await conn.execute(_SET_SUMMARY, run_key, json.dumps(run_summary))
+        return run_summary
+
+    @classmethod
+    async def mark_user_done(cls, run_key: str, user_id: int) -> None:
+        """checkpoint a user as done in the run"""
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            await conn.execute(_INSERT_DONE_USER, run_key, user_id)
+
+    @classmethod
+    async def done_users(cls, run_key: str) -> Set[int]:
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            rows = await conn.fetch(_SELECT_DONE_USERS, run_key)
+        return {row["user_id"] for row in rows}
@@ -0,0 +1,80 @@
+import json
+from typing import List, Tuple
+
+from tortoise import fields
+from tortoise.models import Model
+
+from deneb.tortoise_pool import PoolTortoise
+
+_INSERT_TRACKS = """
+    INSERT INTO deneb.track (album_id, spotify_id, name, artists, popularity, position)
+    SELECT album_id, spotify_id, name, artists::json, popularity, position
+    FROM unnest($1::int[], $2::text[], $3::text[], $4::text[], $5::int[], $6::int[])
+        AS input(album_id, spotify_id, name, artists, popularity, position)
+    ON CONFLICT (album_id, spotify_id) DO NOTHING
+"""
+
+
+def _artists(item: dict) -> List[dict]:
+    return [{"id": a["id"], "name": a["name"]} for a in item["artists"]]
+
+
+class Track(Model):
+    """track of a stored album, as needed to build playlists"""
+
+    id = fields.IntField(pk=True)
+    album = fields.ForeignKeyField("models.Album", related_name="tracks")
+    spotify_id = fields.CharField(max_length=255)
+    name = fields.CharField(max_length=255)
+    # [{"id": .., "name": ..}]
+    artists = fields.JSONField()
+    # simplified tracks (from album listings) come without it
+    popularity = fields.IntField(null=True)
+    position = fields.IntField()
+
+    class Meta:
+        table = 'deneb"."track'
+
+    def __str__(self):
+        return f"<spotify:track:{self.spotify_id}> - {self.name}"
+
+    def __repr__(self):
+        return self.__str__()
+
+    def as_dict(self) -> dict:
+        """the track in the shape spotify returns it"""
+        track = {
+            "id": self.spotify_id,
+            "name": self.name,
+            "uri": f"spotify:track:{self.spotify_id}",
+            "artists": self.artists,
+        }
+        if self.popularity is not None:
+            track["popularity"] = self.popularity
+        return track
+
+    @staticmethod
+    async def insert_many(conn, albums_tracks: List[Tuple[int, List[dict]]]) -> None:
+        rows = [
+            (album_id, track, position)
+            for album_id, tracks in albums_tracks
+            for position, track in enumerate(tracks)
+        ]
+        if not rows:
+            return
+        await conn.execute(
+            _INSERT_TRACKS,
+            [album_id for album_id, _, _ in rows],
+            [track["id"] for _, track, _ in rows],
+            [track["name"] for _, track, _ in rows],
+            [json.dumps(_artists(track)) for _, track, _ in rows],
+            [track.get("popularity") for _, track, _ in rows],
+            [position for _, _, position in rows],
+        )
+
+    @classmethod
+    async def bulk_store(cls, albums_tracks: List[Tuple[int, List[dict]]]) -> None:
+        """insert tracks by the db id of their album, known tracks are skipped"""
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            await cls.insert_many(conn, albums_tracks)
@@ -1,13 +1,26 @@
 import json
+from typing import List
 
 from tortoise import fields
 from tortoise.models import Model
 
 from deneb.db import Album, Market
 from deneb.logger import get_logger
+from deneb.tortoise_pool import PoolTortoise
 
 _LOGGER = get_logger(__name__)
 
+_FOLLOW_ARTISTS = """
+    INSERT INTO deneb.user_followed_artists (user_id, artist_id)
+    SELECT DISTINCT $1::int, follow.artist_id
+    FROM unnest($2::int[]) AS follow(artist_id)
+    WHERE NOT EXISTS (
+        SELECT 1
+        FROM deneb.user_followed_artists
+        WHERE user_id = $1 AND artist_id = follow.artist_id
+    )
+"""
+
 
 class User(Model):  # type: ignore
     id = fields.IntField(pk=True)
@@ -18,11 +31,17 @@ class User(Model):  # type: ignore
     artists = fields.ManyToManyField(
         "models.Artist",
         through='deneb"."user_followed_artists',
+        related_name="users",
         forward_key="artist_id",
         backward_key="user_id",
     )
     spotify_token = fields.CharField(max_length=255, null=True)
     config = fields.JSONField()
+    # newest liked track seen per liked by year playlist,
+    # {year: {"added_at": .., "track_id": ..}}
+    liked_cursors = fields.JSONField(null=True)
+    # followed artists set as of the last follows sync, "count:sha1"
+    follows_fingerprint = fields.CharField(max_length=64, null=True)
 
     class Meta:
         table = 'deneb"."user'
@@ -45,6 +64,22 @@ class User(Model):  # type: ignore
             market_id=market.id,
         )
 
+    async def update_liked_cursors(self, cursors: dict) -> None:
+        self.liked_cursors = {**(self.liked_cursors or {}), **cursors}
+        await User.filter(id=self.id).update(liked_cursors=self.liked_cursors)
+
+    async def update_follows_fingerprint(self, fingerprint: str) -> None:
+        self.follows_fingerprint = fingerprint
+        await User.filter(id=self.id).update(follows_fingerprint=fingerprint)
+
+    async def follow_artists(self, artists_ids: List[int]) -> None:
+        """link the artists to the user in a single query"""
+        if not artists_ids:
+            return
+        pool = PoolTortoise.get_connection("default")
+        async with pool.acquire_connection() as conn:
+            await conn.execute(_FOLLOW_ARTISTS, self.id, artists_ids)
+
     async def released_from_weekday(self, date):
         followed_ids = await self.artists.filter().values_list("id")
         followed_ids = [a[0] for a in followed_ids]
@@ -0,0 +1,179 @@
+"""Split scheduled jobs over all users into chunks run as separate tasks
+
+a run and each of its chunks have a key, stored in the db, so a job
+scheduled twice in the same hour or a chunk delivered twice does no
+work again; the chunk finishing last adds up the chunks summaries.
+
+A run still going when the job is scheduled again is not overlapped: its
+chunks left behind, or released on a failure, are sent again, and users
+already done in it are checkpointed, so it resumes where it stopped. The
+new run is dispatched along, without the users the run still going has
+done or has yet to do.
+"""
+import asyncio
+import datetime
+from contextlib import asynccontextmanager
+from typing import (
+    Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+)
+
+from deneb.config import Config
+from deneb.db import PoolTortoise, TaskRun, User
+from deneb.logger import get_logger, push_sentry_error
+from deneb.tools import grouper
+
+_LOGGER = get_logger(__name__)
+
+
+def run_key(name: str, now: Optional[datetime.datetime] = None) -> str:
+    """scheduled jobs run hourly, one run per job and hour"""
+    now = now or datetime.datetime.now()
+    return f"{name}:{now:%Y-%m-%dT%H}"
+
+
+async def _keep_leased(chunk_key: str) -> None:
+    """renew the chunk lease while it runs, so it's not taken as left behind"""
+    while True:
+        await asyncio.sleep(Config.TASK_CHUNK_LEASE_MINUTES * 60 / 4)
+        try:
+            await TaskRun.renew(chunk_key)
+        except Exception:
+            _LOGGER.exception(f"failed to renew chunk {chunk_key} lease")
+
+
+async def _resume_run(
+    previous: TaskRun, send_chunk: Callable[[str, List[int]], Any]
+) -> Tuple[int, Set[int]]:
+    """send again the chunks left behind by a run still going
+
+    returns the chunks sent, and the users the run did or still has to do
+    """
+    chunks = await TaskRun.resumable_chunks(
+        previous.key, Config.TASK_CHUNK_LEASE_MINUTES
+    )
+    for chunk_key, chunk in chunks:
+        send_chunk(chunk_key, chunk)
+    _LOGGER.info(f"run {previous.key} still going; sent again {len(chunks)} chunks")
+
+    users_ids = await TaskRun.done_users(previous.key)
+    users_ids |= await TaskRun.unfinished_users(previous.key)
+    return len(chunks), users_ids
+
+
+async def dispatch_users_chunks(
+    name: str,
+    users: List[User],
+    send_chunk: Callable[[str, List[int]], Any],
+    now: Optional[datetime.datetime] = None,
+) -> int:
+    """register a run of job `name` and send its users in chunks
+
+    `send_chunk` is called with each chunk key and its users ids; returns
+    the number of chunks sent, none if this run was dispatched already.
+    Chunks left behind by previous unfinished runs are sent too, and their
+    users are left out of this run.
+    """
+    now = now or datetime.datetime.now()
+    await TaskRun.abandon_stale(
+        name, now - datetime.timedelta(hours=Config.TASK_RUN_MAX_HOURS)
+    )
+    key = run_key(name, now)
+    resumed_nr = 0
+    taken_ids = set()  # type: Set[int]
+    for previous in await TaskRun.unfinished(name):
+        if previous.key == key:
+            continue
+        chunks_nr, users_ids = await _resume_run(previous, send_chunk)
+        resumed_nr += chunks_nr
+        taken_ids |= users_ids
+
+    users_ids = [a.id for a in users if a.id not in taken_ids]
+    chunks = {
+        f"{key}:{idx}": [a for a in chunk if a is not None]
+        for idx, chunk in enumerate(grouper(Config.TASK_USERS_CHUNK_SIZE, users_ids))
+    }
+    if not chunks:
+        return resumed_nr
+
+    if not await TaskRun.register(key, chunks):
+        _LOGGER.info(f"run {key} already dispatched")
+        return resumed_nr
+
+    for chunk_key, chunk in chunks.items():
+        send_chunk(chunk_key, chunk)
+    _LOGGER.info(f"dispatched run {key}: {len(users_ids)} users, {len(chunks)} chunks")
+    return resumed_nr + len(chunks)
+
+
+async def run_users_chunk(
+    chunk_key: str,
+    users_ids: List[int],
+    job: Callable[[List[int], str], Awaitable[Dict[str, Any]]],
+) -> Optional[Dict[str, Any]]:
+    """run `job` with the chunk users and run key, unless the chunk runs already
+
+    returns the run summary when this was the last chunk of the run; a failed
+    chunk is released, so it's sent again when the run resumes
+    """
+    key = await TaskRun.claim(chunk_key, Config.TASK_CHUNK_LEASE_MINUTES)
+    if key is None:
+        _LOGGER.info(f"chunk {chunk_key} already ran")
+        return None
+
+    lease = asyncio.ensure_future(_keep_leased(chunk_key))
+    try:
+        summary = await job(users_ids, key)
+    except Exception as exc:
+        # left to the run resume, which skips the users it got done
+        _LOGGER.exception(f"chunk {chunk_key} failed; released")
+        push_sentry_error(exc)
+        await TaskRun.release(chunk_key)
+        return None
+    finally:
+        lease.cancel()
+
+    run_summary = await TaskRun.finish(chunk_key, summary)
+    if run_summary is not None:
+        _LOGGER.info(f"finished run {key}: {run_summary}")
+    return run_summary
+
+
+async def skip_done_users(key: Optional[str], users: List[User]) -> List[User]:
+    """users not checkpointed as done in the run yet"""
+    if key is None:
+        return users
+    done_ids = await TaskRun.done_users(key)
+    return [a for a in users if a.id not in done_ids]
+
+
+def checkpointed(key: Optional[str], handler: Callable) -> Callable:
+    """checkpoint the users `handler(credentials, user, ...)` synced in the run
+
+    a user is synced when the handler returns something
+    """
+    if key is None:
+        return handler
+
+    async def _handler(*args):
+        result = await handler(*args)
+        if result is not None:
+            await TaskRun.mark_user_done(key, args[1].id)
+        return result
+
+    return _handler
+
+
+@asynccontextmanager
+async def run_lock(name: str) -> AsyncIterator[bool]:
+    """postgres advisory lock on `name` for as long as the run lasts
+
+    yields False when another run, in any process, holds it
+    """
+    pool = PoolTortoise.get_connection("default")
+    async with pool.acquire_connection() as conn:
+        locked = await conn.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", name)
+        try:
+            yield locked
+        finally:
+            if locked:
+                await conn.execute("SELECT pg_advisory_unlock(hashtext($1))", name)
@@ -0,0 +1,174 @@
+"""Process wide cap on in-flight spotify requests
+
+`run_tasks` calls nest (users -> artists -> albums), so the amount of
+concurrent work is the product of every level; the budget here caps the
+requests that work sends at once, whatever the nesting. Db connections
+need no budget of their own, the asyncpg pool caps and queues them
+"""
+import asyncio
+import collections
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from deneb.config import Config
+
+
+class Budget:
+    """shared cap of concurrent holders, with usage counters
+
+    waiters are served in arrival order; `limit` may change at runtime
+    """
+
+    def __init__(self, name: str, limit: float) -> None:
+        self.name = name
+        self.limit = limit
+        self._waiters = collections.deque()  # type: Deque[asyncio.Future]
+
+        self.in_use = 0
+        self.peak = 0
+        self.waits = 0
+
+    def _has_room(self) -> bool:
+        return self.in_use < int(self.limit)
+
+    def _wake_waiters(self) -> None:
+        free = int(self.limit) - self.in_use
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    async def _acquire(self) -> None:
+        if not self._has_room() or self._waiters:
+            self.waits += 1
+        while not self._has_room() or self._waiters:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # pass the wake up on, it was meant for a slot
+                if waiter.done() and not waiter.cancelled():
+                    self._wake_waiters()
+                raise
+            if self._has_room():
+                break
+        self.in_use += 1
+        self.peak = max(self.peak, self.in_use)
+
+    def _release(self) -> None:
+        self.in_use -= 1
+        self._wake_waiters()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        await self._acquire()
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "limit": int(self.limit),
+            "in_use": self.in_use,
+            "peak": self.peak,
+            "waits": self.waits,
+        }
+
+
+class AdaptiveBudget(Budget):
+    """budget which finds its own limit, additive increase multiplicative decrease
+
+    grows by one slot per `limit` successful calls while the p95 latency
+    stays close to the lowest one seen, is cut by `decrease` when spotify
+    throttles (429) or fails (5xx). Cuts happen once per `cooldown`, as the
+    calls in flight when the first error came are likely to fail as well.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        limit: float,
+        min_limit: int,
+        max_limit: int,
+        window: int = 100,
+        latency_tolerance: float = 1.5,
+        decrease: float = 0.5,
+        cooldown: float = 2.0,
+    ) -> None:
+        super().__init__(name, limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self.decrease = decrease
+        self.cooldown = cooldown
+
+        self._latencies = collections.deque(maxlen=window)  # type: Deque[float]
+        self._window = window
+        self._samples = 0
+        self._decreased_at = 0.0
+        self.p95 = None  # type: Optional[float]
+        self.base_p95 = None  # type: Optional[float]
+        # (time, limit, reason) on every change of the effective limit
+        self.history = collections.deque(maxlen=100)  # type: Deque[Tuple]
+
+    def _set_limit(self, limit: float, reason: str) -> None:
+        limit = min(self.max_limit, max(self.min_limit, limit))
+        changed = int(limit) != int(self.limit)
+        self.limit = limit
+        if changed:
+            self.history.append((round(time.time(), 2), int(limit), reason))
+            self._wake_waiters()
+
+    def _update_p95(self) -> None:
+        latencies = sorted(self._latencies)
+        self.p95 = latencies[int(len(latencies) * 0.95) - 1]
+        if self.base_p95 is None or self.p95 < self.base_p95:
+            self.base_p95 = self.p95
+
+    def _latency_is_flat(self) -> bool:
+        if self.p95 is None or self.base_p95 is None:
+            return True
+        return self.p95 <= self.base_p95 * self.latency_tolerance
+
+    def on_success(self, latency: float) -> None:
+        self._latencies.append(latency)
+        self._samples += 1
+        if self._samples % (self._window // 5 or 1) == 0:
+            self._update_p95()
+
+        if self._latency_is_flat():
+            self._set_limit(self.limit + 1 / int(self.limit), "increase")
+
+    def on_error(self, status: int) -> None:
+        now = time.monotonic()
+        if now - self._decreased_at < self.cooldown:
+            return
+        self._decreased_at = now
+        self._set_limit(self.limit * self.decrease, f"decrease on {status}")
+
+    def get_history(self) -> List[Tuple]:
+        return list(self.history)
+
+    def stats(self) -> Dict[str, float]:
+        stats = super().stats()
+        stats["p95"] = round(self.p95, 3) if self.p95 is not None else None
+        stats["base_p95"] = (
+            round(self.base_p95, 3) if self.base_p95 is not None else None
+        )
+        return stats
+
+
+HTTP_BUDGET = AdaptiveBudget(
+    "http",
+    Config.HTTP_CONCURRENCY,
+    Config.HTTP_CONCURRENCY_MIN,
+    Config.HTTP_CONCURRENCY_MAX,
+)
+
+
+def stats() -> Dict[str, Dict[str, float]]:
+    return {budget.name: budget.stats() for budget in (HTTP_BUDGET,)}
@@ -0,0 +1,43 @@
+"""Shared aiohttp sessions, one connection pool per event loop"""
+import asyncio
+import weakref
+
+import aiohttp
+
+from deneb.config import Config
+
+# sessions are bound to the loop they were created on, so keep one per loop;
+# entries go away together with their loop
+_SESSIONS = weakref.WeakKeyDictionary()  # type: weakref.WeakKeyDictionary
+
+
+def _create_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=Config.HTTP_POOL_LIMIT,
+        limit_per_host=Config.HTTP_POOL_LIMIT_PER_HOST,
+        use_dns_cache=True,
+        ttl_dns_cache=Config.HTTP_DNS_CACHE_TTL,
+    )
+    return aiohttp.ClientSession(
+        connector=connector, headers={"Accept-Encoding": "gzip, deflate"}
+    )
+
+
+def get_session() -> aiohttp.ClientSession:
+    """return the pooled session of the running loop, create it if missing"""
+    loop = asyncio.get_running_loop()
+    session = _SESSIONS.get(loop)
+    if session is None or session.closed:
+        session = _create_session()
+        _SESSIONS[loop] = session
+    return session
+
+
+async def init_http_pool() -> None:
+    get_session()
+
+
+async def close_http_pool() -> None:
+    session = _SESSIONS.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
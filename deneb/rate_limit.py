@@ -0,0 +1,86 @@
+"""Process wide rate limiting for spotify api calls"""
+import asyncio
+import time
+from typing import Dict
+
+from deneb.config import Config
+
+
+class RateLimiter:
+    """token bucket shared by every caller in the process
+
+    each `acquire` reserves a token and sleeps until its slot comes, so
+    waiters are served in order at `rate` calls per second. A `pause`
+    (spotify `Retry-After`) stops everybody until it passes and voids
+    the reservations made before it.
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._epoch = 0
+
+        self.throttled_calls = 0
+        self.throttled_seconds = 0.0
+        self.pauses = 0
+        self.paused_seconds = 0.0
+
+    def _refill(self, now: float) -> None:
+        if now > self._updated_at:
+            elapsed = now - self._updated_at
+            self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+            self._updated_at = now
+
+    async def acquire(self) -> None:
+        tstart = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            self._refill(now)
+            self._tokens -= 1
+            if self._tokens >= 0:
+                break
+
+            epoch = self._epoch
+            await asyncio.sleep(-self._tokens / self.rate)
+            if epoch == self._epoch:
+                break
+            # a pause came in meanwhile and wiped the reservation, queue again
+
+        waited = time.monotonic() - tstart
+        if waited > 0.001:
+            self.throttled_calls += 1
+            self.throttled_seconds += waited
+
+    def pause(self, seconds: float) -> None:
+        """block all callers for `seconds` from now on"""
+        now = time.monotonic()
+        until = now + seconds
+        if until <= self._paused_until:
+            return
+
+        self.pauses += 1
+        self.paused_seconds += until - max(now, self._paused_until)
+        self._paused_until = until
+        self._tokens = 0.0
+        self._updated_at = until
+        self._epoch += 1
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "throttled_calls": self.throttled_calls,
+            "throttled_seconds": round(self.throttled_seconds, 2),
+            "pauses": self.pauses,
+            "paused_seconds": round(self.paused_seconds, 2),
+        }
+
+
+SPOTIFY_LIMITER = RateLimiter(
+    Config.SPOTIFY_REQUESTS_PER_SECOND, Config.SPOTIFY_REQUESTS_BURST
+)
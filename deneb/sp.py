@@ -4,18 +4,27 @@ import json
 import random
 import time
 from contextlib import asynccontextmanager
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 import aiohttp
 from spotipy.client import Spotify, SpotifyException
-from spotipy.oauth2 import SpotifyClientCredentials, SpotifyOAuth
+from spotipy.oauth2 import SpotifyClientCredentials
 
+from deneb.config import Config
 from deneb.db import User
+from deneb.governor import HTTP_BUDGET
+from deneb.http_pool import get_session
 from deneb.logger import get_logger, push_sentry_error
+from deneb.rate_limit import SPOTIFY_LIMITER
 from deneb.structs import SpotifyKeys
 
 _LOGGER = get_logger(__name__)
 
+_TOKEN_URL = "https://accounts.spotify.com/api/token"
+
+# refresh_token -> in flight refresh request
+_REFRESHES = {}  # type: Dict[str, asyncio.Future]
+
 
 @asynccontextmanager
 async def spotify_client(credentials: SpotifyKeys, user: User):
@@ -43,9 +52,67 @@ class Spotter:
         return f"<spotter:{self.userdata.get('id', 'unknown_id')}>"
 
 
+def is_token_expiring(token_info: dict) -> bool:
+    expires_in = token_info["expires_at"] - int(time.time())
+    return expires_in < Config.TOKEN_REFRESH_MARGIN
+
+
+async def _request_access_token(credentials: SpotifyKeys, refresh_token: str) -> dict:
+    payload = {"grant_type": "refresh_token", "refresh_token": refresh_token}
+    auth = aiohttp.BasicAuth(credentials.client_id, credentials.client_secret)
+    session = get_session()
+    async with session.post(_TOKEN_URL, data=payload, auth=auth) as res:
+        if res.status != 200:
+            raise SpotifyException(
+                res.status,
+                -1,
+                "%s:\n %s" % (res.url, await res.text()),
+                headers=res.headers,
+            )
+        token_info = await res.json()
+
+    token_info["expires_at"] = int(time.time()) + token_info["expires_in"]
+    # spotify sends a new refresh token only when it rotates it
+    token_info.setdefault("refresh_token", refresh_token)
+    return token_info
+
+
+async def refresh_access_token(credentials: SpotifyKeys, refresh_token: str) -> dict:
+    """refresh user token; concurrent refreshes of a token share one request"""
+    refresh = _REFRESHES.get(refresh_token)
+    if refresh is None:
+        refresh = asyncio.ensure_future(
+            _request_access_token(credentials, refresh_token)
+        )
+        _REFRESHES[refresh_token] = refresh
+        refresh.add_done_callback(lambda _: _REFRESHES.pop(refresh_token, None))
+    # a cancelled caller must not cancel the refresh for the others
+    return await asyncio.shield(refresh)
+
+
 class AsyncSpotify(Spotify):  # pragma: no cover
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, credentials: Optional[SpotifyKeys] = None, **kwargs):
         super().__init__(*args, **kwargs)
+        self.credentials = credentials
+
+    def _auth_headers(self):
+        # user tokens are kept and refreshed by us, don't let spotipy
+        # fetch one synchronously and block the loop
+        token_info = getattr(self.client_credentials_manager, "token_info", None)
+        if token_info and "access_token" in token_info:
+            return {"Authorization": f"Bearer {token_info['access_token']}"}
+        return super()._auth_headers()
+
+    async def refresh_token(self, force: bool = False) -> None:
+        """refresh user token if about to expire, or always when `force`"""
+        token_info = getattr(self.client_credentials_manager, "token_info", None)
+        if not self.credentials or not token_info or "refresh_token" not in token_info:
+            return
+        if not force and not is_token_expiring(token_info):
+            return
+        self.client_credentials_manager.token_info = await refresh_access_token(
+            self.credentials, token_info["refresh_token"]
+        )
 
     async def current_user(self):
         """ Get detailed profile information about the current user.
@@ -93,6 +160,8 @@ class AsyncSpotify(Spotify):  # pragma: no cover
         delay = 5
         while retries > 0:
             try:
+                await self.refresh_token()
+                await SPOTIFY_LIMITER.acquire()
                 return await self.__async_internal_call(method, url, payload, kwargs)
             except SpotifyException as e:
                 retries -= 1
@@ -104,11 +173,16 @@ class AsyncSpotify(Spotify):  # pragma: no cover
 
                 # 429 means we hit a rate limit, backoff
                 if status == 429 or (status >= 500 and status < 600):
+                    HTTP_BUDGET.on_error(status)
                     if retries < 0:
                         raise
                     else:
                         sleep_seconds = int(e.headers.get("Retry-After", delay)) + 1
-                        await asyncio.sleep(sleep_seconds)
+                        if status == 429:
+                            # the quota is per app, so every caller backs off
+                            SPOTIFY_LIMITER.pause(sleep_seconds)
+                        else:
+                            await asyncio.sleep(sleep_seconds)
                         delay += 1
                 else:
                     raise
@@ -135,12 +209,16 @@ class AsyncSpotify(Spotify):  # pragma: no cover
         if payload:
             args["data"] = json.dumps(payload)
 
-        async with aiohttp.ClientSession() as session:
+        session = get_session()
+        async with HTTP_BUDGET.slot():
+            # latency of the call itself, without the wait for a slot
+            tstart = time.monotonic()
             async with session.request(method, url, headers=headers, **args) as res:
                 try:
                     res.text = await res.text()
                     res.json = json.loads(res.text)
                     res.raise_for_status()
+                    HTTP_BUDGET.on_success(time.monotonic() - tstart)
                 except aiohttp.ClientResponseError:
                     if res.status == 500:
                         raise SpotifyException(
@@ -172,9 +250,6 @@ class AsyncSpotify(Spotify):  # pragma: no cover
 
 async def get_client(credentials: SpotifyKeys, token_info: dict) -> Spotter:
     """returns a spotter obj with spotipy client"""
-    sp_oauth = SpotifyOAuth(
-        credentials.client_id, credentials.client_secret, credentials.client_uri
-    )
     client_credentials = SpotifyClientCredentials(
         credentials.client_id, credentials.client_secret
     )
@@ -182,14 +257,16 @@ async def get_client(credentials: SpotifyKeys, token_info: dict) -> Spotter:
     if "expires_at" not in token_info:
         token_info["expires_at"] = int(time.time()) + 1000
     client_credentials.token_info = token_info
-    client = AsyncSpotify(client_credentials_manager=client_credentials)
+    client = AsyncSpotify(
+        client_credentials_manager=client_credentials, credentials=credentials
+    )
 
     try:
+        # an expiring token is refreshed before this call goes out
         current_user = await client.current_user()
     except SpotifyException:
-        token_info = sp_oauth.refresh_access_token(token_info["refresh_token"])
-        client_credentials.token_info = token_info
-        client = AsyncSpotify(client_credentials_manager=client_credentials)
+        # token revoked or without a known expire time
+        await client.refresh_token(force=True)
         current_user = await client.current_user()
         _LOGGER.info(f"aquired new token for {current_user['id']}")
 
@@ -0,0 +1,190 @@
+"""Album tracks shared by every user of the process
+
+many users follow the same artists, so the same albums come up for all of
+them; each album and its tracks get fetched once and served from here after
+"""
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from deneb.config import Config
+from deneb.db import CachedAlbumTracks
+from deneb.sp import Spotter
+from deneb.spotify.common import fetch_all
+from deneb.structs import AlbumTracks
+
+# max ids accepted by the `albums?ids=` endpoint
+ALBUMS_BATCH_SIZE = 20
+
+Fetcher = Callable[[List[str]], Awaitable[Dict[str, AlbumTracks]]]
+
+
+def _copy(album: AlbumTracks) -> AlbumTracks:
+    # callers edit the tracks they get, keep the cached ones intact
+    return AlbumTracks(album.parent, [dict(track) for track in album.tracks])
+
+
+def _dump(album: AlbumTracks) -> dict:
+    return {"parent": album.parent, "tracks": album.tracks}
+
+
+class AlbumTracksCache:
+    """LRU of album tracks by album spotify id, capped by estimated size
+
+    concurrent lookups of an album being fetched wait for that fetch instead
+    of starting their own. Entries expire after `ttl` seconds, as track
+    popularity changes over time.
+    """
+
+    def __init__(self, max_size: int, ttl: float, persist: bool = False) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persist = persist
+        self._entries = OrderedDict()  # type: OrderedDict
+        self._pending = {}  # type: Dict[str, asyncio.Future]
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._pending.clear()
+        self.size = 0
+
+    def get(self, spotify_id: str) -> Optional[AlbumTracks]:
+        entry = self._entries.get(spotify_id)
+        if entry is None:
+            return None
+        album, _, expires_at = entry
+        if expires_at < time.monotonic():
+            self._remove(spotify_id)
+            return None
+        self._entries.move_to_end(spotify_id)
+        return album
+
+    def put(self, spotify_id: str, album: AlbumTracks) -> None:
+        size = len(json.dumps(_dump(album)))
+        if size > self.max_size:
+            return
+        self._remove(spotify_id)
+        self._entries[spotify_id] = (album, size, time.monotonic() + self.ttl)
+        self.size += size
+        while self.size > self.max_size:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+
+    def _remove(self, spotify_id: str) -> None:
+        entry = self._entries.pop(spotify_id, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    async def _fetch_missing(
+        self, spotify_ids: List[str], fetch: Fetcher
+    ) -> Dict[str, AlbumTracks]:
+        found = {}  # type: Dict[str, AlbumTracks]
+        if self.persist:
+            stored = await CachedAlbumTracks.load(spotify_ids, int(self.ttl))
+            found = {
+                k: AlbumTracks(v["parent"], v["tracks"]) for k, v in stored.items()
+            }
+
+        to_fetch = [a for a in spotify_ids if a not in found]
+        if to_fetch:
+            fetched = await fetch(to_fetch)
+            if self.persist and fetched:
+                await CachedAlbumTracks.store(
+                    {k: _dump(v) for k, v in fetched.items()}
+                )
+            found.update(fetched)
+        return found
+
+    async def resolve(
+        self, spotify_ids: List[str], fetch: Fetcher
+    ) -> Dict[str, AlbumTracks]:
+        """album tracks by spotify id; ids not cached yet are passed to `fetch`
+
+        albums `fetch` fails or skips are left out of the result
+        """
+        resolved = {}  # type: Dict[str, AlbumTracks]
+        waiting = []  # type: List[Tuple[str, asyncio.Future]]
+        missing = []  # type: List[str]
+
+        for spotify_id in dict.fromkeys(spotify_ids):
+            album = self.get(spotify_id)
+            if album is not None:
+                self.hits += 1
+                resolved[spotify_id] = _copy(album)
+            elif spotify_id in self._pending:
+                self.hits += 1
+                waiting.append((spotify_id, self._pending[spotify_id]))
+            else:
+                self.misses += 1
+                missing.append(spotify_id)
+
+        loop = asyncio.get_running_loop()
+        futures = {a: loop.create_future() for a in missing}
+        self._pending.update(futures)
+        fetched = {}  # type: Dict[str, AlbumTracks]
+        try:
+            if missing:
+                fetched = await self._fetch_missing(missing, fetch)
+        finally:
+            for spotify_id, future in futures.items():
+                album = fetched.get(spotify_id)
+                if album is not None:
+                    self.put(spotify_id, album)
+                # waiters of a failed fetch get `None`, the error goes up here
+                future.set_result(album)
+                self._pending.pop(spotify_id, None)
+
+        for spotify_id, album in fetched.items():
+            resolved[spotify_id] = _copy(album)
+        for spotify_id, future in waiting:
+            album = await future
+            if album is not None:
+                resolved[spotify_id] = _copy(album)
+
+        return resolved
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "albums": len(self._entries),
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+ALBUM_TRACKS_CACHE = AlbumTracksCache(
+    Config.ALBUM_TRACKS_CACHE_SIZE,
+    Config.ALBUM_TRACKS_CACHE_TTL,
+    persist=Config.ALBUM_TRACKS_CACHE_PERSIST,
+)
+
+
+async def _fetch_albums(sp: Spotter, spotify_ids: List[str]) -> Dict[str, AlbumTracks]:
+    data = await sp.client.albums(spotify_ids)
+    albums = {}  # type: Dict[str, AlbumTracks]
+    for album_data in (data or {}).get("albums", []):
+        # unknown ids come back as `None`
+        if not album_data:
+            continue
+        # only albums with more than one page of tracks need extra requests
+        tracks = await fetch_all(sp, album_data["tracks"])
+        albums[album_data["id"]] = AlbumTracks(album_data, tracks)
+    return albums
+
+
+async def get_albums_tracks(
+    sp: Spotter, spotify_ids: List[str]
+) -> Dict[str, AlbumTracks]:
+    """albums with all their tracks, at most `ALBUMS_BATCH_SIZE` ids"""
+    return await ALBUM_TRACKS_CACHE.resolve(
+        spotify_ids, lambda ids: _fetch_albums(sp, ids)
+    )
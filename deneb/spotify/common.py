@@ -1,14 +1,19 @@
+import asyncio
 import datetime
 from asyncio import sleep
-from typing import Any, Dict, Iterable, List, Optional, Tuple  # noqa
+from typing import (  # noqa
+    Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+)
+from urllib.parse import parse_qs, urlencode, urlparse, urlunparse
 
 import pytz
 
+from deneb.config import Config
 from deneb.db import Market, User
 from deneb.logger import get_logger, push_sentry_error
 from deneb.sp import Spotter
 from deneb.structs import SpotifyKeys
-from deneb.tools import clean, grouper
+from deneb.tools import clean, grouper, shard_of
 
 _LOGGER = get_logger(__name__)
 
@@ -33,13 +38,29 @@ def _user_task_filter(args: Tuple[SpotifyKeys, User, bool]) -> bool:
     return False
 
 
+def _shard_users(users: List[User], shard: Optional[Tuple[int, int]]) -> List[User]:
+    if shard is None:
+        return users
+    index, count = shard
+    return [a for a in users if shard_of(a.id, count) == index]
+
+
 async def _get_to_update_users(
-    username: Optional[str] = None, all_markets: Optional[bool] = False
+    username: Optional[str] = None,
+    all_markets: Optional[bool] = False,
+    shard: Optional[Tuple[int, int]] = None,
+    user_ids: Optional[List[int]] = None,
 ) -> List[User]:
-    """if `--username` option used, fetch that user else fetch all users"""
+    """if `--username` option used, fetch that user else fetch all users
+
+    with `shard` as (index, count) only the users of that shard are returned,
+    with `user_ids` only those users
+    """
     args = dict()  # type: Dict[str, Any]
     if username is not None:
         args["username"] = username
+    if user_ids is not None:
+        args["id__in"] = user_ids
     without_market_users = []  # type: List[User]
 
     if not all_markets:
@@ -51,17 +72,86 @@ async def _get_to_update_users(
 
         if not active_markets:
             # no point in fetching users if no markets are good
-            return without_market_users
+            return _shard_users(without_market_users, shard)
 
         args["market_id__in"] = [a.id for a in active_markets]
 
     users = await User.filter(**args)
 
-    return list(users) + list(without_market_users)
+    return _shard_users(list(users) + list(without_market_users), shard)
+
+
+def _unwrap_page(data: Optional[Dict]) -> Optional[Dict]:
+    """some endpoints wrap their paging object, e.g. `{"artists": {...}}`"""
+    if data and "items" not in data and len(data) == 1:
+        return next(iter(data.values()))
+    return data
+
+
+def _is_offset_paged(data: Dict) -> bool:
+    """cursor based paging objects (followed artists) have no `total`"""
+    if not all(key in data for key in ("total", "limit", "offset")):
+        return False
+    return "offset=" in data["next"]
+
+
+def _page_url(next_url: str, offset: int) -> str:
+    url = urlparse(next_url)
+    query = parse_qs(url.query)
+    query["offset"] = [str(offset)]
+    return urlunparse(url._replace(query=urlencode(query, doseq=True)))
+
+
+async def _fetch_next_pages(
+    sp: Spotter, data: Dict, stop_when: Optional[Callable[[List[Dict]], bool]]
+) -> List[Dict]:
+    contents = []  # type: List[Dict]
+    while data["next"]:
+        data = _unwrap_page(await sp.client.next(data))  # noqa: B305
+        # sp.client.next sometimes might return just `None`
+        if not data:
+            break
+        contents.extend(data["items"])
+        if stop_when and stop_when(data["items"]):
+            break
+    return contents
+
+
+async def _fetch_offset_pages(
+    sp: Spotter, data: Dict, stop_when: Optional[Callable[[List[Dict]], bool]]
+) -> List[Dict]:
+    contents = []  # type: List[Dict]
+    offsets = list(range(data["offset"] + data["limit"], data["total"], data["limit"]))
+
+    # with `stop_when` it usually trips within the first pages, so the
+    # window starts at one page and doubles, up to the full window
+    window_size = 1 if stop_when else Config.PAGES_TASKS_AMOUNT
+    while offsets:
+        window, offsets = offsets[:window_size], offsets[window_size:]
+        window_size = min(window_size * 2, Config.PAGES_TASKS_AMOUNT)
+        urls = [_page_url(data["next"], offset) for offset in window]
+        pages = await asyncio.gather(*[sp.client._get(url) for url in urls])
+        for page in pages:
+            page = _unwrap_page(page)
+            if not page:
+                return contents
+            contents.extend(page["items"])
+            if stop_when and stop_when(page["items"]):
+                return contents
+    return contents
+
 
+async def fetch_all(
+    sp: Spotter,
+    data: Dict,
+    stop_when: Optional[Callable[[List[Dict]], bool]] = None,
+) -> List[Dict]:
+    """fetch all items avaialble from spotify from first response
 
-async def fetch_all(sp: Spotter, data: Dict) -> List[Dict]:
-    """fetch all items avaialble from spotify from first response"""
+    offset paged results get their remaining pages fetched concurrently,
+    cursor paged ones page sequentially. `stop_when` gets every page items,
+    in order, and no further pages are fetched once it returns True
+    """
     contents = []  # type: List[Dict]
 
     if not data:
@@ -69,18 +159,32 @@ async def fetch_all(sp: Spotter, data: Dict) -> List[Dict]:
         # ignore for now, on next run should be ok
         return contents
 
-    while True:
-        contents.extend(data["items"])
-        if not data["next"]:
-            break
-        data = await sp.client.next(data)  # noqa: B305
-        # sp.client.next sometimes might return just `None`
-        if not data:
-            break
+    contents.extend(data["items"])
+    if (stop_when and stop_when(data["items"])) or not data["next"]:
+        return contents
 
+    if _is_offset_paged(data):
+        contents.extend(await _fetch_offset_pages(sp, data, stop_when))
+    else:
+        contents.extend(await _fetch_next_pages(sp, data, stop_when))
     return contents
 
 
+async def iter_items(sp: Spotter, data: Optional[Dict]) -> AsyncIterator[Dict]:
+    """yield items from first response on, fetching pages one at a time
+
+    pages are fetched only as items are consumed, so leaving the loop early
+    spares the requests for the rest
+    """
+    data = _unwrap_page(data)
+    while data:
+        for item in data["items"]:
+            yield item
+        if not data["next"]:
+            break
+        data = _unwrap_page(await sp.client.next(data))  # noqa: B305
+
+
 async def get_tracks(sp: Spotter, playlist: dict) -> List[dict]:
     """return playlist tracks"""
     tracks = await sp.client.user_playlist(
@@ -99,11 +203,16 @@ async def fetch_user_playlists(sp: Spotter) -> List[Dict]:
 
 async def update_spotify_playlist(
     tracks: Iterable, playlist_uri: str, sp: Spotter, insert_top: bool = False
-):
+) -> Optional[str]:
     """Add the ids from track iterable to the playlist, insert_top bool does it
-    on top of all the items, for fridays"""
+    on top of all the items, for fridays
+
+    returns the playlist snapshot id after the adds, None if any failed
+    """
 
     index = 0
+    snapshot_id = None
+    failed = False
     for album_ids in grouper(100, tracks):
         album_ids = clean(album_ids)
         album_ids = [a["id"] for a in album_ids]
@@ -113,7 +222,8 @@ async def update_spotify_playlist(
             args = args + (index,)  # type: ignore
 
         try:
-            await sp.client.user_playlist_add_tracks(*args)
+            result = await sp.client.user_playlist_add_tracks(*args)
+            snapshot_id = (result or {}).get("snapshot_id")
             index += len(album_ids) - 1
             await sleep(0.2)
         except Exception as exc:
@@ -121,3 +231,5 @@ async def update_spotify_playlist(
                 f"{sp.userdata['id']} fail on POST playlist items {album_ids}"
             )
             push_sentry_error(exc, sp.userdata["id"], sp.userdata["display_name"])
+            failed = True
+    return None if failed else snapshot_id
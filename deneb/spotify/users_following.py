@@ -3,13 +3,15 @@
 from typing import Any, Dict, List, Optional, Tuple  # noqa
 
 from deneb.config import Config
-from deneb.db import User
+from deneb.db import Artist, ArtistSyncJob, Market, User
 from deneb.logger import get_logger, push_sentry_error
 from deneb.sp import spotify_client
 from deneb.spotify.common import _get_to_update_users, _user_task_filter
 from deneb.structs import SpotifyKeys, WeeklyPlaylistUpdateConfig
-from deneb.tools import run_tasks
+from deneb.tools import clean, run_tasks
+from deneb.workers.artist_queue import drain_artist_queue
 from deneb.workers.artist_sync import get_new_releases
+from deneb.workers.release_discovery import discover_new_releases
 from deneb.workers.user_sync import sync_user_followed_artists
 
 _LOGGER = get_logger(__name__)
@@ -19,11 +21,14 @@ _CONFIG_ID = "weekly-playlist-update"
 
 async def _update_user_artists(
     credentials: SpotifyKeys, user: User, force_update: bool, dry_run: bool
-):
-    """task to update user followed artists and artist albums"""
+) -> Optional[User]:
+    """task to update user followed artists and artist albums
+
+    returns the user if synced
+    """
     user_config = WeeklyPlaylistUpdateConfig(**user.config[_CONFIG_ID])
     if not user_config.enabled:
-        return
+        return None
     sp = None
     try:
         async with spotify_client(credentials, user) as sp:
@@ -50,6 +55,64 @@ async def _update_user_artists(
             user_id = sp.userdata["id"]
             username = sp.userdata["display_name"]
         push_sentry_error(exc, user_id, username)
+        return None
+    return user
+
+
+async def _update_user_follows(
+    credentials: SpotifyKeys, user: User, dry_run: bool
+) -> Optional[User]:
+    """task to update user followed artists only; returns the user if synced"""
+    user_config = WeeklyPlaylistUpdateConfig(**user.config[_CONFIG_ID])
+    if not user_config.enabled:
+        return None
+    sp = None
+    try:
+        async with spotify_client(credentials, user) as sp:
+            new_follows, lost_follows = await sync_user_followed_artists(
+                user, sp, dry_run
+            )
+            _LOGGER.info(f"{user} : follows +{len(new_follows)} -{len(lost_follows)}")
+    except Exception as exc:
+        _LOGGER.exception(f"{user} failed to update follows")
+        user_id = None
+        username = None
+        if sp:
+            user_id = sp.userdata["id"]
+            username = sp.userdata["display_name"]
+        push_sentry_error(exc, user_id, username)
+        return None
+    return user
+
+
+async def _update_artists_once(
+    credentials: SpotifyKeys, users: List[User], force_update: bool, dry_run: bool
+) -> Dict[str, int]:
+    """sync user follows, then every artist followed by them exactly once"""
+    args_items = [(credentials, user, dry_run) for user in users]
+    synced_users = clean(
+        await run_tasks(
+            Config.USERS_TASKS_AMOUNT,
+            args_items,
+            _update_user_follows,
+            _user_task_filter,
+        )
+    )
+    if not synced_users:
+        return {"synced": 0}
+
+    artists = await Artist.followed_by([a.id for a in synced_users])
+    _LOGGER.info(
+        f"updating {len(artists)} artists followed by {len(synced_users)} users"
+    )
+
+    # artist albums are the same for everybody, any user client will do
+    async with spotify_client(credentials, synced_users[0]) as sp:
+        albums_nr, updated_nr = await get_new_releases(
+            sp, artists, force_update, claim=True
+        )
+    _LOGGER.info(f"fetched {albums_nr} albums for {updated_nr} artists")
+    return {"synced": len(synced_users), "albums": albums_nr, "artists": updated_nr}
 
 
 async def sync_users_artists(
@@ -58,10 +121,64 @@ async def sync_users_artists(
     force_update: bool = False,
     dry_run: bool = False,
     all_markets: bool = False,
-):
-    """entry point for updating user artists and artist albums"""
-    users = await _get_to_update_users(user_id, all_markets=all_markets)
+    artist_centric: bool = False,
+    shard: Optional[Tuple[int, int]] = None,
+) -> Dict[str, int]:
+    """entry point for updating user artists and artist albums
+
+    `artist_centric` syncs every followed artist once for all users,
+    instead of once per each user following it; returns a run summary
+    """
+    users = await _get_to_update_users(user_id, all_markets=all_markets, shard=shard)
+    if artist_centric:
+        summary = await _update_artists_once(credentials, users, force_update, dry_run)
+        return {"users": len(users), **summary}
+
     args_items = [(credentials, user, force_update, dry_run) for user in users]
-    await run_tasks(
+    synced_users = await run_tasks(
         Config.USERS_TASKS_AMOUNT, args_items, _update_user_artists, _user_task_filter
     )
+    return {"users": len(users), "synced": len(clean(synced_users))}
+
+
+async def feed_artists_queue(shard: Optional[Tuple[int, int]] = None) -> Dict[str, int]:
+    """entry point for queueing the artists due a sync, once for all nodes
+
+    `shard` is of no use here, the queue is shared
+    """
+    return {"queued": await ArtistSyncJob.feed()}
+
+
+async def sync_artists_queue(
+    credentials: SpotifyKeys, shard: Optional[Tuple[int, int]] = None
+) -> Dict[str, int]:
+    """entry point for syncing the queued artists, alongside other nodes
+
+    nodes share the queue, so `shard` is of no use here. Returns a run summary
+    """
+    users = [a for a in await _get_to_update_users(all_markets=True) if a.spotify_token]
+    if not users:
+        return {}
+
+    # artist albums are the same for everybody, any user client will do
+    async with spotify_client(credentials, users[0]) as sp:
+        summary = await drain_artist_queue(sp)
+    _LOGGER.info(f"synced {summary['artists']} queued artists")
+    return summary
+
+
+async def discover_releases(
+    credentials: SpotifyKeys, shard: Optional[Tuple[int, int]] = None
+) -> Dict[str, int]:
+    """entry point for finding followed artists releases in the markets feeds
+
+    `shard` is of no use here, there's no per user work
+    """
+    users = [a for a in await _get_to_update_users(all_markets=True) if a.spotify_token]
+    if not users:
+        return {}
+
+    markets = [a.name for a in await Market.all()]
+    # the feeds are the same for everybody, any user client will do
+    async with spotify_client(credentials, users[0]) as sp:
+        return await discover_new_releases(sp, markets)
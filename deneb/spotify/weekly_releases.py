@@ -5,17 +5,19 @@ from datetime import datetime as dt
 from datetime import timedelta
 from itertools import chain
 from math import ceil
-from typing import Dict, Iterable, List, Optional, Tuple  # noqa:F401
+from typing import Callable, Dict, Iterable, List, Optional, Tuple  # noqa:F401
 
 from spotipy.client import SpotifyException
 
 from deneb.chatbot.message import send_message
 from deneb.config import Config
-from deneb.db import Album, User
+from deneb.db import Album, Track, User
+from deneb.dispatch import checkpointed, skip_done_users
 from deneb.logger import get_logger, push_sentry_error
 from deneb.sp import SpotifyStats, Spotter, spotify_client
+from deneb.spotify.album_tracks import ALBUMS_BATCH_SIZE, get_albums_tracks
 from deneb.spotify.common import (
-    fetch_all, fetch_user_playlists, get_tracks, update_spotify_playlist
+    fetch_user_playlists, get_tracks, update_spotify_playlist
 )
 from deneb.spotify.users_following import (
     _get_to_update_users, _user_task_filter
@@ -23,7 +25,9 @@ from deneb.spotify.users_following import (
 from deneb.structs import (
     AlbumTracks, FBAlert, SpotifyKeys, WeeklyPlaylistUpdateConfig
 )
-from deneb.tools import convert_to_date, run_tasks, search_dict_by_key
+from deneb.tools import (
+    clean, convert_to_date, grouper, run_tasks, search_dict_by_key
+)
 
 from .users_following import _update_user_artists
 
@@ -31,6 +35,9 @@ _LOGGER = get_logger(__name__)
 
 _CONFIG_ID = "weekly-playlist-update"
 
+# max ids accepted by the `tracks?ids=` endpoint
+_TRACKS_BATCH_SIZE = 50
+
 
 def week_of_month(dt: dt) -> int:
     """ Returns the week of the month for the specified date.
@@ -56,13 +63,81 @@ def generate_playlist_name() -> str:
     return f"{Config.PLAYLIST_NAME_PREFIX}{month_name} W{week_nr} {now.year}"
 
 
-async def _make_album_tracks(sp: Spotter, album: Album) -> AlbumTracks:
-    tracks = []  # type: List[dict]
-    album_data = await sp.client.album(album.uri)
-    if not album_data:
-        raise SpotifyException(f"failed fetch {album_data}")
-    tracks = await fetch_all(sp, album_data["tracks"])
-    return AlbumTracks(album_data, tracks)
+async def _fetch_albums_batch(
+    sp: Spotter, ids: List[str]
+) -> List[Tuple[str, AlbumTracks]]:
+    # albums are shared between users, most of them come from the cache
+    return list((await get_albums_tracks(sp, ids)).items())
+
+
+async def _fetch_tracks_batch(
+    sp: Spotter, ids: List[str]
+) -> List[Tuple[str, AlbumTracks]]:
+    data = await sp.client.tracks(ids)
+    tracks = clean((data or {}).get("tracks", []))
+    return [(track["id"], AlbumTracks(track["album"], [track])) for track in tracks]
+
+
+async def _fetch_batch(
+    sp: Spotter, fetch_func: Callable, ids: List[str]
+) -> List[Tuple[str, AlbumTracks]]:
+    try:
+        return await fetch_func(sp, ids)
+    except SpotifyException:
+        _LOGGER.warning(f"failed to fetch batch {ids}")
+        return []
+
+
+async def _load_albums_tracks(db_albums: List[Album]) -> Dict[str, AlbumTracks]:
+    """albums tracks stored at artist sync time, by album spotify id
+
+    featuring tracks are stored from album listings, without popularity;
+    those are left out, to be fetched with it for the popularity filter
+    """
+    cataloged = {a.id: a for a in db_albums if a.catalog}
+    if not cataloged:
+        return {}
+
+    stored = {}  # type: Dict[str, AlbumTracks]
+    tracks = await Track.filter(album_id__in=list(cataloged)).order_by("position")
+    for track in tracks:
+        db_album = cataloged[track.album_id]
+        if db_album.type != "album" and track.popularity is None:
+            continue
+        if db_album.spotify_id not in stored:
+            stored[db_album.spotify_id] = AlbumTracks(db_album.catalog)
+        stored[db_album.spotify_id].tracks.append(track.as_dict())
+    return stored
+
+
+async def _resolve_albums_tracks(
+    sp: Spotter, db_albums: List[Album]
+) -> List[Tuple[Album, Optional[AlbumTracks]]]:
+    """db albums with their tracks, from the db when stored at sync time
+
+    the rest are fetched through the multi-id endpoints, concurrently
+    """
+    unique_albums = list({a.spotify_id: a for a in db_albums}.values())
+    stored = await _load_albums_tracks(unique_albums)
+    to_fetch = [a for a in unique_albums if a.spotify_id not in stored]
+    albums_ids = [a.spotify_id for a in to_fetch if a.type == "album"]
+    tracks_ids = [a.spotify_id for a in to_fetch if a.type != "album"]
+
+    args_items = [
+        (sp, _fetch_albums_batch, clean(batch))
+        for batch in grouper(ALBUMS_BATCH_SIZE, albums_ids)
+    ]
+    args_items.extend(
+        (sp, _fetch_tracks_batch, clean(batch))
+        for batch in grouper(_TRACKS_BATCH_SIZE, tracks_ids)
+    )
+    task_results = await run_tasks(
+        Config.ALBUMS_TASKS_AMOUNT, args_items, _fetch_batch
+    )
+
+    fetched = dict(chain.from_iterable(task_results))
+    fetched.update(stored)
+    return [(a, fetched.get(a.spotify_id)) for a in unique_albums]
 
 
 def __update_already_present(already_present_tracks: set, album: AlbumTracks):
@@ -79,17 +154,6 @@ def _clean_update_playlist_already_present(
     return album, already_present_tracks
 
 
-async def _get_album_tracks(sp: Spotter, item: Album, is_album: bool) -> AlbumTracks:
-    if is_album:
-        album = await _make_album_tracks(sp, item)
-    else:
-        track = await sp.client.track(item.uri)
-        if not track:
-            raise SpotifyException(f"failed fetch {track}")
-        album = AlbumTracks(track["album"], [track])
-    return album
-
-
 def _is_various_artists_album(album: dict) -> bool:
     if len(album["artists"]) and album["artists"][0]["name"] == "Various Artists":
         return True
@@ -123,11 +187,9 @@ async def generate_tracks_to_add(  # noqa
     post_process_singles = []  # type: List[AlbumTracks]
     post_process_features = []  # type: List[AlbumTracks]
 
-    for db_album in db_albums:
+    for db_album, album in await _resolve_albums_tracks(sp, db_albums):
         is_album = db_album.type == "album"
-        try:
-            album = await _get_album_tracks(sp, db_album, is_album)
-        except SpotifyException:
+        if album is None:
             _LOGGER.warning(f"failed to fetch {db_album} is_album:{is_album}")
             continue
 
@@ -260,10 +322,10 @@ async def update_user_playlist(
 
 async def _handle_update_user_playlist(
     credentials: SpotifyKeys, user: User, dry_run: bool, fb_alert: FBAlert
-):
+) -> Optional[SpotifyStats]:
     user_config = WeeklyPlaylistUpdateConfig(**user.config[_CONFIG_ID])
     if not user_config.enabled:
-        return
+        return None
     try:
         async with spotify_client(credentials, user) as sp:
             stats = await update_user_playlist(user, sp, dry_run)
@@ -272,6 +334,8 @@ async def _handle_update_user_playlist(
     except SpotifyException as exc:
         _LOGGER.warning(f"{user} failed to update playlist")
         push_sentry_error(exc, user.username, user.display_name)
+        return None
+    return stats
 
 
 async def update_users_playlists(
@@ -280,22 +344,31 @@ async def update_users_playlists(
     user_id: str = None,
     dry_run: bool = False,
     all_markets: bool = False,
-):
-    users = await _get_to_update_users(user_id, all_markets=all_markets)
+    shard: Optional[Tuple[int, int]] = None,
+) -> Dict[str, int]:
+    """entry point for updating users weekly playlists; returns a run summary"""
+    users = await _get_to_update_users(user_id, all_markets=all_markets, shard=shard)
     args_items = [(credentials, user, dry_run, fb_alert) for user in users]
-    await run_tasks(
-        Config.USERS_TASKS_AMOUNT,
-        args_items,
-        _handle_update_user_playlist,
-        _user_task_filter,
+    users_stats = clean(
+        await run_tasks(
+            Config.USERS_TASKS_AMOUNT,
+            args_items,
+            _handle_update_user_playlist,
+            _user_task_filter,
+        )
     )
+    return {
+        "users": len(users),
+        "synced": len(users_stats),
+        "with_new_tracks": len([a for a in users_stats if a.has_new_tracks()]),
+    }
 
 
 async def _handle_update_users_followed_artists_and_weekly_playlists(
     credentials: SpotifyKeys, user: User, dry_run: bool, fb_alert: FBAlert
-):
+) -> Optional[SpotifyStats]:
     await _update_user_artists(credentials, user, force_update=True, dry_run=dry_run)
-    await _handle_update_user_playlist(credentials, user, dry_run, fb_alert)
+    return await _handle_update_user_playlist(credentials, user, dry_run, fb_alert)
 
 
 async def update_users_followed_artists_and_weekly_playlists(
@@ -304,12 +377,27 @@ async def update_users_followed_artists_and_weekly_playlists(
     user_id: str = None,
     dry_run: bool = False,
     all_markets: bool = False,
-):
-    users = await _get_to_update_users(user_id, all_markets=all_markets)
+    user_ids: Optional[List[int]] = None,
+    run_key: Optional[str] = None,
+) -> Dict[str, int]:
+    """with `run_key` users done in that run are skipped, and checkpointed"""
+    users = await _get_to_update_users(
+        user_id, all_markets=all_markets, user_ids=user_ids
+    )
+    users = await skip_done_users(run_key, users)
     args_items = [(credentials, user, dry_run, fb_alert) for user in users]
-    await run_tasks(
-        Config.USERS_TASKS_AMOUNT,
-        args_items,
-        _handle_update_users_followed_artists_and_weekly_playlists,
-        _user_task_filter,
+    users_stats = clean(
+        await run_tasks(
+            Config.USERS_TASKS_AMOUNT,
+            args_items,
+            checkpointed(
+                run_key, _handle_update_users_followed_artists_and_weekly_playlists
+            ),
+            _user_task_filter,
+        )
     )
+    return {
+        "users": len(users),
+        "synced": len(users_stats),
+        "with_new_tracks": len([a for a in users_stats if a.has_new_tracks()]),
+    }
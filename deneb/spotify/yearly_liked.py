@@ -1,25 +1,30 @@
 """Create spotify playlist with liked songs based on years"""
+import asyncio
 import datetime
-from typing import List
+from typing import Dict, List, Optional, Set, Tuple
 
 from spotipy.exceptions import SpotifyException
 
 from deneb.chatbot.message import send_message
 from deneb.config import Config
-from deneb.db import User
+from deneb.db import LikedTrack, PlaylistMirror, User
+from deneb.dispatch import checkpointed, skip_done_users
 from deneb.logger import get_logger, push_sentry_error
 from deneb.sp import SpotifyYearlyStats, Spotter, spotify_client
 from deneb.spotify.common import (
-    _get_to_update_users, _user_task_filter, fetch_all, fetch_user_playlists,
-    update_spotify_playlist
+    _get_to_update_users, _user_task_filter, fetch_user_playlists, get_tracks,
+    iter_items, update_spotify_playlist
 )
 from deneb.structs import FBAlert, LikedSortedYearlyConfig, SpotifyKeys
-from deneb.tools import run_tasks, search_dict_by_key
+from deneb.tools import clean, grouper, run_tasks
 
 _LOGGER = get_logger(__name__)
 
 _CONFIG_ID = "liked-sorted-yearly"
 
+# max ids accepted by the `me/tracks/contains` endpoint
+_CONTAINS_BATCH_SIZE = 50
+
 
 def generate_playlist_name(year: str) -> str:
     """return a string of format `liked from <Year>`"""
@@ -27,10 +32,16 @@ def generate_playlist_name(year: str) -> str:
 
 
 def generate_tracks_to_add(
-    liked_tracks: List[dict], playlist_tracks: List[dict]
+    liked_tracks: List[dict], present_ids: Set[str]
 ) -> List[dict]:
-    already_present_ids = [a["track"]["id"] for a in playlist_tracks]
-    return [a for a in liked_tracks if a["id"] not in already_present_ids]
+    """liked tracks not in the playlist yet, each once"""
+    seen = set(present_ids)
+    to_add = []
+    for track in liked_tracks:
+        if track["id"] not in seen:
+            seen.add(track["id"])
+            to_add.append(track)
+    return to_add
 
 
 async def _sync_with_spotify_playlist(
@@ -40,7 +51,9 @@ async def _sync_with_spotify_playlist(
     playlist: dict,
     playlist_name: str,
     dry_run: bool,
-) -> SpotifyYearlyStats:
+) -> Tuple[SpotifyYearlyStats, bool]:
+    """add the new tracks to the playlist; returns whether all got added"""
+    added = True
     if not dry_run:
         has_new_tracks = bool(new_tracks)
         if not playlist and has_new_tracks:
@@ -49,9 +62,11 @@ async def _sync_with_spotify_playlist(
             )
 
         if has_new_tracks:
-            await update_spotify_playlist(
+            snapshot_id = await update_spotify_playlist(
                 new_tracks, playlist["uri"], sp, insert_top=True
             )
+            playlist = {**playlist, "snapshot_id": snapshot_id}
+            added = snapshot_id is not None
     else:
         playlist = {
             "name": f"dry-run-{playlist_name}",
@@ -63,93 +78,335 @@ async def _sync_with_spotify_playlist(
     _LOGGER.info(
         f"updated playlist: <{playlist_name}> for {user} | {stats.describe(brief=True)}"
     )
-    return stats
+    return stats, added
+
+
+def parse_years(year: Optional[str]) -> Optional[List[str]]:
+    """`--year` value: a year, comma separated years, or `all` (None)
+
+    defaults to the current year
+    """
+    if not year:
+        return [str(datetime.datetime.now().year)]
+    if year == "all":
+        return None
+    return [a.strip() for a in year.split(",")]
+
+
+def liked_cursor(item: dict) -> Dict[str, str]:
+    return {"added_at": item["added_at"], "track_id": item["track"]["id"]}
+
+
+def _reached_cursor(item: dict, cursor: Optional[Dict[str, str]]) -> bool:
+    """liked tracks come newest first; the cursor track may be unliked since"""
+    if cursor is None:
+        return False
+    return (
+        item["track"]["id"] == cursor["track_id"]
+        or item["added_at"] < cursor["added_at"]
+    )
+
+
+class LikedByYear:
+    """liked tracks split by their release year, in one pass, newest first
+
+    a year is done once the scan gets to its stop point: the newest liked
+    track seen on its last run (cursor), or its playlist last added track.
+    The scan is over when every wanted year is, never for all years (None)
+    """
+
+    def __init__(
+        self,
+        years: Optional[List[str]],
+        cursors: Dict[str, Dict[str, str]],
+        last_added: Dict[str, str],
+    ) -> None:
+        self.years = years
+        self.stops = {
+            year: (cursors.get(year), last_added.get(year))
+            for year in set(cursors) | set(last_added)
+            if years is None or year in years
+        }
+        self.done = set()  # type: Set[str]
+        self.tracks = {}  # type: Dict[str, List[dict]]
+
+    def add(self, item: dict) -> bool:
+        """sort a liked track in its year; returns True once the scan is over"""
+        for year, (cursor, last_added_id) in self.stops.items():
+            if year in self.done:
+                continue
+            if _reached_cursor(item, cursor) or item["track"]["id"] == last_added_id:
+                self.done.add(year)
+
+        year = item["track"]["album"]["release_date"][:4]
+        if year not in self.done and (self.years is None or year in self.years):
+            self.tracks.setdefault(year, []).append(item["track"])
+        return self.years is not None and self.done.issuperset(self.years)
 
 
-async def _fetch_year_tracks_from_saved(
-    user: User, sp: Spotter, year: str, last_added_track_id: str = None
+async def _scan_new_liked(
+    sp: Spotter, cursor: Optional[Dict[str, str]]
 ) -> List[dict]:
-    current_year_tracks = []
-    all_liked_partial = await sp.client.current_user_saved_tracks()
+    """liked items newer than the cursor, the whole library without one"""
+    items = []
+    all_liked_partial = await sp.client.current_user_saved_tracks(
+        limit=Config.LIKED_TRACKS_PAGE_SIZE
+    )
+    async for item in iter_items(sp, all_liked_partial):
+        if _reached_cursor(item, cursor):
+            break
+        items.append(item)
+    return items
+
+
+async def _fetch_tracks_by_year(
+    user: User,
+    sp: Spotter,
+    years: Optional[List[str]],
+    cursors: Dict[str, Dict[str, str]],
+    last_added: Dict[str, str],
+    dry_run: bool,
+) -> Tuple[Dict[str, List[dict]], Optional[Dict[str, str]]]:
+    """new liked tracks by release year, see `LikedByYear`
+
+    only tracks liked since the user liked index was last updated are
+    fetched, the years are sorted out of the index. Returns them along with
+    the cursor of the newest liked track, to start from next time. A dry run
+    leaves the index as is, sorting the fetched tracks ahead of it
+    """
+    index_cursor = await LikedTrack.newest_cursor(user.id)
+    new_items = await _scan_new_liked(sp, index_cursor)
+    if not dry_run:
+        await LikedTrack.store(user.id, new_items)
 
-    all_liked_songs = await fetch_all(sp, all_liked_partial)
+    # years with a cursor need only what was liked since
+    since = None
+    if years is not None and all(a in cursors for a in years):
+        since = min(cursors[a]["added_at"] for a in years)
 
-    for item in all_liked_songs:
-        if item["track"]["id"] == last_added_track_id:
+    items = await LikedTrack.load(user.id, years, since)
+    if dry_run:
+        new_ids = {a["track"]["id"] for a in new_items}
+        items = new_items + [a for a in items if a["track"]["id"] not in new_ids]
+
+    liked = LikedByYear(years, cursors, last_added)
+    for item in items:
+        if liked.add(item):
             break
 
-        if item["track"]["album"]["release_date"][:4] == year:
-            current_year_tracks.append(item["track"])
+    new_cursor = liked_cursor(new_items[0]) if new_items else index_cursor
+    return liked.tracks, new_cursor
+
+
+async def _playlist_tracks_ids(
+    sp: Spotter, playlist: dict, mirror: Optional[PlaylistMirror]
+) -> Set[str]:
+    """playlist track ids, from its mirror while the playlist didn't change"""
+    if not playlist:
+        return set()
+    if mirror is not None:
+        tracks_ids = mirror.tracks_of(playlist)
+        if tracks_ids is not None:
+            return tracks_ids
+    return {a["track"]["id"] for a in await get_tracks(sp, playlist) if a["track"]}
+
+
+async def _saved_tracks_contains(sp: Spotter, tracks_ids: List[str]) -> List[bool]:
+    return await sp.client.current_user_saved_tracks_contains(tracks_ids)
+
+
+async def _drop_unliked(
+    user: User, sp: Spotter, tracks: List[dict], dry_run: bool
+) -> List[dict]:
+    """tracks still liked; the unliked ones are dropped from the liked index"""
+    batches = [
+        [a["id"] for a in clean(batch)]
+        for batch in grouper(_CONTAINS_BATCH_SIZE, tracks)
+    ]
+    results = await asyncio.gather(*[_saved_tracks_contains(sp, a) for a in batches])
+    liked_ids = {
+        track_id
+        for batch, contains in zip(batches, results)
+        for track_id, is_liked in zip(batch, contains)
+        if is_liked
+    }
+    unliked_ids = [a["id"] for a in tracks if a["id"] not in liked_ids]
+    if unliked_ids and not dry_run:
+        await LikedTrack.forget(user.id, unliked_ids)
+    return [a for a in tracks if a["id"] in liked_ids]
+
+
+async def _find_playlists(sp: Spotter) -> Dict[str, dict]:
+    """user liked by year playlists, by year"""
+    prefix = generate_playlist_name("")
+    playlists = {}  # type: Dict[str, dict]
+    for playlist in await fetch_user_playlists(sp):
+        year = playlist["name"][len(prefix) :]
+        if playlist["name"].startswith(prefix) and year.isdigit():
+            playlists.setdefault(year, playlist)
+    return playlists
+
+
+async def _last_added_track_id(sp: Spotter, playlist: dict) -> Optional[str]:
+    # not using `get_tracks` because there's need for the first item
+    # from first batch only
+    playlist_tracks = await sp.client.user_playlist(
+        sp.userdata["id"], playlist["id"], fields="tracks,next"
+    )
+    playlist_tracks = playlist_tracks.get("tracks", {}).get("items", [])
+    if not playlist_tracks:
+        return None
+    return playlist_tracks[0]["track"]["id"]
+
+
+async def _last_added_tracks(
+    sp: Spotter, playlists: Dict[str, dict]
+) -> Dict[str, str]:
+    """last added track id of the playlists, by year, fetched concurrently"""
+
+    async def _year_last_added(year: str) -> Tuple[str, Optional[str]]:
+        # results come as they finish, not in the years order
+        return year, await _last_added_track_id(sp, playlists[year])
+
+    years_tracks_ids = await run_tasks(
+        Config.PAGES_TASKS_AMOUNT, [(a,) for a in playlists], _year_last_added
+    )
+    return {year: a for year, a in years_tracks_ids if a}
+
+
+async def _playlists_tracks_ids(
+    sp: Spotter, playlists: Dict[str, dict], mirrors: Dict[str, PlaylistMirror]
+) -> Dict[str, Set[str]]:
+    """track ids of the playlists, by year, fetched concurrently"""
 
-    return current_year_tracks
+    async def _year_tracks_ids(year: str) -> Tuple[str, Set[str]]:
+        return year, await _playlist_tracks_ids(sp, playlists[year], mirrors.get(year))
+
+    return dict(
+        await run_tasks(
+            Config.PAGES_TASKS_AMOUNT, [(a,) for a in playlists], _year_tracks_ids
+        )
+    )
+
+
+async def _sync_year_playlist(
+    user: User,
+    sp: Spotter,
+    year: str,
+    liked_tracks: List[dict],
+    playlist: dict,
+    present_ids: Set[str],
+    dry_run: bool,
+) -> Tuple[SpotifyYearlyStats, bool]:
+    """add the liked tracks not in it yet to the year playlist, and mirror it
+
+    returns whether all the tracks got added
+    """
+    new_tracks = generate_tracks_to_add(liked_tracks, present_ids)
+    # liked tracks come from the index, which may hold tracks unliked since
+    new_tracks = await _drop_unliked(user, sp, new_tracks, dry_run)
+    stats, added = await _sync_with_spotify_playlist(
+        user, sp, new_tracks, playlist, generate_playlist_name(year), dry_run
+    )
+    if not dry_run and stats.playlist:
+        await PlaylistMirror.store(
+            user.id,
+            year,
+            stats.playlist["id"],
+            stats.playlist.get("snapshot_id"),
+            present_ids | {a["id"] for a in new_tracks},
+        )
+    return stats, added
 
 
 async def _handle_saved_songs_by_year_playlist(
-    credentials: SpotifyKeys, user: User, year: str, dry_run: bool, fb_alert: FBAlert
-) -> None:
+    credentials: SpotifyKeys,
+    user: User,
+    years: Optional[List[str]],
+    dry_run: bool,
+    fb_alert: FBAlert,
+) -> Optional[List[SpotifyYearlyStats]]:
     """Main task runner which will:
-        - fetch playlist based on year and it's tracks
-        - fetch first first batch of tracks from playlist if exists
-        - first (which is last added) track is used as stop point for
-          fetching liked tracks
-        - fetch liked tracks up to last added track id previously fetched
-        - sync with playlist (and create if non-existent) new tracks
+        - for years without a cursor (the newest liked track seen last run),
+          fetch their playlists first (which is last added) track as stop
+          point instead
+        - fetch liked tracks newer than the liked index into it, once
+        - sort the index tracks by year, each up to its year stop point
+        - add to every year playlist (and create if non-existent) the tracks
+          not in it, as known from its mirror while its snapshot is the same,
+          and still liked
+        - keep the newest liked track as cursor for next run, for the years
+          whose new tracks all got added
+
+    `years` None is for every year
     """
     user_config = LikedSortedYearlyConfig(**user.config[_CONFIG_ID])
     if not user_config.enabled:
-        return
+        return None
     try:
         async with spotify_client(credentials, user) as sp:
-            # fetch playlist if exist and get last added track as reference
-            # to when to stop seeking in liked songs
-            playlist_name = generate_playlist_name(year)
-            user_playlists = await fetch_user_playlists(sp)
-
-            is_created, playlist = search_dict_by_key(
-                playlist_name, user_playlists, "name"
-            )
-
-            # not using `get_tracks` because there's need for the first item
-            # from first batch only
-            playlist_tracks = (
-                await sp.client.user_playlist(
-                    sp.userdata["id"], playlist["id"], fields="tracks,next"
+            _LOGGER.info(f"updating liked playlists of {years or 'all'} for {user}")
+
+            cursors = user.liked_cursors or {}
+            playlists = None  # type: Optional[Dict[str, dict]]
+            last_added = {}  # type: Dict[str, str]
+            if years is None or any(a not in cursors for a in years):
+                playlists = await _find_playlists(sp)
+                last_added = await _last_added_tracks(
+                    sp, {a: b for a, b in playlists.items() if a not in cursors}
                 )
-                if is_created
-                else {}
-            )
-
-            # unpack tracks
-            playlist_tracks = playlist_tracks.get("tracks", {}).get("items", [])
-
-            # last added track if so
-            last_added_track_id = None
-
-            if playlist_tracks:
-                last_added_track_id = playlist_tracks[0]["track"]["id"]
-
-            _LOGGER.info(f"updating playlist: <{playlist_name}> for {user}")
 
+            new_cursor = None
             try:
-                new_tracks = await _fetch_year_tracks_from_saved(
-                    user, sp, year, last_added_track_id
+                tracks_by_year, new_cursor = await _fetch_tracks_by_year(
+                    user, sp, years, cursors, last_added, dry_run
                 )
             except SpotifyException:
                 msg = f"Bad spotify request attempt from {user}"
                 push_sentry_error(msg, user.fb_id, sp.userdata["id"], is_exc=False)
                 _LOGGER.exception(msg)
-                new_tracks = []
-
-            stats = await _sync_with_spotify_playlist(
-                user, sp, new_tracks, playlist, playlist_name, dry_run
-            )
+                tracks_by_year = {}
+
+            # nothing new liked, the usual case, needs no playlist lookup
+            years_playlists = {}  # type: Dict[str, dict]
+            present_ids = {}  # type: Dict[str, Set[str]]
+            if tracks_by_year:
+                if playlists is None:
+                    playlists = await _find_playlists(sp)
+                years_playlists = {a: playlists.get(a, {}) for a in tracks_by_year}
+                present_ids = await _playlists_tracks_ids(
+                    sp, years_playlists, await PlaylistMirror.by_year(user.id)
+                )
 
-            if fb_alert.notify and stats.has_new_tracks():
-                await send_message(user.fb_id, fb_alert, stats.describe())
+            all_stats = []
+            failed_years = set()  # type: Set[str]
+            for year, liked_tracks in sorted(tracks_by_year.items()):
+                stats, added = await _sync_year_playlist(
+                    user,
+                    sp,
+                    year,
+                    liked_tracks,
+                    years_playlists[year],
+                    present_ids[year],
+                    dry_run,
+                )
+                all_stats.append(stats)
+                if not added:
+                    failed_years.add(year)
+                if fb_alert.notify and stats.has_new_tracks():
+                    await send_message(user.fb_id, fb_alert, stats.describe())
+
+            if not dry_run and new_cursor is not None:
+                scanned = years or set(tracks_by_year) | set(cursors) | set(last_added)
+                # years whose tracks failed to be added go over them next run
+                await user.update_liked_cursors(
+                    {a: new_cursor for a in scanned if a not in failed_years}
+                )
     except Exception as exc:
         _LOGGER.exception(f"{user} failed to save liked songs by year")
         push_sentry_error(exc, user.username, user.display_name)
-    return
+        return None
+    return all_stats
 
 
 async def update_users_playlists_liked_by_year(
@@ -158,16 +415,37 @@ async def update_users_playlists_liked_by_year(
     user_id: str = None,
     year: str = None,
     dry_run: bool = False,
-) -> None:
-    users = await _get_to_update_users(user_id, all_markets=True)
-
-    if not year:
-        year = str(datetime.datetime.now().year)
-
-    args_items = [(credentials, user, year, dry_run, fb_alert) for user in users]
-    await run_tasks(
-        Config.USERS_TASKS_AMOUNT,
-        args_items,
-        _handle_saved_songs_by_year_playlist,
-        _user_task_filter,
+    shard: Optional[Tuple[int, int]] = None,
+    user_ids: Optional[List[int]] = None,
+    run_key: Optional[str] = None,
+) -> Dict[str, int]:
+    """entry point for updating users liked by year playlists; returns a run summary
+
+    `year` is as `parse_years` takes it, every year comes out of a single
+    scan of the liked tracks; with `run_key` users done in that run are
+    skipped, and checkpointed
+    """
+    users = await _get_to_update_users(
+        user_id, all_markets=True, shard=shard, user_ids=user_ids
     )
+    users = await skip_done_users(run_key, users)
+
+    years = parse_years(year)
+    args_items = [(credentials, user, years, dry_run, fb_alert) for user in users]
+    users_stats = [
+        a
+        for a in await run_tasks(
+            Config.USERS_TASKS_AMOUNT,
+            args_items,
+            checkpointed(run_key, _handle_saved_songs_by_year_playlist),
+            _user_task_filter,
+        )
+        if a is not None
+    ]
+    return {
+        "users": len(users),
+        "synced": len(users_stats),
+        "with_new_tracks": len(
+            [a for a in users_stats if any(b.has_new_tracks() for b in a)]
+        ),
+    }
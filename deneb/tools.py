@@ -1,8 +1,13 @@
 """Helper tools"""
 import asyncio
 import datetime
+import zlib
 from itertools import zip_longest
-from typing import Any, Callable, Dict, List, Optional, Tuple
+from typing import (
+    Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+)
+
+_WORKER_DONE = object()
 
 
 def grouper(n, iterable, padvalue=None):
@@ -27,6 +32,20 @@ def search_dict_by_key(
     return False, {}
 
 
+def shard_of(key: Any, shards: int) -> int:
+    """stable shard index of key, the same in every process and run"""
+    return zlib.crc32(str(key).encode()) % shards
+
+
+def merge_summaries(summaries: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """add up the numbers of run summaries, key by key"""
+    merged = {}  # type: Dict[str, Any]
+    for summary in summaries:
+        for key, value in summary.items():
+            merged[key] = merged.get(key, 0) + value
+    return merged
+
+
 def convert_to_date(date_item: datetime.datetime) -> datetime.date:
     """Issues with Postgres, only accepts datetime.date instances for DateField"""
     return datetime.date(year=date_item.year, month=date_item.month, day=date_item.day)
@@ -40,49 +59,64 @@ def generate_release_date(date: str, precision: str) -> datetime.date:
     )
 
 
-def _create_jobs(func: Callable, args_items: List[Any]) -> List[asyncio.Future]:
-    return [asyncio.create_task(func(*item)) for item in args_items]
-
+async def iter_tasks(
+    queue_size: int,
+    args_items: Iterable[Any],
+    afunc: Callable,
+    items_filter: Optional[Callable] = None,
+) -> AsyncIterator[Any]:
+    """run `afunc(*args)` for every args item, yield results as they finish
 
-def _take(
-    amount: int, items: List[Any], can_add_filter: Callable
-) -> Tuple[List[Any], List[Any]]:
-    taken_items = []  # type: List[Any]
-    for idx, item in enumerate(items):
-        if len(taken_items) == amount:
-            return taken_items, items[idx:]
-        if can_add_filter(args=item):
-            taken_items.append(item)
-    return taken_items, []
+    `queue_size` workers pull items one by one, so items are filtered right
+    before they start, and only `queue_size` results wait for the consumer.
+    The first failing item stops the run and raises its error.
+    """
+    items_filter = items_filter or (lambda args: args)
+    items = (args for args in args_items if items_filter(args=args))
+    results = asyncio.Queue(maxsize=queue_size)  # type: asyncio.Queue
+
+    stopping = False
+
+    async def _worker() -> None:
+        try:
+            for args in items:
+                await results.put((await afunc(*args), None))
+        except BaseException as exc:
+            if stopping:
+                raise
+            # cancelled from elsewhere too, the consumer must not wait on it
+            await results.put((None, exc))
+            if not isinstance(exc, Exception):
+                raise
+        else:
+            await results.put((_WORKER_DONE, None))
+
+    workers = [asyncio.ensure_future(_worker()) for _ in range(queue_size)]
+    running = len(workers)
+    try:
+        while running:
+            result, exc = await results.get()
+            if result is _WORKER_DONE:
+                running -= 1
+            elif exc is not None:
+                raise exc
+            else:
+                yield result
+    finally:
+        stopping = True
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
 
 
 async def run_tasks(
     queue_size: int,
-    args_items_left: List[Any],
+    args_items: Iterable[Any],
     afunc: Callable,
     items_filter: Optional[Callable] = None,
 ) -> List[Any]:
-    items_filter = items_filter or (lambda args: args)
-
-    args_items_batch, args_items_left = _take(queue_size, args_items_left, items_filter)
-    jobs = _create_jobs(afunc, args_items_batch)
-    job_results = []
-
-    while jobs:
-        done_tasks, pending = await asyncio.wait(
-            jobs, return_when=asyncio.FIRST_COMPLETED
-        )
-        while done_tasks:
-            done_task = done_tasks.pop()
-            jobs.remove(done_task)
-            result = await done_task
-            job_results.append(result)
-
-        if args_items_left:
-            required_amount = queue_size - len(pending)
-            args_items_batch, args_items_left = _take(
-                required_amount, args_items_left, items_filter
-            )
-            jobs.extend(_create_jobs(afunc, args_items_batch))
-
-    return job_results
+    """run `afunc(*args)` for every args item, `queue_size` at a time"""
+    return [
+        result
+        async for result in iter_tasks(queue_size, args_items, afunc, items_filter)
+    ]
@@ -4,16 +4,15 @@ import asyncpg
 from tortoise import Tortoise
 from tortoise.backends.asyncpg.client import AsyncpgDBClient
 
+from deneb.config import Config
+
 
 @asynccontextmanager
 async def get_pool(client: "PoolAsyncpgDBClient") -> asyncpg.connection:
     if not client.pool:
         await client.init_pool()
-    try:
-        async with client.pool.acquire() as connection:
-            yield connection
-    finally:
-        pass
+    async with client.pool.acquire() as connection:
+        yield connection
 
 
 class PoolAsyncpgDBClient(AsyncpgDBClient):
@@ -29,7 +28,9 @@ class PoolAsyncpgDBClient(AsyncpgDBClient):
             port=self.port,
             database=self.database,
         )
-        self.pool = await asyncpg.create_pool(dsn=dsn, min_size=19, max_size=20)
+        self.pool = await asyncpg.create_pool(
+            dsn=dsn, min_size=Config.DB_POOL_SIZE - 1, max_size=Config.DB_POOL_SIZE
+        )
         self.con = await self.pool.acquire()
         return self.pool
 
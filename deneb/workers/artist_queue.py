@@ -0,0 +1,51 @@
+"""Artist sync through the work queue shared by every node"""
+from typing import Dict, List
+
+from deneb.config import Config
+from deneb.db import Artist, ArtistSyncJob
+from deneb.logger import get_logger, push_sentry_error
+from deneb.sp import Spotter
+from deneb.workers.artist_sync import get_new_releases
+
+_LOGGER = get_logger(__name__)
+
+
+async def _sync_artists(sp: Spotter, artists_ids: List[int]) -> int:
+    artists = await Artist.filter(id__in=artists_ids)
+    # claimed jobs are due, no need to check again
+    albums_nr, _ = await get_new_releases(sp, artists, force_update=True)
+    return albums_nr
+
+
+async def drain_artist_queue(sp: Spotter) -> Dict[str, int]:
+    """claim and sync batches of queued artists until none is due
+
+    failed batches go back to the queue, to be retried later
+    """
+    summary = {"artists": 0, "albums": 0, "failed": 0}
+    while True:
+        artists_ids = await ArtistSyncJob.claim(
+            Config.ARTIST_QUEUE_BATCH_SIZE, Config.ARTIST_QUEUE_LEASE_SECONDS
+        )
+        if not artists_ids:
+            break
+
+        try:
+            albums_nr = await _sync_artists(sp, artists_ids)
+        except Exception as exc:
+            _LOGGER.exception(f"failed to sync queued artists {artists_ids}")
+            push_sentry_error(exc, sp.userdata["id"], sp.userdata["display_name"])
+            dropped = await ArtistSyncJob.release(
+                artists_ids,
+                Config.ARTIST_QUEUE_RETRY_SECONDS,
+                Config.ARTIST_QUEUE_MAX_ATTEMPTS,
+            )
+            if dropped:
+                _LOGGER.warning(f"gave up on syncing artists {dropped}")
+            summary["failed"] += len(artists_ids)
+            continue
+
+        await ArtistSyncJob.complete(artists_ids)
+        summary["artists"] += len(artists_ids)
+        summary["albums"] += albums_nr
+    return summary
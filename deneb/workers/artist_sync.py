@@ -1,79 +1,177 @@
 """Module to handle artist related updates"""
+import asyncio
 import datetime
 import time
 from functools import partial
-from typing import Dict, Iterable, List, Tuple
+from itertools import chain
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
 
 from deneb.config import Config
-from deneb.db import Album, Artist, PoolTortoise
+from deneb.db import Album, Artist, PoolTortoise, Track
 from deneb.logger import get_logger, push_sentry_error
 from deneb.sp import SpotifyException, Spotter
+from deneb.spotify.album_tracks import ALBUMS_BATCH_SIZE, get_albums_tracks
 from deneb.spotify.common import fetch_all
-from deneb.tools import run_tasks, search_dict_by_key
+from deneb.structs import AlbumTracks
+from deneb.tools import (
+    clean, generate_release_date, grouper, iter_tasks, run_tasks, search_dict_by_key
+)
 
 _LOGGER = get_logger(__name__)
 
 
-def should_fetch_more_albums(
-    albums: List[Dict], to_check_album_types: List[str]
-) -> Tuple[bool, List[Dict], List[str]]:
+# the order spotify lists artist album groups in
+_ALBUM_GROUPS = ["album", "single", "appears_on"]
+
+
+def _album_group(album: Dict) -> str:
+    return album.get("album_group", album["album_type"])
+
+
+def _release_date(album: Dict) -> datetime.date:
+    return generate_release_date(album["release_date"], album["release_date_precision"])
+
+
+def is_known_release(album: Dict, mark: Optional[Dict]) -> bool:
+    """True if album is the release mark of its group or older than it
+
+    artists never synced before have no mark; albums released before the
+    current month are considered known for them
     """
-    filter artist albums from current year only and return if more fetching
-    required
-    #TODO: add year as a function argument
+    if mark is None:
+        return _release_date(album) < datetime.date.today().replace(day=1)
+    if album["id"] == mark["id"]:
+        return True
+    return _release_date(album) < datetime.date.fromisoformat(mark["release_date"])
+
+
+class AlbumsCollector:
+    """collect artist albums newer than the artist release marks
+
+    albums come grouped by `album_group` and newest first inside each group,
+    so a group is done at its first known album and the first album seen
+    of a group is its new release mark. Used as `fetch_all` stop predicate,
+    paging stops once every group is done.
+
+    a group paged only partly keeps its old mark, else the albums between
+    the two marks would never be looked at again
     """
-    required_year = str(datetime.datetime.now().year)
-    required_month = "{:02d}".format(datetime.datetime.now().month)
 
-    validated_albums = []  # type: List[dict]
-    for album in albums:
-        if album["album_type"] in to_check_album_types:
-            to_check_album_types.remove(album["album_type"])
-        if f"{required_year}-{required_month}" in album["release_date"]:
-            validated_albums.append(album)
-        else:
-            if not to_check_album_types:
-                return False, validated_albums, to_check_album_types
+    def __init__(
+        self, marks: Optional[Dict[str, Dict]], groups: Optional[List[str]] = None
+    ) -> None:
+        self.marks = marks or {}
+        self.seen_marks = {}  # type: Dict[str, Dict]
+        self.pending_groups = list(groups or _ALBUM_GROUPS)
+        self.albums = []  # type: List[Dict]
+
+    def __call__(self, items: List[Dict]) -> bool:
+        for album in items:
+            group = _album_group(album)
+            if group not in _ALBUM_GROUPS:
+                continue
+
+            # once a group shows up, the groups listed before it are over
+            position = _ALBUM_GROUPS.index(group)
+            self.pending_groups = [
+                a for a in self.pending_groups if _ALBUM_GROUPS.index(a) >= position
+            ]
+            if group not in self.pending_groups:
+                continue
+
+            if group not in self.seen_marks:
+                self.seen_marks[group] = {
+                    "id": album["id"],
+                    "release_date": _release_date(album).isoformat(),
+                }
+
+            if is_known_release(album, self.marks.get(group)):
+                self.pending_groups.remove(group)
+            else:
+                self.albums.append(album)
+
+        return not self.pending_groups
+
+    def new_marks(self, paged_through: bool) -> Dict[str, Dict]:
+        """release marks of the done groups, or of all if paged through"""
+        marks = dict(self.marks)
+        for group, mark in self.seen_marks.items():
+            if paged_through or group not in self.pending_groups:
+                marks[group] = mark
+        return marks
+
+
+async def fetch_all_albums(
+    sp: Spotter,
+    data: dict,
+    marks: Optional[Dict[str, Dict]] = None,
+    groups: Optional[List[str]] = None,
+) -> Tuple[List[Dict], Dict[str, Dict]]:
+    """fetch albums newer than the release marks; returns them and new marks"""
+    collector = AlbumsCollector(marks, groups)
+    items = await fetch_all(sp, data, stop_when=collector)
+    # fetch_all gives back what it got so far when a page fails
+    paged_through = bool(data) and len(items) >= data.get("total", 0)
 
-    return True, validated_albums, to_check_album_types
+    # there are some duplicates, remove them
+    contents = list({v["id"]: v for v in collector.albums}.values())
+    return contents, collector.new_marks(paged_through)
 
 
-async def fetch_all_albums(sp: Spotter, data: dict) -> List[Dict]:
-    # ok, so this new `to_check_album_types` is a hack to fix-up a problem
-    # the issues constits in the fact the as we fetch albums
-    # we retrieve several `album_types`, like `album`, `single`, `appears_on`
-    # and they are returned back in descendant order by `release_date`, the catch
-    # is that they are group, meaning that you'll then them ordered that way but
-    # first the `albums`, then the `single` and `appears_on`. This made the script
-    # to miss some `sinlge` and `appears_on` type of albums
+async def _fetch_group_albums(
+    sp: Spotter, artist: Artist, group: str
+) -> Tuple[List[Dict], Dict[str, Dict]]:
+    data = await sp.client.artist_albums(
+        artist.spotify_id, limit=50, album_type=group
+    )
+    return await fetch_all_albums(sp, data, artist.release_marks, groups=[group])
 
-    to_check_album_types = ["album", "single", "appears_on"]
-    contents = []
 
-    while True:
-        should, albums, to_check_album_types = should_fetch_more_albums(
-            data["items"], to_check_album_types
-        )
-        contents.extend(albums)
-        if not should or not data["next"]:
-            break
-        data = await sp.client.next(data)  # noqa: B305
-        # sp.client.next sometimes might return just `None`
-        if not data:
-            break
+async def _fetch_albums_by_group(
+    sp: Spotter, artist: Artist
+) -> Tuple[List[Dict], Dict[str, Dict]]:
+    """the first page of all the groups, then a request chain per group left
 
-    # there are some duplicates, remove them
-    contents = list({v["id"]: v for v in contents}.values())
-    return contents
+    with all the groups in one request they come one after another, so
+    reaching `appears_on` means paging through all the albums and singles;
+    groups not done within the first page are paged on their own
+    """
+    data = await sp.client.artist_albums(
+        artist.spotify_id, limit=50, album_type=",".join(_ALBUM_GROUPS)
+    )
+    collector = AlbumsCollector(artist.release_marks)
+    if not data or collector(data["items"]) or not data["next"]:
+        albums = list({v["id"]: v for v in collector.albums}.values())
+        return albums, collector.new_marks(paged_through=bool(data))
+
+    groups = collector.pending_groups
+    results = await asyncio.gather(
+        *[_fetch_group_albums(sp, artist, group) for group in groups]
+    )
+
+    albums = list(collector.albums)
+    marks = collector.new_marks(paged_through=False)
+    for group, (group_albums, group_marks) in zip(groups, results):
+        albums.extend(group_albums)
+        if group in group_marks:
+            marks[group] = group_marks[group]
+
+    albums = list({v["id"]: v for v in albums}.values())
+    return albums, marks
 
 
 async def fetch_albums(sp: Spotter, artist: Artist, retry: bool = True) -> List[dict]:
     """fetches artist albums from spotify"""
     try:
-        data = await sp.client.artist_albums(
-            artist.spotify_id, limit=50, album_type="album,single,appears_on"
-        )
-        albums = await fetch_all_albums(sp, data)
+        if Config.ALBUMS_FETCH_BY_GROUP:
+            albums, artist.release_marks = await _fetch_albums_by_group(sp, artist)
+        else:
+            data = await sp.client.artist_albums(
+                artist.spotify_id, limit=50, album_type=",".join(_ALBUM_GROUPS)
+            )
+            albums, artist.release_marks = await fetch_all_albums(
+                sp, data, artist.release_marks
+            )
     except SpotifyException as exc:
         _LOGGER.warning(f"failed fetch artist albums for `{artist}`: {exc}")
         return []
@@ -100,15 +198,18 @@ def is_in_artists_list(artist: Artist, item: dict) -> bool:
 
 async def get_featuring_songs(sp: Spotter, artist: Artist, album: dict) -> List[dict]:
     """get feature tracks from an album for an artist"""
-    tracks = await sp.client.album_tracks(album_id=album["id"], limit=50)
-    tracks = await fetch_all(sp, tracks)
+    # the same album comes up for every artist featured on it
+    albums = await get_albums_tracks(sp, [album["id"]])
+    if album["id"] not in albums:
+        return []
     feature_tracks = []
 
-    for track in tracks:
+    for track in albums[album["id"]].tracks:
         if is_in_artists_list(artist, track):
             # track has no release date, so grab it
             track["release_date"] = album["release_date"]
             track["release_date_precision"] = album["release_date_precision"]
+            track["album"] = album
             feature_tracks.append(track)
     return feature_tracks
 
@@ -155,24 +256,10 @@ async def update_album_marketplace(
                 )
 
 
-async def handle_album_sync(album: dict, artist: Artist) -> Tuple[bool, Album]:
-    db_album, created = await Album.get_or_create(album)
-    has_artist = await db_album.artists.filter(id=artist.id)
-    if not has_artist:
-        await db_album.artists.add(artist)
-
-    # update it's marketplaces, for availability
-    # TODO: disabled because not using this stuff;
-    # think of where should marketplace be used and if not, removed;
-    # not that big of an issue at this point with unavailable songs in playlists;
-    # await update_album_marketplace(db_album, album["available_markets"])
-    return created, db_album
-
-
-async def update_artist_albums(
-    sp: Spotter, artist: Artist, dry_run: bool = False
-) -> Tuple[Artist, List[Album]]:
-    """update artist albums by adding them to the db"""
+async def fetch_artist_releases(
+    sp: Spotter, artist: Artist
+) -> Tuple[Artist, List[dict]]:
+    """fetch artist albums and featuring tracks to be stored as albums"""
     albums = await fetch_albums(sp, artist)
     processed_albums = []
 
@@ -194,19 +281,92 @@ async def update_artist_albums(
         else:
             processed_albums.append(album)
 
-    args_items = [(album, artist) for album in processed_albums]
+    return artist, processed_albums
+
+
+async def _fetch_albums_tracks(
+    sp: Spotter, ids: List[str]
+) -> Dict[str, AlbumTracks]:
+    try:
+        return await get_albums_tracks(sp, ids)
+    except SpotifyException as exc:
+        _LOGGER.warning(f"failed to fetch albums tracks {ids}: {exc}")
+        return {}
+
+
+async def store_albums_tracks(sp: Spotter, albums: List[Album]) -> None:
+    """store the tracks of new albums, so playlists get built from the db"""
+    db_albums = {a.spotify_id: a for a in albums if a.type == "album"}
+    args_items = [
+        (sp, clean(batch)) for batch in grouper(ALBUMS_BATCH_SIZE, list(db_albums))
+    ]
     task_results = await run_tasks(
-        Config.ALBUMS_TASKS_AMOUNT, args_items, handle_album_sync
+        Config.ALBUMS_TASKS_AMOUNT, args_items, _fetch_albums_tracks
+    )
+    await Track.bulk_store(
+        [
+            (db_albums[spotify_id].id, album.tracks)
+            for fetched in task_results
+            for spotify_id, album in fetched.items()
+        ]
+    )
+
+
+async def store_releases(
+    sp: Spotter, artists_albums: List[Tuple[dict, Artist]]
+) -> Dict[int, List[Album]]:
+    """bulk insert releases with their tracks; returns new albums by artist id"""
+    new_albums = {}  # type: Dict[int, List[Album]]
+    for batch in grouper(Config.ALBUMS_BULK_SIZE, artists_albums):
+        for artist_id, albums in (await Album.bulk_sync(clean(batch))).items():
+            new_albums.setdefault(artist_id, []).extend(albums)
+
+    # featuring tracks come with their track, albums need theirs fetched
+    await store_albums_tracks(sp, list(chain.from_iterable(new_albums.values())))
+    return new_albums
+
+
+async def store_artists_releases(
+    sp: Spotter, artists_releases: List[Tuple[Artist, List[dict]]]
+) -> Dict[int, List[Album]]:
+    """bulk insert fetched releases; returns new albums by artist id"""
+    new_albums = await store_releases(
+        sp,
+        [(album, artist) for artist, albums in artists_releases for album in albums],
     )
 
+    # update it's marketplaces, for availability
+    # TODO: disabled because not using this stuff;
+    # think of where should marketplace be used and if not, removed;
+    # not that big of an issue at this point with unavailable songs in playlists;
+    # await update_album_marketplace(db_album, album["available_markets"])
+
+    artists = [artist for artist, _ in artists_releases]
     try:
-        await artist.update_synced_at()
+        await Artist.bulk_update_synced(artists)
     except Exception as exc:
-        _LOGGER.exception(f"{sp.userdata['id']} failed to update {artist} synced_at")
+        _LOGGER.exception(f"{sp.userdata['id']} failed to update {artists} synced_at")
         push_sentry_error(exc, sp.userdata["id"], sp.userdata["display_name"])
 
-    new_inserts = [a for created, a in task_results if created]
-    return artist, new_inserts
+    return new_albums
+
+
+async def update_artist_albums(
+    sp: Spotter, artist: Artist, dry_run: bool = False
+) -> Tuple[Artist, List[Album]]:
+    """update artist albums by adding them to the db"""
+    artist_releases = await fetch_artist_releases(sp, artist)
+    new_albums = await store_artists_releases(sp, [artist_releases])
+    return artist, new_albums.get(artist.id, [])
+
+
+async def _claimed_fetch_artist_releases(
+    sp: Spotter, artist: Artist, force_update: bool
+) -> Optional[Tuple[Artist, List[dict]]]:
+    """fetch artist releases unless another task already claimed the artist"""
+    if not force_update and not await artist.claim_update():
+        return None
+    return await fetch_artist_releases(sp, artist)
 
 
 def _album_filter(force: bool, args: Tuple[Spotter, Artist]) -> bool:
@@ -215,28 +375,60 @@ def _album_filter(force: bool, args: Tuple[Spotter, Artist]) -> bool:
     return False
 
 
+async def _releases_batches(
+    results: AsyncIterator[Optional[Tuple[Artist, List[dict]]]]
+) -> AsyncIterator[List[Tuple[Artist, List[dict]]]]:
+    """group fetched artists releases by about `ALBUMS_BULK_SIZE` albums"""
+    batch = []  # type: List[Tuple[Artist, List[dict]]]
+    albums_nr = 0
+    async for artist_releases in results:
+        if artist_releases is None:
+            continue
+        batch.append(artist_releases)
+        albums_nr += len(artist_releases[1])
+        if max(albums_nr, len(batch)) >= Config.ALBUMS_BULK_SIZE:
+            yield batch
+            batch, albums_nr = [], 0
+    if batch:
+        yield batch
+
+
 async def get_new_releases(
-    sp: Spotter, artists: List[Artist], force_update: bool = False
+    sp: Spotter,
+    artists: List[Artist],
+    force_update: bool = False,
+    claim: bool = False,
 ) -> Tuple[int, int]:
-    """update artists with released albums"""
+    """update artists with released albums
+
+    with `claim` every artist is claimed in the db before syncing it, for
+    when other tasks may be syncing the same artists. Releases are stored
+    as they come, about `ALBUMS_BULK_SIZE` at a time
+    """
     updated_nr = 0
     albums_nr = 0
-
-    args_items = [(sp, a) for a in artists]
+    artists_nr = 0
 
     tstart = time.time()
     filter_func = partial(_album_filter, force=force_update)
-    task_results = await run_tasks(
-        Config.ARTISTS_TASKS_AMOUNT, args_items, update_artist_albums, filter_func
+    if claim:
+        args_items = [(sp, a, force_update) for a in artists]
+        fetch_func = _claimed_fetch_artist_releases
+    else:
+        args_items = [(sp, a) for a in artists]
+        fetch_func = fetch_artist_releases
+
+    results = iter_tasks(
+        Config.ARTISTS_TASKS_AMOUNT, args_items, fetch_func, filter_func
     )
+    async for batch in _releases_batches(results):
+        new_albums = await store_artists_releases(sp, batch)
+        albums_nr += sum(len(a) for a in new_albums.values())
+        updated_nr += len(new_albums)
+        artists_nr += len(batch)
+
     elapsed_time = time.time() - tstart
     _LOGGER.info(
-        f"finished {len(task_results)} get_new_releases jobs; total elapsed: {elapsed_time}s"
+        f"finished {artists_nr} get_new_releases jobs; total elapsed: {elapsed_time}s"
     )
-
-    for artist, new_additions in task_results:
-        if new_additions:
-            albums_nr += len(new_additions)
-            updated_nr += 1
-
     return albums_nr, updated_nr
@@ -0,0 +1,90 @@
+"""Find new releases of followed artists in spotify new releases feed
+
+one pass over the feed of every market costs a few requests, whatever
+the number of followed artists; per artist syncing is left as backstop
+"""
+import datetime
+from typing import Dict, Iterable, List, Set, Tuple
+
+from deneb.config import Config
+from deneb.db import Artist
+from deneb.logger import get_logger
+from deneb.sp import Spotter
+from deneb.spotify.common import fetch_all
+from deneb.tools import generate_release_date, run_tasks
+from deneb.workers.artist_sync import store_releases
+
+_LOGGER = get_logger(__name__)
+
+
+def _release_date(album: Dict) -> datetime.date:
+    return generate_release_date(album["release_date"], album["release_date_precision"])
+
+
+class ReleasedBefore:
+    """`fetch_all` stop predicate, the feed comes roughly newest first
+
+    paging stops at the first page with only releases older than `since`
+    """
+
+    def __init__(self, since: datetime.date) -> None:
+        self.since = since
+
+    def __call__(self, items: List[Dict]) -> bool:
+        return all(_release_date(a) < self.since for a in items)
+
+
+async def fetch_market_releases(
+    sp: Spotter, market: str, since: datetime.date
+) -> List[Dict]:
+    """albums in the market new releases feed released since `since`"""
+    data = await sp.client.new_releases(country=market, limit=50)
+    albums = await fetch_all(sp, data and data["albums"], ReleasedBefore(since))
+    return [a for a in albums if _release_date(a) >= since]
+
+
+def match_followed(
+    albums: Iterable[Dict], followed_ids: Set[str]
+) -> List[Tuple[Dict, str]]:
+    """(album, artist spotify id) for every followed artist of the albums"""
+    matches = []
+    for album in albums:
+        if album["album_type"] == "compilation":
+            # skipped by artist syncing too
+            continue
+        matches.extend(
+            (album, artist["id"])
+            for artist in album["artists"]
+            if artist["id"] in followed_ids
+        )
+    return matches
+
+
+async def discover_new_releases(sp: Spotter, markets: List[str]) -> Dict[str, int]:
+    """store the feed releases of followed artists, as artist syncing would"""
+    since = datetime.date.today() - datetime.timedelta(days=Config.NEW_RELEASES_DAYS)
+    followed_ids = await Artist.followed_spotify_ids()
+
+    args_items = [(sp, market, since) for market in markets]
+    markets_albums = await run_tasks(
+        Config.PAGES_TASKS_AMOUNT, args_items, fetch_market_releases
+    )
+    albums = {a["id"]: a for albums in markets_albums for a in albums}
+    matches = match_followed(albums.values(), followed_ids)
+
+    artists = {}  # type: Dict[str, Artist]
+    if matches:
+        matched_ids = list({artist_id for _, artist_id in matches})
+        artists = {
+            a.spotify_id: a for a in await Artist.filter(spotify_id__in=matched_ids)
+        }
+    new_albums = await store_releases(
+        sp, [(album, artists[artist_id]) for album, artist_id in matches]
+    )
+
+    albums_nr = sum(len(a) for a in new_albums.values())
+    _LOGGER.info(
+        f"{len(albums)} releases in {len(markets)} markets, "
+        f"{len(matches)} by followed artists, {albums_nr} new"
+    )
+    return {"releases": len(albums), "matched": len(matches), "albums": albums_nr}
@@ -1,10 +1,13 @@
 """Module to handle user related updates"""
+import asyncio
+import hashlib
 from itertools import zip_longest
-from typing import Dict, List, Tuple
+from typing import Dict, Iterable, List, Tuple
 
 from deneb.db import Artist, User
 from deneb.logger import get_logger
 from deneb.sp import Spotter
+from deneb.spotify.common import fetch_all
 from deneb.tools import grouper
 
 _LOGGER = get_logger(__name__)
@@ -12,25 +15,26 @@ _LOGGER = get_logger(__name__)
 
 async def fetch_artists(sp: Spotter) -> List[Dict]:
     """fetch user followed artists"""
-    artists = []  # type: List[Dict]
     artists_data = await sp.client.current_user_followed_artists(limit=50)
-
-    while True:
-        artists.extend(artists_data["artists"]["items"])
-        if not artists_data["artists"]["next"]:
-            break
-        artists_data = await sp.client.next(artists_data["artists"])  # noqa:B305
-        if not artists_data:
-            break
+    # cursor paginated, pages come one after another
+    artists = await fetch_all(sp, artists_data["artists"])
 
     clean_artists = list({v["id"]: v for v in artists}.values())
     return clean_artists
 
 
+def follows_fingerprint(artists_ids: Iterable[str]) -> str:
+    """fingerprint of a followed artists set, the same for the same set"""
+    ids = sorted(set(artists_ids))
+    digest = hashlib.sha1(",".join(ids).encode()).hexdigest()
+    return f"{len(ids)}:{digest}"
+
+
 def extract_new_follows_objects(
-    followed_artists: List[Dict], following_ids: List[str]
+    followed_artists: List[Dict], following_ids: Iterable[str]
 ) -> List[Dict]:
     """returns artists not present in following_ids"""
+    following_ids = set(following_ids)
     new_follows = [a for a in followed_artists if a["id"] not in following_ids]
     return new_follows
 
@@ -39,55 +43,56 @@ def extract_lost_follows_artists(
     followed_artists: List[Dict], current_following: List[Artist]
 ) -> List[Artist]:
     """returns artists not present in following_ids"""
-    current_following_ids = [a["id"] for a in followed_artists]
-    db_follows_ids = [a.spotify_id for a in current_following]
-    lost_follows_ids = [a for a in db_follows_ids if a not in current_following_ids]
-    lost_follows = [a for a in current_following if a.spotify_id in lost_follows_ids]
+    current_following_ids = {a["id"] for a in followed_artists}
+    lost_follows = [
+        a for a in current_following if a.spotify_id not in current_following_ids
+    ]
     return lost_follows
 
 
-async def check_follows(sp: Spotter, artists: List[Artist]) -> List[Artist]:
-    """check with spotify api if artists are followed"""
+async def _check_follows_batch(sp: Spotter, batch: List[Artist]) -> List[Artist]:
+    artists_ids = ",".join([a.spotify_id for a in batch])
+    result = await sp.client._get(
+        "me/following/contains", type="artist", ids=artists_ids
+    )
     lost_follows = []
-    for batch in grouper(50, artists):
-        artists_ids = ",".join([a.spotify_id for a in batch if a is not None])
-        result = await sp.client._get(
-            "me/following/contains", type="artist", ids=artists_ids
-        )
-        for artist, is_followed in zip_longest(batch, result, fillvalue=None):
-            if artist is None:
-                break
-            if not is_followed:
-                lost_follows.append(artist)
+    for artist, is_followed in zip_longest(batch, result, fillvalue=None):
+        if artist is None:
+            break
+        if not is_followed:
+            lost_follows.append(artist)
     return lost_follows
 
 
+async def check_follows(sp: Spotter, artists: List[Artist]) -> List[Artist]:
+    """check with spotify api if artists are followed"""
+    batches = [[a for a in batch if a is not None] for batch in grouper(50, artists)]
+    results = await asyncio.gather(*[_check_follows_batch(sp, a) for a in batches])
+    return [artist for lost_follows in results for artist in lost_follows]
+
+
 async def sync_user_followed_artists(
     user: User, sp: Spotter, dry_run: bool
 ) -> Tuple[List[Artist], List[Artist]]:
     """sync in db the artists followed by user"""
     followed_artists = await fetch_artists(sp)
+    fingerprint = follows_fingerprint(a["id"] for a in followed_artists)
+    if fingerprint == user.follows_fingerprint:
+        # same follows as when last synced, nothing to diff
+        return [], []
+
     user_db_artists = await user.artists.filter()
-    following_ids = [a.spotify_id for a in user_db_artists]
+    following_ids = {a.spotify_id for a in user_db_artists}
 
     # followed_artaists - following_ids = new follows
     new_follows = extract_new_follows_objects(followed_artists, following_ids)
-    # convert artists to db objects
-    new_follows_db = []
-    for artist in new_follows:
-        try:
-            db_artist = await Artist.get(spotify_id=artist["id"])
-        except Exception:
-            db_artist = await Artist.create(
-                name=artist["name"], spotify_id=artist["id"]
-            )
-        new_follows_db.append(db_artist)
+    # convert artists to db objects, creating the ones never seen
+    new_follows_db = await Artist.resolve_many(new_follows)
 
     if new_follows_db and not dry_run:
-        await user.artists.add(*new_follows_db)
+        await user.follow_artists([a.id for a in new_follows_db])
 
     # following_ids - followed_artists = lost follows
-    user_db_artists = await user.artists.filter()
     lost_follows_db = extract_lost_follows_artists(followed_artists, user_db_artists)
     # add second unfollow verification
     # spotify might not return the artist
@@ -96,4 +101,7 @@ async def sync_user_followed_artists(
     if lost_follows_db_clean and not dry_run:
         await user.artists.remove(*lost_follows_db_clean)
 
+    if not dry_run:
+        await user.update_follows_fingerprint(fingerprint)
+
     return new_follows_db, lost_follows_db_clean
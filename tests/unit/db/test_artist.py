@@ -0,0 +1,94 @@
+# flake8: noqa
+import datetime
+from contextlib import asynccontextmanager
+from unittest import mock
+
+import pytest
+from aiomock import AIOMock
+
+from deneb.config import Config
+from deneb.db import Artist
+from deneb.db.artist import _INSERT_ARTISTS, _SELECT_BY_SPOTIFY_IDS, sync_interval
+from deneb.tortoise_pool import PoolTortoise
+
+_TODAY = datetime.date(2020, 6, 1)
+
+
+def _days_ago(*days):
+    return [_TODAY - datetime.timedelta(days=a) for a in days]
+
+
+@mock.patch.object(Config, "ARTIST_SYNC_MIN_HOURS", 4)
+@mock.patch.object(Config, "ARTIST_SYNC_MAX_HOURS", 168)
+@mock.patch.object(Config, "ARTIST_SYNC_CADENCE_FRACTION", 0.1)
+class TestSyncInterval:
+    def test_without_releases_is_the_floor(self):
+        assert sync_interval([], _TODAY) == datetime.timedelta(hours=4)
+
+    def test_follows_release_gap(self):
+        # a release every 10 days, the last one yesterday
+        interval = sync_interval(_days_ago(1, 11, 21, 31), _TODAY)
+        assert interval == datetime.timedelta(days=1)
+
+    def test_long_silence_outweighs_gap(self):
+        interval = sync_interval(_days_ago(30, 40, 50), _TODAY)
+        assert interval == datetime.timedelta(days=3)
+
+    def test_within_floor_and_ceiling(self):
+        assert sync_interval(_days_ago(0, 0, 1), _TODAY) == datetime.timedelta(hours=4)
+        assert sync_interval(_days_ago(3650), _TODAY) == datetime.timedelta(days=7)
+
+
+class TestCanUpdate:
+    def test_due_by_next_sync(self):
+        now = datetime.datetime.now()
+        artist = Artist(synced_at=now, next_sync_at=now - datetime.timedelta(minutes=1))
+        assert artist.can_update()
+
+        artist.next_sync_at = now + datetime.timedelta(days=1)
+        artist.synced_at = now - datetime.timedelta(days=1)
+        assert not artist.can_update()
+
+    def test_without_next_sync_uses_hours_delta(self):
+        now = datetime.datetime.now()
+        assert Artist(synced_at=now - datetime.timedelta(hours=5)).can_update()
+        assert not Artist(synced_at=now - datetime.timedelta(hours=3)).can_update()
+
+
+class TestReleases:
+    def test_adds_release_marks(self):
+        artist = Artist(release_marks={"album": {"id": "1", "release_date": "2020-05-01"}})
+        stored = _days_ago(10, 31)
+        assert artist._releases(stored) == _days_ago(10, 31)
+        assert artist._releases([]) == [datetime.date(2020, 5, 1)]
+
+
+def _patch_conn(conn):
+    @asynccontextmanager
+    async def acquire_connection():
+        yield conn
+
+    pool = mock.Mock(acquire_connection=acquire_connection)
+    return mock.patch.object(PoolTortoise, "get_connection", return_value=pool)
+
+
+class TestResolveMany:
+    @pytest.mark.asyncio
+    async def test_creates_missing_artists(self):
+        conn = AIOMock()
+        conn.fetch.async_side_effect = [
+            [{"id": 1, "name": "a", "spotify_id": "sp-a"}],
+            [{"id": 2, "name": "b", "spotify_id": "sp-b"}],
+        ]
+        artists = [{"id": "sp-a", "name": "a"}, {"id": "sp-b", "name": "b"}]
+        with _patch_conn(conn):
+            resolved = await Artist.resolve_many(artists)
+
+        assert [(a.id, a.spotify_id) for a in resolved] == [(1, "sp-a"), (2, "sp-b")]
+        select, insert = conn.fetch.call_args_list
+        assert select.args == (_SELECT_BY_SPOTIFY_IDS, ["sp-a", "sp-b"])
+        sql, names, spotify_ids, now = insert.args
+        assert sql == _INSERT_ARTISTS
+        assert "$3::timestamp, $3::timestamp, $3::timestamp" in sql
+        assert (names, spotify_ids) == (["b"], ["sp-b"])
+        assert isinstance(now, datetime.datetime) and now.tzinfo is None
@@ -0,0 +1,86 @@
+# flake8: noqa
+import asyncio
+
+import pytest
+
+from deneb.spotify.album_tracks import AlbumTracksCache
+from deneb.structs import AlbumTracks
+from tests.unit.fixtures.mocks import get_album, get_track
+
+
+def _album_tracks(spotify_id):
+    return AlbumTracks({**get_album(spotify_id), "id": spotify_id}, [get_track()])
+
+
+class TestAlbumTracksCache:
+    @pytest.mark.asyncio
+    async def test_concurrent_lookups_share_one_fetch(self):
+        cache = AlbumTracksCache(max_size=10 ** 6, ttl=60)
+        calls = []
+
+        async def _fetch(ids):
+            calls.append(ids)
+            await asyncio.sleep(0.01)
+            return {a: _album_tracks(a) for a in ids}
+
+        results = await asyncio.gather(
+            cache.resolve(["a", "b"], _fetch),
+            cache.resolve(["b", "c"], _fetch),
+            cache.resolve(["a"], _fetch),
+        )
+
+        assert calls == [["a", "b"], ["c"]]
+        assert [sorted(r) for r in results] == [["a", "b"], ["b", "c"], ["a"]]
+        assert cache.stats()["misses"] == 3
+
+    @pytest.mark.asyncio
+    async def test_failed_fetch_is_not_cached(self):
+        cache = AlbumTracksCache(max_size=10 ** 6, ttl=60)
+
+        async def _fail(ids):
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            await cache.resolve(["a"], _fail)
+
+        async def _fetch(ids):
+            return {a: _album_tracks(a) for a in ids}
+
+        assert list(await cache.resolve(["a"], _fetch)) == ["a"]
+
+    @pytest.mark.asyncio
+    async def test_returned_tracks_are_copies(self):
+        cache = AlbumTracksCache(max_size=10 ** 6, ttl=60)
+
+        async def _fetch(ids):
+            return {a: _album_tracks(a) for a in ids}
+
+        album = (await cache.resolve(["a"], _fetch))["a"]
+        album.tracks[0]["name"] = "changed"
+        album.tracks.append(get_track())
+
+        cached = (await cache.resolve(["a"], _fetch))["a"]
+        assert len(cached.tracks) == 1
+        assert cached.tracks[0]["name"] != "changed"
+
+    def test_evicts_least_recently_used(self):
+        album_size = AlbumTracksCache(max_size=10 ** 6, ttl=60)
+        album_size.put("a", _album_tracks("a"))
+
+        cache = AlbumTracksCache(max_size=album_size.size * 2 + 10, ttl=60)
+        cache.put("a", _album_tracks("a"))
+        cache.put("b", _album_tracks("b"))
+        cache.get("a")
+        cache.put("c", _album_tracks("c"))
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.get("c") is not None
+        assert cache.size <= cache.max_size
+
+    def test_expired_entries_are_dropped(self):
+        cache = AlbumTracksCache(max_size=10 ** 6, ttl=-1)
+        cache.put("a", _album_tracks("a"))
+
+        assert cache.get("a") is None
+        assert len(cache) == 0
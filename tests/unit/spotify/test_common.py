@@ -0,0 +1,90 @@
+# flake8: noqa
+import pytest
+from aiomock import AIOMock
+
+from deneb.spotify.common import _page_url, fetch_all, iter_items
+
+_NEXT = "https://api.spotify.com/v1/me/tracks?offset=2&limit=2"
+
+
+def _offset_page(offset: int, total: int = 7) -> dict:
+    items = [{"id": idx} for idx in range(offset, min(offset + 2, total))]
+    has_next = offset + 2 < total
+    return {
+        "items": items,
+        "total": total,
+        "limit": 2,
+        "offset": offset,
+        "next": _page_url(_NEXT, offset + 2) if has_next else None,
+    }
+
+
+def _offset_client() -> AIOMock:
+    def _get(url):
+        offset = int(url.split("offset=")[1].split("&")[0])
+        return _offset_page(offset)
+
+    sp = AIOMock()
+    sp.client._get.async_side_effect = _get
+    return sp
+
+
+class TestFetchAll:
+    @pytest.mark.asyncio
+    async def test_offset_pages_in_order(self):
+        sp = _offset_client()
+        items = await fetch_all(sp, _offset_page(0))
+
+        assert [a["id"] for a in items] == list(range(7))
+        assert sp.client._get.call_count == 3
+        sp.client.next.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_offset_pages_stop_when(self):
+        sp = _offset_client()
+        items = await fetch_all(
+            sp, _offset_page(0), stop_when=lambda page: {"id": 3} in page
+        )
+
+        assert [a["id"] for a in items] == [0, 1, 2, 3]
+        # pages past the one it stopped at are not requested
+        assert sp.client._get.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_cursor_pages_are_sequential(self):
+        sp = AIOMock()
+        sp.client.next.async_side_effect = [
+            {"artists": {"items": [{"id": 2}], "next": "cursor-next"}},
+            {"artists": {"items": [{"id": 3}], "next": None}},
+        ]
+        first_page = {"items": [{"id": 1}], "next": "cursor-next", "cursors": {}}
+        items = await fetch_all(sp, first_page)
+
+        assert [a["id"] for a in items] == [1, 2, 3]
+        assert sp.client.next.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_empty_first_response(self):
+        assert await fetch_all(AIOMock(), None) == []
+
+
+class TestIterItems:
+    @pytest.mark.asyncio
+    async def test_fetches_pages_as_consumed(self):
+        sp = AIOMock()
+        sp.client.next.async_side_effect = [
+            _offset_page(2),
+            _offset_page(4),
+        ]
+        items = []
+        async for item in iter_items(sp, _offset_page(0)):
+            items.append(item["id"])
+            if item["id"] == 2:
+                break
+
+        assert items == [0, 1, 2]
+        assert sp.client.next.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_empty_first_response(self):
+        assert [a async for a in iter_items(AIOMock(), None)] == []
@@ -0,0 +1,102 @@
+# flake8: noqa
+from unittest import mock
+
+import pytest
+from aiomock import AIOMock
+
+from deneb.db import Album, Track
+from deneb.db.album import album_catalog
+from deneb.spotify.album_tracks import ALBUM_TRACKS_CACHE
+from deneb.spotify.weekly_releases import (
+    _resolve_albums_tracks, remove_unwanted_tracks
+)
+from tests.unit.fixtures.mocks import get_album, get_track
+
+
+class TestResolveAlbumsTracks:
+    @pytest.mark.asyncio
+    async def test_batches_albums_and_tracks(self):
+        ALBUM_TRACKS_CACHE.clear()
+        albums = [
+            Album(name=f"a{idx}", type="album", spotify_id=f"a{idx}")
+            for idx in range(25)
+        ]
+        tracks = [Album(name="t1", type="track", spotify_id="t1")]
+
+        def _albums(ids):
+            page = {"items": [get_track()], "next": None}
+            return {
+                "albums": [{**get_album(a), "id": a, "tracks": page} for a in ids]
+            }
+
+        sp = AIOMock()
+        sp.client.albums.async_side_effect = _albums
+        sp.client.tracks.async_return_value = {
+            "tracks": [{**get_track("t1"), "id": "t1", "album": get_album("x")}]
+        }
+
+        resolved = await _resolve_albums_tracks(sp, albums + tracks + albums[:2])
+
+        assert sp.client.albums.call_count == 2
+        assert sp.client.tracks.call_count == 1
+        # duplicates are dropped, order is kept
+        assert [a.spotify_id for a, _ in resolved] == [
+            a.spotify_id for a in albums + tracks
+        ]
+        assert all(album_tracks is not None for _, album_tracks in resolved)
+
+    @pytest.mark.asyncio
+    async def test_uses_stored_tracks(self):
+        ALBUM_TRACKS_CACHE.clear()
+        catalog = album_catalog(get_album("a1"))
+        stored = Album(id=1, name="a1", type="album", spotify_id="a1", catalog=catalog)
+        missing = Album(id=2, name="a2", type="album", spotify_id="a2")
+        tracks = [
+            Track(spotify_id="t1", name="t1", artists=[], position=0),
+            Track(spotify_id="t2", name="t2", artists=[], position=1),
+        ]
+        for track in tracks:
+            track.album_id = 1
+
+        sp = AIOMock()
+        sp.client.albums.async_return_value = {"albums": [None]}
+        query = AIOMock()
+        query.order_by.async_return_value = tracks
+
+        with mock.patch.object(Track, "filter", return_value=query) as track_filter:
+            resolved = await _resolve_albums_tracks(sp, [stored, missing])
+
+        track_filter.assert_called_once_with(album_id__in=[1])
+        # only the album without stored tracks goes to spotify
+        sp.client.albums.assert_called_once_with(["a2"])
+        album_tracks = resolved[0][1]
+        assert album_tracks.parent == catalog
+        assert [t["uri"] for t in album_tracks.tracks] == [
+            "spotify:track:t1",
+            "spotify:track:t2",
+        ]
+        assert resolved[1][1] is None
+
+    @pytest.mark.asyncio
+    async def test_fetches_features_without_popularity(self):
+        ALBUM_TRACKS_CACHE.clear()
+        catalog = album_catalog(get_album("x"))
+        feature = Album(id=1, name="t1", type="track", spotify_id="t1", catalog=catalog)
+        stored = Track(spotify_id="t1", name="t1", artists=[], position=0)
+        stored.album_id = 1
+
+        sp = AIOMock()
+        sp.client.tracks.async_return_value = {
+            "tracks": [
+                {**get_track("t1"), "id": "t1", "album": catalog, "popularity": 12}
+            ]
+        }
+        query = AIOMock()
+        query.order_by.async_return_value = [stored]
+
+        with mock.patch.object(Track, "filter", return_value=query):
+            resolved = await _resolve_albums_tracks(sp, [feature])
+
+        sp.client.tracks.assert_called_once_with(["t1"])
+        # a low popularity feature gets filtered out
+        assert remove_unwanted_tracks(resolved[0][1].tracks) == []
@@ -0,0 +1,261 @@
+# flake8: noqa
+import asyncio
+from unittest import mock
+
+import pytest
+from aiomock import AIOMock
+
+from deneb.config import Config
+from deneb.db import LikedTrack, PlaylistMirror, User
+from deneb.spotify.yearly_liked import (
+    LikedByYear, _drop_unliked, _fetch_tracks_by_year, _last_added_tracks,
+    _playlist_tracks_ids, _playlists_tracks_ids, _scan_new_liked,
+    _sync_with_spotify_playlist, generate_tracks_to_add, parse_years
+)
+from tests.unit.common import _mocked_call
+
+
+def _liked(track_id, added_at, year="2020"):
+    return {
+        "added_at": added_at,
+        "track": {"id": track_id, "album": {"release_date": f"{year}-01-01"}},
+    }
+
+
+def _page(items, next_url=None):
+    return {"items": items, "next": next_url}
+
+
+def test_parse_years():
+    assert parse_years("2019, 2020") == ["2019", "2020"]
+    assert parse_years("all") is None
+    assert len(parse_years(None)) == 1
+
+
+class TestLikedByYear:
+    def test_years_stop_at_own_stop_point(self):
+        cursors = {"2020": {"added_at": "2020-05-02T00:00:00Z", "track_id": "c"}}
+        liked = LikedByYear(["2019", "2020"], cursors, {"2019": "b"})
+
+        assert not liked.add(_liked("d", "2020-05-03T00:00:00Z", "2020"))
+        assert not liked.add(_liked("a", "2020-05-02T12:00:00Z", "2019"))
+        # 2020 is done here, 2019 goes on
+        assert not liked.add(_liked("c", "2020-05-02T00:00:00Z", "2020"))
+        assert not liked.add(_liked("e", "2020-05-01T12:00:00Z", "2020"))
+        assert not liked.add(_liked("f", "2020-05-01T06:00:00Z", "2019"))
+        assert liked.add(_liked("b", "2020-05-01T00:00:00Z", "2019"))
+
+        assert {a: [b["id"] for b in c] for a, c in liked.tracks.items()} == {
+            "2020": ["d"],
+            "2019": ["a", "f"],
+        }
+
+    def test_all_years_never_stop(self):
+        liked = LikedByYear(None, {}, {"2019": "b"})
+
+        assert not liked.add(_liked("b", "2020-05-02T00:00:00Z", "2019"))
+        assert not liked.add(_liked("a", "2020-05-01T00:00:00Z", "2018"))
+        assert list(liked.tracks) == ["2018"]
+
+
+@pytest.mark.asyncio
+async def test_last_added_tracks_by_year():
+    async def _playlist(user_id, playlist_id, fields):
+        # the first playlist answers last
+        await asyncio.sleep(0.01 if playlist_id == "p2019" else 0)
+        return {"tracks": {"items": [{"track": {"id": f"t-{playlist_id}"}}]}}
+
+    sp = AIOMock()
+    sp.userdata = {"id": "user"}
+    sp.client.user_playlist = _playlist
+    playlists = {"2019": {"id": "p2019"}, "2020": {"id": "p2020"}}
+
+    assert await _last_added_tracks(sp, playlists) == {
+        "2019": "t-p2019",
+        "2020": "t-p2020",
+    }
+
+
+class TestScanNewLiked:
+    @pytest.mark.asyncio
+    async def test_stops_at_cursor(self):
+        sp = AIOMock()
+        sp.client.current_user_saved_tracks.async_return_value = _page(
+            [_liked("3", "2020-05-03T00:00:00Z"), _liked("2", "2020-05-01T00:00:00Z")],
+            "next-page",
+        )
+        cursor = {"added_at": "2020-05-01T00:00:00Z", "track_id": "2"}
+
+        items = await _scan_new_liked(sp, cursor)
+
+        assert [a["track"]["id"] for a in items] == ["3"]
+        sp.client.current_user_saved_tracks.assert_called_once_with(
+            limit=Config.LIKED_TRACKS_PAGE_SIZE
+        )
+        sp.client.next.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_stops_past_unliked_cursor_track(self):
+        sp = AIOMock()
+        sp.client.current_user_saved_tracks.async_return_value = _page(
+            [_liked("1", "2020-04-01T00:00:00Z")], "next-page"
+        )
+        cursor = {"added_at": "2020-05-01T00:00:00Z", "track_id": "gone"}
+
+        assert await _scan_new_liked(sp, cursor) == []
+        sp.client.next.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_without_cursor_scans_everything(self):
+        sp = AIOMock()
+        sp.client.current_user_saved_tracks.async_return_value = _page(
+            [_liked("2", "2020-05-02T00:00:00Z")], "next-page"
+        )
+        sp.client.next.async_return_value = _page([_liked("1", "2020-05-01T00:00:00Z")])
+
+        items = await _scan_new_liked(sp, None)
+
+        assert [a["track"]["id"] for a in items] == ["2", "1"]
+
+
+class TestFetchTracksByYear:
+    @pytest.mark.asyncio
+    async def test_sorts_index_by_year(self):
+        sp = AIOMock()
+        sp.client.current_user_saved_tracks.async_return_value = _page(
+            [_liked("3", "2020-05-03T00:00:00Z"), _liked("2", "2020-05-02T00:00:00Z")]
+        )
+        index_cursor = {"added_at": "2020-05-02T00:00:00Z", "track_id": "2"}
+        year_cursor = {"added_at": "2020-05-01T00:00:00Z", "track_id": "1"}
+        indexed = [
+            _liked("3", "2020-05-03T00:00:00Z"),
+            _liked("2", "2020-05-02T00:00:00Z"),
+            _liked("1", "2020-05-01T00:00:00Z"),
+        ]
+
+        with mock.patch.object(
+            LikedTrack, "newest_cursor", _mocked_call(index_cursor)
+        ), mock.patch.object(LikedTrack, "store", _mocked_call()) as store, mock.patch.object(
+            LikedTrack, "load", _mocked_call(indexed)
+        ) as load:
+            tracks, new_cursor = await _fetch_tracks_by_year(
+                User(id=1), sp, ["2020"], {"2020": year_cursor}, {}, False
+            )
+
+        # only tracks liked since the index was updated are stored
+        assert [a["track"]["id"] for a in store.call_args[0][1]] == ["3"]
+        load.assert_called_once_with(1, ["2020"], "2020-05-01T00:00:00Z")
+        assert [a["id"] for a in tracks["2020"]] == ["3", "2"]
+        assert new_cursor == {"added_at": "2020-05-03T00:00:00Z", "track_id": "3"}
+
+    @pytest.mark.asyncio
+    async def test_dry_run_leaves_index(self):
+        sp = AIOMock()
+        sp.client.current_user_saved_tracks.async_return_value = _page(
+            [_liked("3", "2020-05-03T00:00:00Z"), _liked("2", "2020-05-02T00:00:00Z")]
+        )
+        index_cursor = {"added_at": "2020-05-02T00:00:00Z", "track_id": "2"}
+        year_cursor = {"added_at": "2020-05-01T00:00:00Z", "track_id": "1"}
+        indexed = [
+            _liked("2", "2020-05-02T00:00:00Z"),
+            _liked("1", "2020-05-01T00:00:00Z"),
+        ]
+
+        with mock.patch.object(
+            LikedTrack, "newest_cursor", _mocked_call(index_cursor)
+        ), mock.patch.object(LikedTrack, "store", _mocked_call()) as store, mock.patch.object(
+            LikedTrack, "load", _mocked_call(indexed)
+        ):
+            tracks, new_cursor = await _fetch_tracks_by_year(
+                User(id=1), sp, ["2020"], {"2020": year_cursor}, {}, True
+            )
+
+        store.assert_not_called()
+        # the fetched tracks are sorted ahead of the index all the same
+        assert [a["id"] for a in tracks["2020"]] == ["3", "2"]
+        assert new_cursor == {"added_at": "2020-05-03T00:00:00Z", "track_id": "3"}
+
+
+def test_generate_tracks_to_add():
+    tracks = [{"id": "1"}, {"id": "2"}, {"id": "2"}, {"id": "3"}]
+    assert generate_tracks_to_add(tracks, {"1"}) == [{"id": "2"}, {"id": "3"}]
+
+
+class TestSyncWithSpotifyPlaylist:
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("snapshot_id, added", [("s2", True), (None, False)])
+    async def test_tells_if_tracks_got_added(self, snapshot_id, added):
+        playlist = {"id": "p", "uri": "spotify:playlist:p", "snapshot_id": "s1"}
+        with mock.patch(
+            "deneb.spotify.yearly_liked.update_spotify_playlist",
+            new=_mocked_call(snapshot_id),
+        ):
+            stats, tracks_added = await _sync_with_spotify_playlist(
+                User(fb_id="fb"), AIOMock(), [{"id": "1"}], playlist, "2020", False
+            )
+
+        # a failed add keeps the year cursor, to go over its tracks again
+        assert tracks_added is added
+        assert stats.playlist["snapshot_id"] == snapshot_id
+
+
+class TestPlaylistTracksIds:
+    @pytest.mark.asyncio
+    async def test_uses_mirror_of_same_snapshot(self):
+        sp = AIOMock()
+        playlist = {"id": "p", "snapshot_id": "s1"}
+        mirror = PlaylistMirror(playlist_id="p", snapshot_id="s1", tracks_ids=["1"])
+
+        assert await _playlist_tracks_ids(sp, playlist, mirror) == {"1"}
+        sp.client.user_playlist.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_fetches_changed_playlist(self):
+        sp = AIOMock()
+        sp.userdata = {"id": "user"}
+        sp.client.user_playlist.async_return_value = {
+            "tracks": {"items": [{"track": {"id": "2"}}], "next": None}
+        }
+        playlist = {"id": "p", "snapshot_id": "s2"}
+        mirror = PlaylistMirror(playlist_id="p", snapshot_id="s1", tracks_ids=["1"])
+
+        assert await _playlist_tracks_ids(sp, playlist, mirror) == {"2"}
+
+
+@pytest.mark.asyncio
+async def test_playlists_tracks_ids_by_year():
+    sp = AIOMock()
+    sp.userdata = {"id": "user"}
+    sp.client.user_playlist.async_return_value = {
+        "tracks": {"items": [{"track": {"id": "2"}}], "next": None}
+    }
+    playlists = {
+        "2019": {"id": "p1", "snapshot_id": "s1"},
+        "2020": {},
+        "2021": {"id": "p2"},
+    }
+    mirror = PlaylistMirror(playlist_id="p1", snapshot_id="s1", tracks_ids=["1"])
+    mirrors = {"2019": mirror}
+
+    assert await _playlists_tracks_ids(sp, playlists, mirrors) == {
+        "2019": {"1"},
+        "2020": set(),
+        "2021": {"2"},
+    }
+    sp.client.user_playlist.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_drop_unliked_tracks():
+    sp = AIOMock()
+    sp.client.current_user_saved_tracks_contains.async_side_effect = lambda ids: [
+        a != "2" for a in ids
+    ]
+    tracks = [{"id": str(a)} for a in range(60)]
+
+    with mock.patch.object(LikedTrack, "forget", _mocked_call()) as forget:
+        liked = await _drop_unliked(User(id=1), sp, tracks, False)
+
+    assert sp.client.current_user_saved_tracks_contains.call_count == 2
+    assert liked == tracks[:2] + tracks[3:]
+    forget.assert_called_once_with(1, ["2"])
@@ -0,0 +1,149 @@
+# flake8: noqa
+import asyncio
+import datetime
+from unittest import mock
+
+import pytest
+
+from deneb.config import Config
+from deneb.db import TaskRun, User
+from deneb.dispatch import (
+    checkpointed, dispatch_users_chunks, run_users_chunk, skip_done_users
+)
+from tests.unit.common import _mocked_call
+
+_NOW = datetime.datetime(2020, 5, 1, 13, 1)
+
+
+def _patch_runs(unfinished=(), done=(), left=()):
+    return mock.patch.multiple(
+        TaskRun,
+        abandon_stale=_mocked_call(0),
+        unfinished=_mocked_call(list(unfinished)),
+        done_users=_mocked_call(set(done)),
+        unfinished_users=_mocked_call(set(left)),
+    )
+
+
+class TestDispatchUsersChunks:
+    @pytest.mark.asyncio
+    @mock.patch.object(Config, "TASK_USERS_CHUNK_SIZE", 2)
+    async def test_sends_chunks_once(self):
+        users = [User(id=idx) for idx in range(5)]
+        sent = []
+
+        with _patch_runs(), mock.patch.object(
+            TaskRun, "register", _mocked_call(True)
+        ) as register:
+            chunks_nr = await dispatch_users_chunks(
+                "weekly", users, lambda *args: sent.append(args), now=_NOW
+            )
+
+        assert chunks_nr == 3
+        register.assert_called_once_with(
+            "weekly:2020-05-01T13",
+            {
+                "weekly:2020-05-01T13:0": [0, 1],
+                "weekly:2020-05-01T13:1": [2, 3],
+                "weekly:2020-05-01T13:2": [4],
+            },
+        )
+        assert sent == [
+            ("weekly:2020-05-01T13:0", [0, 1]),
+            ("weekly:2020-05-01T13:1", [2, 3]),
+            ("weekly:2020-05-01T13:2", [4]),
+        ]
+
+    @pytest.mark.asyncio
+    async def test_skips_dispatched_run(self):
+        sent = []
+        with _patch_runs(), mock.patch.object(TaskRun, "register", _mocked_call(False)):
+            chunks_nr = await dispatch_users_chunks(
+                "weekly", [User(id=1)], lambda *args: sent.append(args), now=_NOW
+            )
+
+        assert chunks_nr == 0
+        assert sent == []
+
+    @pytest.mark.asyncio
+    async def test_resumes_unfinished_run(self):
+        previous = TaskRun(key="weekly:2020-05-01T12", status="running")
+        left = [("weekly:2020-05-01T12:1", [2, 3])]
+        users = [User(id=idx) for idx in range(1, 6)]
+        sent = []
+
+        with _patch_runs([previous], done={1}, left={2, 3}), mock.patch.object(
+            TaskRun, "resumable_chunks", _mocked_call(left)
+        ), mock.patch.object(TaskRun, "register", _mocked_call(True)) as register:
+            chunks_nr = await dispatch_users_chunks(
+                "weekly", users, lambda *args: sent.append(args), now=_NOW
+            )
+
+        assert chunks_nr == 2
+        # this hour users are dispatched too, without the previous run ones
+        register.assert_called_once_with(
+            "weekly:2020-05-01T13", {"weekly:2020-05-01T13:0": [4, 5]}
+        )
+        assert sent == left + [("weekly:2020-05-01T13:0", [4, 5])]
+
+
+class TestRunUsersChunk:
+    @pytest.mark.asyncio
+    async def test_skips_claimed_chunk(self):
+        job = _mocked_call({})
+        with mock.patch.object(TaskRun, "claim", _mocked_call(None)):
+            assert await run_users_chunk("run:0", [1], job) is None
+        job.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_failed_job_releases_chunk(self):
+        job = _mocked_call()
+        job.async_side_effect = ValueError("boom")
+        with mock.patch.object(TaskRun, "claim", _mocked_call("run")), mock.patch.object(
+            TaskRun, "release", _mocked_call()
+        ) as release, mock.patch.object(TaskRun, "finish", _mocked_call()) as finish:
+            summary = await run_users_chunk("run:0", [1, 2], job)
+
+        job.assert_called_once_with([1, 2], "run")
+        release.assert_called_once_with("run:0")
+        finish.assert_not_called()
+        assert summary is None
+
+    @pytest.mark.asyncio
+    @mock.patch.object(Config, "TASK_CHUNK_LEASE_MINUTES", 0.001)
+    async def test_renews_lease_while_running(self):
+        async def _job(users_ids, key):
+            await asyncio.sleep(0.1)
+            return {}
+
+        with mock.patch.object(TaskRun, "claim", _mocked_call("run")), mock.patch.object(
+            TaskRun, "finish", _mocked_call(None)
+        ), mock.patch.object(TaskRun, "renew", _mocked_call()) as renew:
+            await run_users_chunk("run:0", [1], _job)
+            renewed_nr = renew.call_count
+            await asyncio.sleep(0.05)
+
+        assert renewed_nr > 0
+        renew.assert_called_with("run:0")
+        # no renewing once the chunk is done
+        assert renew.call_count == renewed_nr
+
+
+class TestCheckpoints:
+    @pytest.mark.asyncio
+    async def test_skip_done_users(self):
+        users = [User(id=idx) for idx in range(3)]
+        with mock.patch.object(TaskRun, "done_users", _mocked_call({0, 2})):
+            assert await skip_done_users("run", users) == [users[1]]
+
+    @pytest.mark.asyncio
+    async def test_checkpointed_marks_synced_users(self):
+        users = [User(id=1), User(id=2)]
+        handler = _mocked_call()
+        handler.async_side_effect = lambda creds, user: user if user.id == 1 else None
+
+        with mock.patch.object(TaskRun, "mark_user_done", _mocked_call()) as mark:
+            for user in users:
+                await checkpointed("run", handler)(None, user)
+
+        mark.assert_called_once_with("run", 1)
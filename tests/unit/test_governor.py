@@ -0,0 +1,96 @@
+# flake8: noqa
+import asyncio
+from unittest import mock
+
+import pytest
+
+from deneb.governor import AdaptiveBudget, Budget
+from deneb.tools import run_tasks
+
+
+class TestBudget:
+    @pytest.mark.asyncio
+    async def test_caps_nested_fan_out(self):
+        budget = Budget("test", 3)
+
+        async def _leaf(idx):
+            async with budget.slot():
+                await asyncio.sleep(0.001)
+
+        async def _level(idx):
+            await run_tasks(5, [(a,) for a in range(5)], _leaf)
+
+        await run_tasks(5, [(a,) for a in range(5)], _level)
+
+        assert budget.peak == 3
+        assert budget.in_use == 0
+        assert budget.waits > 0
+
+    @pytest.mark.asyncio
+    async def test_slot_released_on_error(self):
+        budget = Budget("test", 1)
+
+        with pytest.raises(ValueError):
+            async with budget.slot():
+                raise ValueError()
+
+        async with budget.slot():
+            assert budget.in_use == 1
+        assert budget.stats()["in_use"] == 0
+
+
+class TestAdaptiveBudget:
+    def test_grows_while_latency_is_flat(self):
+        budget = AdaptiveBudget("test", 4, min_limit=2, max_limit=10, window=10)
+        for _ in range(40):
+            budget.on_success(0.1)
+
+        assert budget.stats()["limit"] > 4
+        assert budget.get_history()[-1][2] == "increase"
+
+    def test_stops_growing_when_latency_rises(self):
+        budget = AdaptiveBudget("test", 4, min_limit=2, max_limit=100, window=10)
+        for _ in range(10):
+            budget.on_success(0.1)
+        grown = budget.limit
+        for _ in range(20):
+            budget.on_success(1.0)
+
+        assert budget.limit - grown < 1
+
+    def test_cuts_on_errors_once_per_cooldown(self):
+        budget = AdaptiveBudget("test", 16, min_limit=2, max_limit=20, cooldown=60)
+        budget.on_error(429)
+        budget.on_error(429)
+
+        assert budget.stats()["limit"] == 8
+        assert budget.get_history() == [(mock.ANY, 8, "decrease on 429")]
+
+    def test_limit_stays_in_bounds(self):
+        budget = AdaptiveBudget("test", 3, min_limit=2, max_limit=4, cooldown=0)
+        for _ in range(5):
+            budget.on_error(503)
+        assert budget.limit == 2
+
+        for _ in range(100):
+            budget.on_success(0.1)
+        assert budget.limit == 4
+
+    @pytest.mark.asyncio
+    async def test_raised_limit_wakes_waiters(self):
+        budget = AdaptiveBudget("test", 1, min_limit=1, max_limit=2)
+        entered = []
+
+        async def _hold(idx):
+            async with budget.slot():
+                entered.append(idx)
+                await asyncio.sleep(0.05)
+
+        tasks = [asyncio.ensure_future(_hold(idx)) for idx in range(2)]
+        await asyncio.sleep(0.01)
+        assert entered == [0]
+
+        budget.on_success(0.01)
+        await asyncio.sleep(0.01)
+        assert entered == [0, 1]
+        await asyncio.gather(*tasks)
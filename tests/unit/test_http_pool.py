@@ -0,0 +1,23 @@
+# flake8: noqa
+import pytest
+
+from deneb.http_pool import close_http_pool, get_session, init_http_pool
+
+
+class TestHttpPool:
+    @pytest.mark.asyncio
+    async def test_same_session_per_loop(self):
+        await init_http_pool()
+        session = get_session()
+        assert get_session() is session
+        await close_http_pool()
+        assert session.closed
+
+    @pytest.mark.asyncio
+    async def test_recreated_after_close(self):
+        session = get_session()
+        await close_http_pool()
+        new_session = get_session()
+        assert new_session is not session
+        assert not new_session.closed
+        await close_http_pool()
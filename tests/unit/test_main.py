@@ -0,0 +1,102 @@
+# flake8: noqa
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from unittest import mock
+
+import pytest
+from click.testing import CliRunner
+
+from tests.unit.common import _mocked_call
+
+_KEYS = {
+    "SPOTIPY_CLIENT_ID": "id",
+    "SPOTIPY_CLIENT_SECRET": "secret",
+    "SPOTIPY_REDIRECT_URI": "uri",
+}
+
+# the cli module reads the spotify keys and installs uvloop on import
+with mock.patch.dict(os.environ, _KEYS), mock.patch("uvloop.install"):
+    from deneb import __main__ as main
+
+
+@pytest.fixture
+def held_locks():
+    held = set()
+
+    @asynccontextmanager
+    async def run_lock(name):
+        locked = name not in held
+        held.add(name)
+        try:
+            yield locked
+        finally:
+            if locked:
+                held.discard(name)
+
+    with mock.patch.multiple(
+        main,
+        run_lock=run_lock,
+        init_db=_mocked_call(None),
+        close_db=_mocked_call(None),
+        init_http_pool=_mocked_call(None),
+        close_http_pool=_mocked_call(None),
+    ):
+        yield held
+
+
+class TestRunnerLock:
+    def test_unsharded_run_skipped_while_sharded_goes(self, held_locks):
+        calls, held = [], []
+
+        async def command(*args, **kwargs):
+            calls.append(kwargs)
+
+        def run_shards(func, args, workers):
+            held.append(set(held_locks))
+            main.runner(command, ())
+            return {}
+
+        with mock.patch.object(main, "_run_shards", side_effect=run_shards) as shards:
+            main.runner(command, (), workers=2)
+
+        shards.assert_called_once_with(command, (), 2)
+        assert held == [{"command"}]
+        assert calls == []
+        assert held_locks == set()
+
+        main.runner(command, ())
+        assert calls == [{}]
+
+    def test_sharded_run_skipped_while_unsharded_goes(self, held_locks):
+        calls = []
+
+        async def command(*args, **kwargs):
+            calls.append(kwargs)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, main.runner, command, (), 2)
+
+        with mock.patch.object(main, "_run_shards", return_value={}) as shards:
+            main.runner(command, ())
+
+        assert calls == [{}]
+        shards.assert_not_called()
+        assert held_locks == set()
+
+    def test_shards_run_unlocked(self):
+        with mock.patch.object(main, "_run", return_value={}) as run:
+            main._run_shard(mock.Mock(), (), (1, 2))
+
+        run.assert_called_once_with(mock.ANY, (), {"shard": (1, 2)}, lock=False)
+
+
+class TestSyncArtists:
+    @pytest.mark.parametrize("feed, fed", [(["--feed"], True), ([], False)])
+    def test_feeds_queue_once_for_all_workers(self, feed, fed):
+        with mock.patch.object(main, "runner") as runner:
+            result = CliRunner().invoke(main.sync_artists, [*feed, "--workers", "3"])
+
+        assert result.exit_code == 0
+        drain = mock.call(main.sync_artists_queue, (main.SPOTIFY_KEYS,), 3, lock=False)
+        feeding = [mock.call(main.feed_artists_queue, (), lock=False)] if fed else []
+        assert runner.call_args_list == [*feeding, drain]
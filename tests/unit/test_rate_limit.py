@@ -0,0 +1,39 @@
+# flake8: noqa
+import time
+
+import pytest
+
+from deneb.rate_limit import RateLimiter
+
+
+class TestRateLimiter:
+    @pytest.mark.asyncio
+    async def test_burst_is_not_throttled(self):
+        limiter = RateLimiter(rate=10, burst=5)
+        for _ in range(5):
+            await limiter.acquire()
+        assert limiter.throttled_calls == 0
+
+    @pytest.mark.asyncio
+    async def test_throttles_over_rate(self):
+        limiter = RateLimiter(rate=100, burst=1)
+        tstart = time.monotonic()
+        for _ in range(6):
+            await limiter.acquire()
+        assert time.monotonic() - tstart >= 0.04
+        assert limiter.throttled_calls >= 4
+
+    @pytest.mark.asyncio
+    async def test_pause_blocks_callers(self):
+        limiter = RateLimiter(rate=100, burst=10)
+        limiter.pause(0.05)
+        tstart = time.monotonic()
+        await limiter.acquire()
+        assert time.monotonic() - tstart >= 0.04
+        assert limiter.stats()["pauses"] == 1
+
+    def test_shorter_pause_is_ignored(self):
+        limiter = RateLimiter(rate=100, burst=10)
+        limiter.pause(10)
+        limiter.pause(1)
+        assert limiter.pauses == 1
@@ -1,11 +1,16 @@
 # flake8: noqa
+import asyncio
+import time
 from unittest.mock import MagicMock, patch
 
 import pytest
 from aiomock import AIOMock
 from spotipy import SpotifyException
 
-from deneb.sp import SpotifyStats, Spotter, get_client, spotify_client
+from deneb.sp import (
+    AsyncSpotify, SpotifyStats, Spotter, get_client, refresh_access_token,
+    spotify_client
+)
 from deneb.structs import AlbumTracks, SpotifyKeys
 from tests.unit.common import _mocked_call
 from tests.unit.fixtures.mocks import album, playlist, track
@@ -53,18 +58,18 @@ class TestGetClient:
             # called current user method
             sp.client.current_user.assert_called_once()
 
-    # @patch("deneb.sp._LOGGER")
-    # @patch("deneb.sp.AsyncSpotify")
-    # @patch("deneb.sp.SpotifyOAuth")
-    # @patch("deneb.sp.Spotify.current_user", side_effect=[Exception(), {"id": "test"}])
     @pytest.mark.asyncio
     async def test_get_client_exception(self, mocker):
         keys = SpotifyKeys("client_id", "client_secret", "client_uri")
 
-        from deneb.sp import SpotifyOAuth
-        mocked_refresh_access_token = mocker.patch.object(
-            SpotifyOAuth, "refresh_access_token", return_value="new-test-token"
+        mocked_refresh_access_token = mocker.patch(
+            "deneb.sp.refresh_access_token", new=AIOMock()
         )
+        mocked_refresh_access_token.async_return_value = {
+            "access_token": "new-test-token",
+            "refresh_token": "test-token",
+            "expires_at": 9999999999,
+        }
 
         from deneb.sp import AsyncSpotify
         mocked_current_user = mocker.patch.object(
@@ -80,6 +85,50 @@ class TestGetClient:
         # try and except
         assert mocked_current_user.call_count == 2
         assert mocked_refresh_access_token.call_count == 1
+        token_info = sp.client.client_credentials_manager.token_info
+        assert token_info["access_token"] == "new-test-token"
+
+
+class TestRefreshAccessToken:
+    @pytest.mark.asyncio
+    async def test_concurrent_refreshes_share_request(self, mocker):
+        keys = SpotifyKeys("client_id", "client_secret", "client_uri")
+        mocked_request = mocker.patch(
+            "deneb.sp._request_access_token", new=AIOMock()
+        )
+        mocked_request.async_return_value = {"access_token": "new-token"}
+
+        results = await asyncio.gather(
+            *[refresh_access_token(keys, "test-token") for _ in range(3)]
+        )
+
+        assert mocked_request.call_count == 1
+        assert all(a["access_token"] == "new-token" for a in results)
+
+    @pytest.mark.asyncio
+    async def test_expiring_token_refreshed_ahead(self, mocker):
+        keys = SpotifyKeys("client_id", "client_secret", "client_uri")
+        mocked_refresh_access_token = mocker.patch(
+            "deneb.sp.refresh_access_token", new=AIOMock()
+        )
+        mocked_refresh_access_token.async_return_value = {
+            "access_token": "new-token",
+            "refresh_token": "test-token",
+            "expires_at": int(time.time()) + 3600,
+        }
+        client = AsyncSpotify(credentials=keys)
+        client.client_credentials_manager = MagicMock()
+        client.client_credentials_manager.token_info = {
+            "access_token": "old-token",
+            "refresh_token": "test-token",
+            "expires_at": int(time.time()) + 10,
+        }
+
+        await client.refresh_token()
+        await client.refresh_token()
+
+        assert mocked_refresh_access_token.call_count == 1
+        assert client._auth_headers() == {"Authorization": "Bearer new-token"}
 
 
 class TestSpotifyStats:
@@ -0,0 +1,107 @@
+# flake8: noqa
+import asyncio
+
+import pytest
+
+from deneb.tools import iter_tasks, merge_summaries, run_tasks, shard_of
+
+
+class TestIterTasks:
+    @pytest.mark.asyncio
+    async def test_runs_at_most_queue_size_at_once(self):
+        running = []
+        peak = []
+
+        async def _task(idx):
+            running.append(idx)
+            peak.append(len(running))
+            await asyncio.sleep(0.001)
+            running.remove(idx)
+            return idx
+
+        results = await run_tasks(3, [(idx,) for idx in range(20)], _task)
+
+        assert sorted(results) == list(range(20))
+        assert max(peak) == 3
+
+    @pytest.mark.asyncio
+    async def test_yields_results_as_they_finish(self):
+        async def _task(delay):
+            await asyncio.sleep(delay)
+            return delay
+
+        results = [r async for r in iter_tasks(2, [(0.02,), (0.001,)], _task)]
+
+        assert results == [0.001, 0.02]
+
+    @pytest.mark.asyncio
+    async def test_filters_items_when_taken(self):
+        done = set()
+
+        async def _task(idx):
+            done.add(idx)
+            return idx
+
+        def _filter(args):
+            # sees the items finished meanwhile
+            return args[0] - 1 not in done
+
+        results = await run_tasks(1, [(idx,) for idx in range(6)], _task, _filter)
+
+        assert results == [0, 2, 4]
+
+    @pytest.mark.asyncio
+    async def test_error_stops_the_run(self):
+        started = []
+
+        async def _task(idx):
+            started.append(idx)
+            if idx == 2:
+                raise ValueError(idx)
+            await asyncio.sleep(0.001)
+
+        with pytest.raises(ValueError):
+            await run_tasks(2, [(idx,) for idx in range(100)], _task)
+        assert len(started) < 100
+
+    @pytest.mark.asyncio
+    async def test_stopping_early_cancels_workers(self):
+        started = []
+
+        async def _task(idx):
+            started.append(idx)
+            await asyncio.sleep(0.001)
+            return idx
+
+        async for _ in iter_tasks(2, ((idx,) for idx in range(100)), _task):
+            break
+        await asyncio.sleep(0.01)
+
+        assert len(started) <= 4
+
+    @pytest.mark.asyncio
+    async def test_cancelled_task_is_raised(self):
+        async def _task(idx):
+            if idx == 1:
+                raise asyncio.CancelledError()
+            return idx
+
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(
+                run_tasks(2, [(idx,) for idx in range(4)], _task), timeout=1
+            )
+
+
+class TestSharding:
+    def test_shards_are_stable_and_cover_all_keys(self):
+        shards = [shard_of(key, 4) for key in range(1000)]
+
+        assert shards == [shard_of(key, 4) for key in range(1000)]
+        assert set(shards) == {0, 1, 2, 3}
+        # crc32, not the per process salted `hash`
+        assert shard_of("user-1", 4) == 0
+
+    def test_merge_summaries(self):
+        merged = merge_summaries([{"users": 2, "synced": 1}, {"users": 3}, {}])
+
+        assert merged == {"users": 5, "synced": 1}
@@ -0,0 +1,60 @@
+# flake8: noqa
+from unittest import mock
+
+import pytest
+from aiomock import AIOMock
+
+from deneb.config import Config
+from deneb.db import ArtistSyncJob
+from deneb.workers import artist_queue
+from deneb.workers.artist_queue import drain_artist_queue
+from tests.unit.common import _mocked_call
+
+
+def _sp():
+    sp = AIOMock()
+    sp.userdata = {"id": "1", "display_name": "user"}
+    return sp
+
+
+class TestDrainArtistQueue:
+    @pytest.mark.asyncio
+    async def test_syncs_batches_until_empty(self):
+        claim = _mocked_call()
+        claim.async_side_effect = [[1, 2], [3], []]
+        sync = _mocked_call(2)
+
+        with mock.patch.object(ArtistSyncJob, "claim", claim), mock.patch.object(
+            ArtistSyncJob, "complete", _mocked_call()
+        ) as complete, mock.patch.object(artist_queue, "_sync_artists", sync):
+            summary = await drain_artist_queue(_sp())
+
+        assert summary == {"artists": 3, "albums": 4, "failed": 0}
+        assert complete.call_args_list == [mock.call([1, 2]), mock.call([3])]
+        claim.assert_called_with(
+            Config.ARTIST_QUEUE_BATCH_SIZE, Config.ARTIST_QUEUE_LEASE_SECONDS
+        )
+
+    @pytest.mark.asyncio
+    async def test_releases_failed_batch(self):
+        claim = _mocked_call()
+        claim.async_side_effect = [[1, 2], []]
+        sync = _mocked_call()
+        sync.async_side_effect = ValueError("boom")
+
+        with mock.patch.object(ArtistSyncJob, "claim", claim), mock.patch.object(
+            ArtistSyncJob, "complete", _mocked_call()
+        ) as complete, mock.patch.object(
+            ArtistSyncJob, "release", _mocked_call([])
+        ) as release, mock.patch.object(
+            artist_queue, "_sync_artists", sync
+        ), mock.patch.object(
+            artist_queue, "push_sentry_error"
+        ):
+            summary = await drain_artist_queue(_sp())
+
+        assert summary == {"artists": 0, "albums": 0, "failed": 2}
+        complete.assert_not_called()
+        release.assert_called_once_with(
+            [1, 2], Config.ARTIST_QUEUE_RETRY_SECONDS, Config.ARTIST_QUEUE_MAX_ATTEMPTS
+        )
@@ -4,49 +4,191 @@ from unittest import mock
 import pytest
 from aiomock import AIOMock
 
+from deneb.config import Config
 from deneb.db import Artist
-from deneb.workers.artist_sync import fetch_albums, get_featuring_songs
+from deneb.spotify.album_tracks import ALBUM_TRACKS_CACHE
+from deneb.workers.artist_sync import (
+    AlbumsCollector, fetch_albums, get_featuring_songs, get_new_releases
+)
 from tests.unit.common import _mocked_call
 from tests.unit.fixtures.mocks import artist_db, get_album, get_track
 
 
 class TestFetchAlbums:
     @pytest.mark.asyncio
+    @mock.patch.object(Config, "ALBUMS_FETCH_BY_GROUP", False)
     async def test_fetches_albums(self, artist_db):
         sp = AIOMock()
         sp.client.artist_albums.async_side_effect = [
             {"items": [get_album("1"), get_album("2")], "next": False}
         ]
+        artist_db.release_marks = None
         results = await fetch_albums(sp, artist_db)
 
         assert len(results) == 2
+        assert artist_db.release_marks["album"]["id"] == "1"
         sp.client.artist_albums.assert_called_once_with(
             artist_db.spotify_id, album_type="album,single,appears_on", limit=50
         )
 
 
+    @pytest.mark.asyncio
+    @mock.patch.object(Config, "ALBUMS_FETCH_BY_GROUP", True)
+    async def test_fetches_albums_by_group(self, artist_db):
+        def _group_page(artist_id, limit, album_type):
+            if "," in album_type:
+                # all the groups listed, more pages to go
+                album = _group_album("album-1", "album", "2020-01-01")
+                return {"items": [album], "next": "more-pages"}
+            album = _group_album(f"{album_type}-1", album_type, "2020-01-01")
+            # only the already synced group has more pages
+            next_page = "more-pages" if album_type == "single" else None
+            return {"items": [album], "next": next_page}
+
+        sp = AIOMock()
+        sp.client.artist_albums.async_side_effect = _group_page
+        artist_db.release_marks = {
+            "single": {"id": "single-1", "release_date": "2020-01-01"}
+        }
+        with mock.patch(
+            "deneb.workers.artist_sync.is_known_release",
+            side_effect=lambda album, mark: mark is not None,
+        ):
+            results = await fetch_albums(sp, artist_db)
+
+        assert sp.client.artist_albums.call_count == 4
+        # single stopped at its mark, no need for more pages
+        sp.client.next.assert_not_called()
+        sp.client._get.assert_not_called()
+        assert {a["id"] for a in results} == {"album-1", "appears_on-1"}
+        assert set(artist_db.release_marks) == {"album", "single", "appears_on"}
+
+    @pytest.mark.asyncio
+    @mock.patch.object(Config, "ALBUMS_FETCH_BY_GROUP", True)
+    async def test_single_page_needs_no_group_requests(self, artist_db):
+        sp = AIOMock()
+        sp.client.artist_albums.async_side_effect = [
+            {"items": [get_album("1"), get_album("2")], "next": None}
+        ]
+        artist_db.release_marks = None
+        results = await fetch_albums(sp, artist_db)
+
+        assert len(results) == 2
+        sp.client.artist_albums.assert_called_once_with(
+            artist_db.spotify_id, album_type="album,single,appears_on", limit=50
+        )
+
+
+def _group_album(album_id: str, group: str, release_date: str) -> dict:
+    album = get_album(album_id)
+    album.update(
+        {
+            "id": album_id,
+            "album_group": group,
+            "release_date": release_date,
+            "release_date_precision": "day",
+        }
+    )
+    return album
+
+
+class TestAlbumsCollector:
+    def test_stops_at_marks(self):
+        marks = {
+            "album": {"id": "a2", "release_date": "2020-05-01"},
+            "single": {"id": "s1", "release_date": "2020-06-01"},
+            "appears_on": {"id": "f1", "release_date": "2020-01-01"},
+        }
+        collector = AlbumsCollector(marks)
+
+        should_stop = collector(
+            [
+                _group_album("a1", "album", "2020-07-01"),
+                _group_album("a2", "album", "2020-05-01"),
+                _group_album("a3", "album", "2019-01-01"),
+                _group_album("s1", "single", "2020-06-01"),
+            ]
+        )
+        assert not should_stop
+        assert [a["id"] for a in collector.albums] == ["a1"]
+
+        should_stop = collector([_group_album("f2", "appears_on", "2020-02-01")])
+        assert not should_stop
+        should_stop = collector([_group_album("f0", "appears_on", "2019-02-01")])
+        assert should_stop
+
+        assert [a["id"] for a in collector.albums] == ["a1", "f2"]
+        new_marks = collector.new_marks(paged_through=False)
+        assert new_marks["album"]["id"] == "a1"
+        assert new_marks["single"]["id"] == "s1"
+        assert new_marks["appears_on"]["id"] == "f2"
+
+    def test_later_group_ends_previous_ones(self):
+        collector = AlbumsCollector({})
+        should_stop = collector([_group_album("f1", "appears_on", "2001-01-01")])
+
+        assert should_stop
+        assert collector.albums == []
+        assert collector.new_marks(paged_through=False) == {
+            "appears_on": {"id": "f1", "release_date": "2001-01-01"}
+        }
+
+    def test_partly_paged_group_keeps_its_mark(self):
+        marks = {"album": {"id": "a3", "release_date": "2019-01-01"}}
+        collector = AlbumsCollector(marks)
+        # paging failed before reaching the mark
+        should_stop = collector([_group_album("a1", "album", "2020-07-01")])
+
+        assert not should_stop
+        assert collector.new_marks(paged_through=False) == marks
+        assert collector.new_marks(paged_through=True)["album"]["id"] == "a1"
+
+
+class TestGetNewReleases:
+    @pytest.mark.asyncio
+    @mock.patch.object(Config, "ALBUMS_BULK_SIZE", 4)
+    async def test_stores_releases_in_batches(self):
+        artists = [Artist(id=idx, spotify_id=f"artist-{idx}") for idx in range(5)]
+
+        async def _fetch(sp, artist):
+            return artist, [get_album(f"{artist.id}-{a}") for a in range(2)]
+
+        stored = []
+
+        async def _store(sp, batch):
+            stored.append([artist.id for artist, _ in batch])
+            return {artist.id: [albums[0]] for artist, albums in batch}
+
+        with mock.patch(
+            "deneb.workers.artist_sync.fetch_artist_releases", new=_fetch
+        ), mock.patch("deneb.workers.artist_sync.store_artists_releases", new=_store):
+            albums_nr, updated_nr = await get_new_releases(AIOMock(), artists, True)
+
+        # stored every 4 albums, not all at the end
+        assert sorted(len(a) for a in stored) == [1, 2, 2]
+        assert (albums_nr, updated_nr) == (5, 5)
+
+
 class TestGetFeaturingSongs:
     @pytest.mark.asyncio
     async def test_fetches_featuring_songs(self):
+        ALBUM_TRACKS_CACHE.clear()
         sp = AIOMock()
         album = get_album(name="1")
-        sp.client.album_tracks.async_side_effect = [
-            {
-                "items": [
-                    get_track("1", artist_name="1"),
-                    get_track("2", artist_name="1"),
-                ],
-                "next": False,
-            }
-        ]
+        tracks = [get_track("1", artist_name="1"), get_track("2", artist_name="1")]
+        sp.client.albums.async_return_value = {
+            "albums": [{**album, "tracks": {"items": tracks, "next": None}}]
+        }
         artist = Artist(name="1", spotify_id=1)
         results = await get_featuring_songs(sp, artist, album)
 
         assert len(results) == 2
-        sp.client.album_tracks.assert_called_once_with(
-            album_id=artist.spotify_id, limit=50
-        )
+        sp.client.albums.assert_called_once_with([album["id"]])
 
         for key in ["release_date", "release_date_precision"]:
             for item in results:
                 assert key in item.keys()
+
+        # the album is fetched once for all artists featured on it
+        await get_featuring_songs(sp, artist, album)
+        assert sp.client.albums.call_count == 1
@@ -0,0 +1,85 @@
+# flake8: noqa
+import datetime
+from unittest import mock
+
+import pytest
+from aiomock import AIOMock
+
+from deneb.db import Artist
+from deneb.workers import release_discovery
+from deneb.workers.release_discovery import (
+    ReleasedBefore, discover_new_releases, fetch_market_releases, match_followed
+)
+from tests.unit.common import _mocked_call
+from tests.unit.fixtures.mocks import get_album
+
+_SINCE = datetime.date(2020, 5, 1)
+
+
+def _album(name, release_date, artists_ids, album_type="album"):
+    album = get_album(name)
+    album["release_date"] = release_date
+    album["album_type"] = album_type
+    album["artists"] = [{"id": a, "name": a} for a in artists_ids]
+    return album
+
+
+class TestReleasedBefore:
+    def test_stops_at_page_of_old_releases(self):
+        released_before = ReleasedBefore(_SINCE)
+        assert not released_before(
+            [_album("1", "2020-05-02", []), _album("2", "2020-04-01", [])]
+        )
+        assert released_before([_album("3", "2020-04-30", [])])
+
+
+class TestFetchMarketReleases:
+    @pytest.mark.asyncio
+    async def test_keeps_releases_since(self):
+        sp = AIOMock()
+        sp.client.new_releases.async_return_value = {
+            "albums": {
+                "items": [_album("1", "2020-05-02", []), _album("2", "2020-04-01", [])],
+                "next": None,
+            }
+        }
+        albums = await fetch_market_releases(sp, "RO", _SINCE)
+
+        assert [a["id"] for a in albums] == ["1"]
+        sp.client.new_releases.assert_called_once_with(country="RO", limit=50)
+
+
+class TestMatchFollowed:
+    def test_matches_every_followed_artist(self):
+        albums = [
+            _album("1", "2020-05-02", ["a", "b", "c"]),
+            _album("2", "2020-05-02", ["d"]),
+            _album("3", "2020-05-02", ["a"], album_type="compilation"),
+        ]
+        matches = match_followed(albums, {"a", "c"})
+        assert [(album["id"], artist) for album, artist in matches] == [
+            ("1", "a"),
+            ("1", "c"),
+        ]
+
+
+class TestDiscoverNewReleases:
+    @pytest.mark.asyncio
+    async def test_stores_followed_artists_releases(self):
+        album = _album("1", datetime.date.today().isoformat(), ["a", "z"])
+        artist = Artist(id=1, spotify_id="a")
+
+        with mock.patch.object(
+            Artist, "followed_spotify_ids", _mocked_call({"a"})
+        ), mock.patch.object(
+            release_discovery, "fetch_market_releases", _mocked_call([album])
+        ), mock.patch.object(
+            Artist, "filter", _mocked_call([artist])
+        ), mock.patch.object(
+            release_discovery, "store_releases", _mocked_call({1: ["new"]})
+        ) as store:
+            summary = await discover_new_releases(AIOMock(), ["RO", "MD"])
+
+        # the same album in both markets is stored once
+        store.assert_called_once_with(mock.ANY, [(album, artist)])
+        assert summary == {"releases": 1, "matched": 1, "albums": 1}
@@ -7,7 +7,7 @@ from aiomock import AIOMock
 from deneb.db import Artist
 from deneb.workers.user_sync import (
     check_follows, extract_lost_follows_artists, extract_new_follows_objects,
-    fetch_artists, sync_user_followed_artists
+    fetch_artists, follows_fingerprint, sync_user_followed_artists
 )
 from tests.unit.common import _mocked_call
 from tests.unit.fixtures.mocks import get_artist, sp_following
@@ -22,6 +22,15 @@ class TestFetchArtist:
         assert len(artists) == 2
 
 
+class TestFollowsFingerprint:
+    def test_same_set_same_fingerprint(self):
+        assert follows_fingerprint(["b", "a", "a"]) == follows_fingerprint(["a", "b"])
+
+    def test_counts_artists(self):
+        assert follows_fingerprint(["a", "b"]).startswith("2:")
+        assert follows_fingerprint(["a"]) != follows_fingerprint(["a", "b"])
+
+
 class TestExtractNewFollowsObjects:
     def test_one_exclude(self):
         followed_artists = [{"id": "stay"}, {"id": "stay2"}, {"id": "leave"}]
@@ -75,12 +84,28 @@ class TestCheckFollows:
         # if contains, list must be empty else the artist
         assert len([a for a in contains_follow if a == False]) == len(lost_follows)
 
+    @pytest.mark.asyncio
+    async def test_batches_keep_artists_order(self):
+        sp = AIOMock()
+        sp.client._get.async_side_effect = lambda url, type, ids: [
+            not a.endswith("0") for a in ids.split(",")
+        ]
+        artists = [Artist(spotify_id=f"id{idx}") for idx in range(120)]
+
+        lost_follows = await check_follows(sp, artists)
+
+        assert sp.client._get.call_count == 3
+        assert [a.spotify_id for a in lost_follows] == [
+            f"id{idx}" for idx in range(0, 120, 10)
+        ]
+
 
 class TestFetchUserFollowedArtists:
     @pytest.mark.asyncio
     async def test_no_follows(self):
         user = AIOMock()
         user.artists.filter.async_return_value = []
+        user.update_follows_fingerprint = _mocked_call()
         sp = AIOMock()
 
         with mock.patch(
@@ -94,7 +119,8 @@ class TestFetchUserFollowedArtists:
     async def test_one_add_follows(self):
         user = AIOMock()
         user.artists.filter = _mocked_call([])
-        user.artists.add = _mocked_call()
+        user.follow_artists = _mocked_call()
+        user.update_follows_fingerprint = _mocked_call()
         sp = AIOMock()
 
         artist = get_artist()
@@ -106,19 +132,52 @@ class TestFetchUserFollowedArtists:
                 mock_fetch_artists.async_return_value = [artist]
 
                 # mock model querying
-                db_artist = AIOMock()
-                mock_artist.filter = _mocked_call([])
-                mock_artist.create = _mocked_call([db_artist])
+                db_artist = Artist(id=7, name=artist["name"], spotify_id=artist["id"])
+                mock_artist.resolve_many = _mocked_call([db_artist])
 
                 new, lost = await sync_user_followed_artists(user, sp, False)
 
                 mock_fetch_artists.assert_called_once_with(sp)
-                assert user.artists.filter.call_count == 2
-                mock_artist.get.assert_called_once_with(spotify_id=artist["id"])
-                mock_artist.create.assert_called_once_with(
-                    name=artist["name"], spotify_id=artist["id"]
+                assert user.artists.filter.call_count == 1
+                mock_artist.resolve_many.assert_called_once_with([artist])
+                user.follow_artists.assert_called_once_with([7])
+                assert new == [db_artist]
+                user.update_follows_fingerprint.assert_called_once_with(
+                    follows_fingerprint([artist["id"]])
                 )
-                user.artists.add.assert_called_once_with([db_artist])
+
+    @pytest.mark.asyncio
+    async def test_dry_run_follows_nothing(self):
+        user = AIOMock()
+        user.artists.filter = _mocked_call([])
+        user.follow_artists = _mocked_call()
+
+        artist = get_artist()
+        with mock.patch(
+            "deneb.workers.user_sync.fetch_artists", new=_mocked_call([artist])
+        ), mock.patch.object(Artist, "resolve_many", _mocked_call([Artist(id=7)])):
+            new, lost = await sync_user_followed_artists(user, AIOMock(), True)
+
+        user.follow_artists.assert_not_called()
+        user.update_follows_fingerprint.assert_not_called()
+        assert len(new) == 1
+
+    @pytest.mark.asyncio
+    async def test_unchanged_follows_skip_diff(self):
+        artist = get_artist()
+        user = AIOMock(follows_fingerprint=follows_fingerprint([artist["id"]]))
+        user.artists.filter = _mocked_call([])
+        sp = AIOMock()
+
+        with mock.patch(
+            "deneb.workers.user_sync.fetch_artists", new=_mocked_call([artist])
+        ), mock.patch.object(Artist, "resolve_many", _mocked_call([])) as resolve:
+            new, lost = await sync_user_followed_artists(user, sp, False)
+
+        assert (new, lost) == ([], [])
+        user.artists.filter.assert_not_called()
+        resolve.assert_not_called()
+        sp.client._get.assert_not_called()
 
     @pytest.mark.asyncio
     async def test_one_lost_follows(self):
@@ -126,6 +185,7 @@ class TestFetchUserFollowedArtists:
         user = AIOMock()
         user.artists.filter = _mocked_call([db_artist])
         user.artists.remove = _mocked_call()
+        user.update_follows_fingerprint = _mocked_call()
         sp = AIOMock()
 
         with mock.patch(
@@ -138,10 +198,11 @@ class TestFetchUserFollowedArtists:
                     # mock data received from spotify
                     mock_check_follows.async_return_value = [db_artist]
                     mock_fetch_artists.async_return_value = []
+                    mock_artist.resolve_many = _mocked_call([])
 
                     new, lost = await sync_user_followed_artists(user, sp, False)
 
                     mock_fetch_artists.assert_called_once_with(sp)
-                    assert user.artists.filter.call_count == 2
+                    assert user.artists.filter.call_count == 1
                     mock_check_follows.assert_called_once_with(sp, [db_artist])
                     user.artists.remove.assert_called_once_with(db_artist)